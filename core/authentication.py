@@ -0,0 +1,155 @@
+"""
+Stateless signed auth tokens.
+
+A signed token carries the user id, its expiry and a random id, signed
+with the SECRET_KEY. Validating it needs no query in the common case:
+the users and the small list of revoked token ids are cached. Without a
+shared SIGNED_TOKENS['CACHE'], the other workers see a revocation once
+their cached list expires.
+"""
+import secrets
+import time
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.authentication import get_authorization_header
+from core.models import RevokedToken
+
+
+SALT = 'core.authentication.signed-token'
+
+REVOKED_KEY = 'signed-token:revoked'
+
+
+def _cache():
+    # Return the cache of the users and revoked tokens
+    return caches[settings.SIGNED_TOKENS['CACHE']]
+
+
+def _user_key(user_id):
+    return f'signed-token:user:{user_id}'
+
+
+def is_enabled():
+    # Return whether signed tokens are issued and accepted
+    return settings.SIGNED_TOKENS['ENABLED']
+
+
+def issue_token(user):
+    # Return a new signed token of the user and its expiry
+    expires = int(time.time()) + settings.SIGNED_TOKENS['MAX_AGE']
+    token = signing.dumps(
+        {'uid': user.pk, 'exp': expires, 'jti': secrets.token_hex(16)},
+        salt=SALT
+    )
+
+    return token, datetime.fromtimestamp(expires, tz=dt_timezone.utc)
+
+
+def verify_token(token):
+    # Return the payload of a valid signed token
+    try:
+        payload = signing.loads(token, salt=SALT)
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if payload['exp'] <= time.time():
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    if payload['jti'] in get_revoked():
+        raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+
+    return payload
+
+
+def get_revoked():
+    # Return the ids of the revoked tokens not expired yet
+    revoked = _cache().get(REVOKED_KEY)
+    if revoked is None:
+        revoked = set(RevokedToken.objects.filter(
+            expires_at__gt=timezone.now()
+        ).values_list('jti', flat=True))
+        _cache().set(
+            REVOKED_KEY,
+            revoked,
+            settings.SIGNED_TOKENS['REVOKED_CACHE_TIMEOUT']
+        )
+
+    return revoked
+
+
+def revoke_token(payload):
+    # Revoke a signed token until its expiry
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    RevokedToken.objects.get_or_create(
+        jti=payload['jti'],
+        defaults={'expires_at': datetime.fromtimestamp(
+            payload['exp'], tz=dt_timezone.utc
+        )}
+    )
+    _cache().delete(REVOKED_KEY)
+
+
+def get_user(user_id):
+    # Return the user of a token, cached until it changes
+    user = _cache().get(_user_key(user_id))
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            _cache().set(
+                _user_key(user_id),
+                user,
+                settings.SIGNED_TOKENS['USER_CACHE_TIMEOUT']
+            )
+
+    return user
+
+
+def forget_user(user_id):
+    # Drop the cached user after a change
+    _cache().delete(_user_key(user_id))
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticate the requests with a signed token
+    """
+    # Sent as "Authorization: Bearer <token>"
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        # Return the user and the token payload, None for other schemes
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if not is_enabled():
+            return None
+        if len(auth) != 2:
+            msg = _('Invalid token header.')
+            raise exceptions.AuthenticationFailed(msg)
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            msg = _('Invalid token header.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        return self.authenticate_credentials(token)
+
+    def authenticate_credentials(self, token):
+        # Return the user of a valid token
+        payload = verify_token(token)
+        user = get_user(payload['uid'])
+        if user is None or not user.is_active:
+            msg = _('User inactive or deleted.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        return user, payload
+
+    def authenticate_header(self, request):
+        # Scheme of the WWW-Authenticate header of the 401 responses
+        return self.keyword
@@ -0,0 +1,150 @@
+"""
+Online snapshots of the SQLite databases.
+
+The sqlite3 backup API copies a database a few pages per step. A step
+holds the lock of the source only while it runs, so the requests keep
+writing between the steps; a write of another connection makes SQLite
+restart the copy, which the report counts. Past max_restarts, the copy is
+redone in a single step, holding the lock of the source until it is done.
+The copy is consistent, unlike a copy of the file during a write.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Size of the chunks read for the compression and the checksums
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupReport:
+    """
+    Progress and lock timings of a backup
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.steps = 0
+        self.restarts = 0
+        self.duration = 0.0
+        # Time spent in the steps, when the databases are locked
+        self.lock_time = 0.0
+        self.max_lock_time = 0.0
+        # Whether the restarts made the copy fall back to a single step
+        self.single_step = False
+
+
+class TooManyRestarts(Exception):
+    """
+    Raised by the progress of a backup restarted too many times
+    """
+
+
+def backup(source, target, pages=-1, sleep=0.0, max_restarts=None):
+    # Copy the source connection to the target one, return a BackupReport
+    report = BackupReport()
+    remaining = None
+    step_start = start = time.monotonic()
+
+    def progress(status, pages_remaining, pages_total):
+        # Called after each step, with the locks released
+        nonlocal remaining, step_start
+        step_time = time.monotonic() - step_start
+        report.steps += 1
+        report.lock_time += step_time
+        report.max_lock_time = max(report.max_lock_time, step_time)
+        report.pages = pages_total
+        if remaining is not None and pages_remaining > remaining - pages:
+            # Another connection wrote to the source, the copy restarted
+            # instead of copying the next pages
+            report.restarts += 1
+            if max_restarts is not None and report.restarts > max_restarts:
+                # Aborts the backup, the pages copied are lost anyway
+                raise TooManyRestarts
+        remaining = pages_remaining
+        if sleep and pages_remaining:
+            # Let the writers in between the steps, the source is unlocked
+            time.sleep(sleep)
+        step_start = time.monotonic()
+
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    except TooManyRestarts:
+        # The writers would keep restarting the copy
+        report.single_step = True
+        remaining = None
+        step_start = time.monotonic()
+        source.backup(target, pages=-1, progress=progress)
+    report.duration = time.monotonic() - start
+    report.pages = report.pages or _page_count(target)
+
+    return report
+
+
+def _page_count(connection):
+    # Return the number of pages of a database
+    return connection.execute('PRAGMA page_count').fetchone()[0]
+
+
+def page_size(connection):
+    # Return the size in bytes of the pages of a database
+    return connection.execute('PRAGMA page_size').fetchone()[0]
+
+
+def file_sha256(path):
+    # Return the hex SHA-256 of a file
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def checksum_path(path):
+    # Return the path of the sha256sum file of a snapshot
+    return f'{path}.sha256'
+
+
+def write_checksum(path, digest):
+    # Store the checksum of a snapshot in the sha256sum format
+    with open(checksum_path(path), 'w') as output:
+        output.write(f'{digest}  {os.path.basename(path)}\n')
+
+
+def read_checksum(path):
+    # Return the stored checksum of a snapshot, None when there is none
+    try:
+        with open(checksum_path(path)) as file:
+            return file.read().split()[0]
+    except FileNotFoundError:
+        return None
+
+
+def is_gzip(path):
+    # Return whether a file is gzip compressed
+    with open(path, 'rb') as file:
+        return file.read(2) == GZIP_MAGIC
+
+
+def compress(source, target, level=6):
+    # Write the gzip compression of the source file to target
+    with open(source, 'rb') as file, \
+            gzip.open(target, 'wb', compresslevel=level) as output:
+        shutil.copyfileobj(file, output, CHUNK_SIZE)
+
+
+def decompress(source, target):
+    # Write the decompressed gzip source file to target
+    with gzip.open(source, 'rb') as file, open(target, 'wb') as output:
+        shutil.copyfileobj(file, output, CHUNK_SIZE)
+
+
+def connect(path):
+    # Open a database file outside of the Django connections
+    return sqlite3.connect(path, isolation_level=None)
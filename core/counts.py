@@ -0,0 +1,120 @@
+"""
+Counts of the paginated lists.
+
+Unfiltered lists are counted from the per-user counters of UserCounts,
+created with the users and kept by the signals; the users older than the
+counters get theirs from the backfill_user_counts command.
+Filtered lists are counted once and cached, keyed by their SQL and by a
+per-user generation bumped by every change of the user's objects.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db import router
+from django.db import transaction
+from django.db.models import F
+from core.models import Tag
+from core.models import Ingredient
+from core.models import Recipe
+from core.models import UserCounts
+
+
+COUNTED_MODELS = {
+    Recipe: 'recipes',
+    Tag: 'tags',
+    Ingredient: 'ingredients',
+}
+
+
+def _cache():
+    # Return the cache of the filtered counts
+    return caches[settings.COUNT_CACHE]
+
+
+def _generation_key(user_id):
+    return f'counts-generation:{user_id}'
+
+
+def get_user_count(user, field):
+    # Return the exact number of recipes, tags or ingredients of a user
+    count = UserCounts.objects.filter(user=user).values_list(
+        field,
+        flat=True
+    ).first()
+    if count is not None:
+        return count
+
+    # No counter yet, a read doesn't create it
+    model = {name: model for model, name in COUNTED_MODELS.items()}[field]
+
+    return model.objects.filter(user=user).count()
+
+
+def counts_database(user):
+    # Return the database of the counters of a user
+    return router.db_for_write(UserCounts, instance=user) or DEFAULT_DB_ALIAS
+
+
+def create_user_counts(users):
+    # Create the zeroed counters of new users
+    rows = {}
+    for user in users:
+        rows.setdefault(counts_database(user), []).append(
+            UserCounts(user_id=user.pk)
+        )
+    for using, counters in rows.items():
+        UserCounts.objects.using(using).bulk_create(
+            counters,
+            ignore_conflicts=True
+        )
+
+
+def fill_user_counts(user):
+    # Store the exact counts of a user. The counter is created first, so the
+    # signals of the changes committed meanwhile update it
+    using = counts_database(user)
+    UserCounts.objects.using(using).get_or_create(user=user)
+    with transaction.atomic(using=using):
+        counter = UserCounts.objects.using(using).filter(user=user)
+        # Written before the counts: the write takes the row lock, and the
+        # database lock on SQLite which has no select_for_update, so no
+        # change commits between the counts and their store
+        counter.update(recipes=F('recipes'))
+        counter.update(**{
+            name: model.objects.using(using).filter(user=user).count()
+            for model, name in COUNTED_MODELS.items()
+        })
+
+
+def add_to_user_count(user_id, model, delta, using=None):
+    # Add delta to the counter of the model, if the user has counters
+    UserCounts.objects.db_manager(using).filter(user_id=user_id).update(
+        **{COUNTED_MODELS[model]: F(COUNTED_MODELS[model]) + delta}
+    )
+
+
+def get_cached_count(user_id, queryset):
+    # Return the count of a filtered queryset, cached until the user changes
+    cache = _cache()
+    generation = cache.get(_generation_key(user_id), 0)
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.sha1(f'{sql}:{params!r}'.encode()).hexdigest()
+    key = f'counts:{user_id}:{generation}:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+
+    return count
+
+
+def invalidate_cached_counts(user_id):
+    # Start a new generation of the cached counts of a user
+    cache = _cache()
+    key = _generation_key(user_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
@@ -0,0 +1,209 @@
+"""
+Per-user change notifications.
+
+Changes of recipes, tags and ingredients are published once committed to
+the broker of the process, which fans them out to the change feed
+connections of their user. The backend carries the events between the
+processes: LocalBackend only reaches the connections of the publishing
+process, DatabaseBackend stores the events in the default database and
+every process serving the feed polls them.
+"""
+import asyncio
+import logging
+import threading
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from core.models import ChangeEvent
+
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+IMAGE_READY = 'image_ready'
+
+# Events queued by a connection before it is asked to resync
+MAX_PENDING_EVENTS = 100
+
+
+class Subscription:
+    """
+    Events of a user queued for one feed connection
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.overflowed = False
+
+    def put(self, event):
+        # Queue an event, on the loop of the connection
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client lost events and must resync
+            self.overflowed = True
+
+
+class Broker:
+    """
+    In-process pub/sub of the events of the users
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def subscribe(self, user_id):
+        # Return a new subscription, from the event loop of the feed
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            start = not self._started
+            self._started = True
+        if start:
+            self.backend.start(self)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        # Remove the subscription of a closed connection
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id, ())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, user_id, event):
+        # Send an event to the connections of the user of every process
+        self.backend.publish(self, user_id, event)
+
+    def deliver(self, user_id, event):
+        # Send an event to the connections of the user in this process
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+
+class LocalBackend:
+    """
+    Deliver the events to the feed connections of the same process
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def start(self, broker):
+        # Called on the event loop of the first subscription
+        pass
+
+    def publish(self, broker, user_id, event):
+        # Deliver right away, the feed may be served by this process
+        broker.deliver(user_id, event)
+
+
+class DatabaseBackend(LocalBackend):
+    """
+    Deliver the events through the database to the feeds of every process
+    """
+
+    def start(self, broker):
+        asyncio.ensure_future(self._poll(broker))
+
+    def publish(self, broker, user_id, event):
+        # Store the event for the pollers of every process
+        ChangeEvent.objects.create(user_id=user_id, payload=event)
+
+    async def _poll(self, broker):
+        # Deliver the new events, one query per interval for all connections
+        last_id = await sync_to_async(self._last_id)()
+        while True:
+            await asyncio.sleep(self.options['POLL_INTERVAL'])
+            try:
+                events = await sync_to_async(self._fetch)(last_id)
+            except Exception:
+                logger.warning('Change events unavailable', exc_info=True)
+                continue
+            for event_id, user_id, payload in events:
+                broker.deliver(user_id, payload)
+                last_id = event_id
+
+    def _last_id(self):
+        # Return the id of the last stored event, older ones are not sent
+        try:
+            return ChangeEvent.objects.order_by('-id').values_list(
+                'id', flat=True
+            ).first() or 0
+        finally:
+            close_old_connections()
+
+    def _fetch(self, last_id):
+        # Return the events after last_id, dropping the old ones
+        try:
+            ChangeEvent.objects.filter(
+                created_at__lt=timezone.now() - timedelta(
+                    seconds=self.options['RETENTION']
+                )
+            ).delete()
+            return list(ChangeEvent.objects.filter(
+                id__gt=last_id
+            ).order_by('id').values_list('id', 'user_id', 'payload'))
+        finally:
+            close_old_connections()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def is_enabled():
+    # Return whether the changes are published and the feed served
+    return settings.EVENTS['ENABLED']
+
+
+def get_broker():
+    # Return the broker of the process, created on first use
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            backend_class = import_string(settings.EVENTS['BACKEND'])
+            _broker = Broker(backend_class(settings.EVENTS))
+
+    return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    # Use the new backend after a change of the settings, e.g. in tests
+    global _broker
+    if setting == 'EVENTS':
+        _broker = None
+
+
+def publish_change(user_id, event, model, object_id, using=None):
+    # Publish a change of an object once its transaction is committed
+    if not is_enabled():
+        return
+
+    payload = {'event': event, 'model': model, 'id': object_id}
+    transaction.on_commit(lambda: _publish(user_id, payload), using=using)
+
+
+def _publish(user_id, payload):
+    # The change is committed, a lost notification must not fail it
+    try:
+        get_broker().publish(user_id, payload)
+    except Exception:
+        logger.warning('Change event not published', exc_info=True)
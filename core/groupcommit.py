@@ -0,0 +1,154 @@
+"""
+Group commit of the short writes of concurrent requests.
+
+SQLite lets a single transaction write at a time, so concurrent creates
+queue on the database lock and fail with "database is locked" under
+bursts. With GROUP_COMMIT enabled the writes are handed to one writer
+thread per database which runs them in batched transactions, each write
+in its own savepoint so a failing write doesn't affect the others.
+"""
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from django.db import router
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Write:
+    """
+    Write queued for the writer with the future of its result
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        # Run with the context of the request, e.g. its shard
+        self.context = contextvars.copy_context()
+        self.future = Future()
+
+
+class Writer:
+    """
+    Single thread committing the queued writes of a database in batches
+    """
+
+    def __init__(self, using, max_batch, max_delay):
+        self.using = using
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f'group-commit-{using}',
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, fn):
+        # Queue fn, return the future of its result
+        write = _Write(fn)
+        self._queue.put(write)
+        return write.future
+
+    def _next_batch(self):
+        # Wait for a write, then gather the writes queued until the deadline
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        # Commit the batches until the process exits
+        while True:
+            self._commit(self._next_batch())
+
+    def _commit(self, batch):
+        # Run the writes of a batch in one transaction
+        results = []
+        connection = connections[self.using]
+        try:
+            with transaction.atomic(using=self.using):
+                for write in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            result = write.context.run(write.fn)
+                    except Exception as exc:
+                        results.append((write, None, exc))
+                    else:
+                        results.append((write, result, None))
+                # Taken out of the transaction, so a failing hook can't
+                # look like a failed commit once the writes are stored
+                hooks = [entry[1] for entry in connection.run_on_commit]
+                connection.run_on_commit = []
+        except Exception as exc:
+            # The commit failed, none of the writes were stored
+            for write in batch:
+                write.future.set_exception(exc)
+            connection.close_if_unusable_or_obsolete()
+            return
+
+        for write, result, exc in results:
+            if exc is None:
+                write.future.set_result(result)
+            else:
+                write.future.set_exception(exc)
+        for hook in hooks:
+            try:
+                hook()
+            except Exception:
+                logger.exception('Group commit hook %r failed', hook)
+        connection.close_if_unusable_or_obsolete()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def is_enabled():
+    # Return whether the writes are group committed
+    return settings.GROUP_COMMIT['ENABLED']
+
+
+def get_writer(using=DEFAULT_DB_ALIAS):
+    # Return the writer of a database, started on first use
+    with _writers_lock:
+        writer = _writers.get(using)
+        if writer is None:
+            writer = _writers[using] = Writer(
+                using,
+                max_batch=settings.GROUP_COMMIT['MAX_BATCH'],
+                max_delay=settings.GROUP_COMMIT['MAX_DELAY'],
+            )
+
+    return writer
+
+
+def run(fn, using=DEFAULT_DB_ALIAS):
+    # Run fn in a group committed transaction and return its result
+    if not is_enabled() or connections[using].in_atomic_block:
+        # A write of an outer transaction can't be committed by the writer
+        return fn()
+
+    return get_writer(using).submit(fn).result()
+
+
+def save(serializer, **kwargs):
+    # Save a model serializer through the writer of the database of its model
+    using = router.db_for_write(serializer.Meta.model) or DEFAULT_DB_ALIAS
+    return run(lambda: serializer.save(**kwargs), using=using)
@@ -0,0 +1,60 @@
+"""
+Id lists of the query parameters.
+
+The lists are validated and bounded. Long lists are passed to the
+database as a single parameter, a JSON array read by json_each on SQLite
+or an array on PostgreSQL, instead of one bound parameter per id.
+"""
+import json
+import re
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+
+
+# Positive ids, at most 18 digits so they fit in a 64-bit integer
+_ID = re.compile(r'[1-9]\d{0,17}', re.ASCII)
+
+
+def parse_id_list(value, name, max_ids=None):
+    # Return the distinct ids of a comma separated parameter, in order
+    if max_ids is None:
+        max_ids = settings.ID_LIST_MAX_IDS
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    if len(parts) > max_ids:
+        raise ValidationError({name: [
+            f'Ensure there are no more than {max_ids} ids.'
+        ]})
+    for part in parts:
+        if not _ID.fullmatch(part):
+            raise ValidationError({name: [f'"{part}" is not a valid id.']})
+
+    return list(dict.fromkeys(int(part) for part in parts))
+
+
+def id_list_subquery(vendor, ids):
+    # Return a subquery of the ids in one parameter, None if unsupported
+    if vendor == 'sqlite':
+        return RawSQL('SELECT value FROM json_each(%s)', (json.dumps(ids),))
+    if vendor == 'postgresql':
+        return RawSQL('SELECT unnest(%s::bigint[])', (ids,))
+
+    return None
+
+
+def filter_in_parameter(queryset, field, ids):
+    # Filter field__in ids with the ids in a single parameter
+    subquery = id_list_subquery(connections[queryset.db].vendor, ids)
+    if subquery is None:
+        return queryset.filter(**{f'{field}__in': ids})
+
+    return queryset.filter(**{f'{field}__in': subquery})
+
+
+def filter_in(queryset, field, ids):
+    # Filter field__in ids, short lists stay inline for the query planner
+    if len(ids) <= settings.ID_LIST_INLINE_MAX:
+        return queryset.filter(**{f'{field}__in': ids})
+
+    return filter_in_parameter(queryset, field, ids)
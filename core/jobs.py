@@ -0,0 +1,206 @@
+"""
+Durable local job queue.
+
+Jobs are rows of the project database, enqueued in the transaction of the
+request that creates them, and run by the threads or processes of the
+run_workers command. Workers claim a job with a conditional update, so no
+row locking is needed and SQLite is enough.
+"""
+from datetime import timedelta
+import logging
+import threading
+import time
+import traceback
+from django.conf import settings
+from django.db import OperationalError
+from django.db import close_old_connections
+from django.db import connection
+from django.db.models import Avg
+from django.db.models import Count
+from django.db.models import DurationField
+from django.db.models import ExpressionWrapper
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from core.models import Job
+
+
+logger = logging.getLogger(__name__)
+
+LANE_NAMES = dict(Job.LANE_CHOICES)
+
+LANES = {name: value for value, name in Job.LANE_CHOICES}
+
+
+def task_path(task):
+    # Return the dotted path of a task given as a function or a path
+    if isinstance(task, str):
+        return task
+
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, args=(), kwargs=None, lane=Job.DEFAULT,
+            idempotency_key=None, max_attempts=3, delay=0):
+    # Queue a task, a job with the same idempotency key is returned as is
+    fields = {
+        'task': task_path(task),
+        'args': list(args),
+        'kwargs': kwargs or {},
+        'lane': lane,
+        'max_attempts': max_attempts,
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+    if idempotency_key is None:
+        return Job.objects.create(**fields)
+
+    job, _ = Job.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults=fields
+    )
+
+    return job
+
+
+def claim_job(lanes):
+    # Mark the next due job of the lanes as running and return it
+    now = timezone.now()
+    candidates = Job.objects.filter(
+        status=Job.QUEUED,
+        lane__in=lanes,
+        run_at__lte=now
+    ).order_by('lane', 'run_at', 'id').values_list('id', flat=True)[:10]
+    for pk in candidates:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            started_at=now,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+
+    return None
+
+
+def run_job(job):
+    # Run a claimed job, retry it later with a backoff when it fails
+    try:
+        import_string(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.pk, job.task)
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'run_at', 'finished_at', 'last_error'
+    ])
+
+
+def requeue_stale_jobs(timeout):
+    # Queue again the jobs left running by a worker that died, the jobs out
+    # of attempts fail instead, they may be the ones killing the workers
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=now - timedelta(seconds=timeout)
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        finished_at=now,
+        last_error='The worker stopped while running the job.'
+    )
+    if failed:
+        logger.error('%s stale jobs out of attempts failed', failed)
+
+    return stale.update(status=Job.QUEUED)
+
+
+def purge_finished_jobs(age):
+    # Delete the done jobs older than age seconds
+    cutoff = timezone.now() - timedelta(seconds=age)
+    deleted, _ = Job.objects.filter(
+        status=Job.DONE,
+        finished_at__lt=cutoff
+    ).delete()
+
+    return deleted
+
+
+def queue_stats():
+    # Return the depth and the average wait of every lane
+    stats = {name: {
+        Job.QUEUED: 0, Job.RUNNING: 0, Job.FAILED: 0, 'latency': None
+    } for name in LANES}
+    depths = Job.objects.exclude(status=Job.DONE).values(
+        'lane', 'status'
+    ).annotate(total=Count('id'))
+    for row in depths:
+        stats[LANE_NAMES[row['lane']]][row['status']] = row['total']
+    latencies = Job.objects.filter(started_at__isnull=False).values(
+        'lane'
+    ).annotate(latency=Avg(ExpressionWrapper(
+        F('started_at') - F('created_at'),
+        output_field=DurationField()
+    )))
+    for row in latencies:
+        stats[LANE_NAMES[row['lane']]]['latency'] = row['latency']
+
+    return stats
+
+
+class Worker(threading.Thread):
+    """
+    Thread running the jobs of some lanes until it is stopped
+    """
+
+    def __init__(self, lanes, stop_event, once=False):
+        super().__init__(daemon=True)
+        self.lanes = lanes
+        self.stop_event = stop_event
+        self.once = once
+        self.next_stale_check = (
+            time.monotonic() + settings.JOB_STALE_CHECK_INTERVAL
+        )
+
+    def requeue_stale_jobs(self):
+        # Queue again the jobs of dead workers, every JOB_STALE_CHECK_INTERVAL
+        now = time.monotonic()
+        if now < self.next_stale_check:
+            return
+        self.next_stale_check = now + settings.JOB_STALE_CHECK_INTERVAL
+        requeued = requeue_stale_jobs(settings.JOB_STALE_TIMEOUT)
+        if requeued:
+            logger.warning('Requeued %s stale jobs', requeued)
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                try:
+                    self.requeue_stale_jobs()
+                    job = claim_job(self.lanes)
+                    if job is not None:
+                        run_job(job)
+                except OperationalError:
+                    # The database is locked by another writer
+                    logger.warning('Job queue unavailable', exc_info=True)
+                    job = None
+                except Exception:
+                    # E.g. the save of a finished job failed, the job is
+                    # queued again once stale, the thread keeps running
+                    logger.exception('Job worker error')
+                    self.stop_event.wait(settings.JOB_POLL_INTERVAL)
+                    continue
+                if job is None:
+                    if self.once:
+                        break
+                    self.stop_event.wait(settings.JOB_POLL_INTERVAL)
+        finally:
+            connection.close()
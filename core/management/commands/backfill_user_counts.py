@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from core import counts
+from core.models import UserCounts
+
+
+class Command(BaseCommand):
+    """
+    Create the counters of the users older than the counters
+    """
+    help = (
+        'Count the recipes, tags and ingredients of the users without '
+        'counters and store them, the signals keep them up to date. Use '
+        '--all to count every user again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Count again the users having counters.'
+        )
+
+    def handle(self, *args, **options):
+        filled = 0
+        for user in get_user_model().objects.order_by('pk').iterator():
+            using = counts.counts_database(user)
+            if not options['all'] and UserCounts.objects.using(using).filter(
+                user=user
+            ).exists():
+                continue
+            counts.fill_user_counts(user)
+            filled += 1
+
+        self.stdout.write(f'Counted {filled} users')
@@ -0,0 +1,121 @@
+import json
+import subprocess
+import sys
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Run in a fresh interpreter, so nothing is imported or built beforehand
+PROBE_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+from django.conf import settings
+from django.test import Client
+from drf_advance.warmup import warm_up
+warm_up_time = 0.0
+if {warm_up!r}:
+    start = time.perf_counter()
+    warm_up(force=True)
+    warm_up_time = time.perf_counter() - start
+client = Client(HTTP_HOST='localhost')
+requests = []
+for path in {paths!r}:
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        client.get(path)
+        timings.append(time.perf_counter() - start)
+    requests.append([path] + timings)
+json.dump(
+    {{'setup': setup, 'warm_up': warm_up_time, 'requests': requests}},
+    sys.stdout
+)
+'''
+
+
+def parse_import_times(output):
+    # Parse the -X importtime report in (module, self us, cumulative us)
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((
+            fields[2].strip(),
+            int(fields[0]),
+            int(fields[1]),
+        ))
+
+    return modules
+
+
+class Command(BaseCommand):
+    """
+    Report the cold start cost of a new worker
+    """
+    help = (
+        'Start fresh interpreters to report the slowest imports and the '
+        'latency of the first requests, with and without the warm-up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='URL requested after the start, can be repeated.'
+        )
+        parser.add_argument(
+            '--top', type=int, default=15,
+            help='Number of modules listed by cumulative import time.'
+        )
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or [
+            '/api/recipe/recipes/',
+            '/api/user/me/',
+        ]
+        for warm_up in (False, True):
+            report, import_output = self._probe(paths, warm_up)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                'With warm-up' if warm_up else 'Without warm-up'
+            ))
+            self.stdout.write(
+                f'  django.setup(): {report["setup"] * 1000:.1f}ms'
+            )
+            if warm_up:
+                self.stdout.write(
+                    f'  warm-up: {report["warm_up"] * 1000:.1f}ms'
+                )
+            for path, first, second in report['requests']:
+                self.stdout.write(
+                    f'  GET {path}: first {first * 1000:.1f}ms, '
+                    f'second {second * 1000:.1f}ms'
+                )
+
+        modules = parse_import_times(import_output)
+        total = sum(self_us for _, self_us, _ in modules)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Imports ({len(modules)} modules, {total / 1000:.1f}ms)'
+        ))
+        modules.sort(key=lambda module: module[2], reverse=True)
+        for name, self_us, cumulative_us in modules[:options['top']]:
+            self.stdout.write(
+                f'  {cumulative_us / 1000:8.1f}ms {self_us / 1000:8.1f}ms  '
+                f'{name}'
+            )
+
+    def _probe(self, paths, warm_up):
+        # Run the probe script, return its report and the import times
+        script = PROBE_SCRIPT.format(paths=paths, warm_up=warm_up)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        return json.loads(result.stdout), result.stderr
@@ -0,0 +1,136 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+from core.models import Tag
+from core.models import Ingredient
+from core.models import Recipe
+from core.models import normalize_name
+from core.signals import touch_recipes
+from recipe import cards
+
+
+MERGED_MODELS = (
+    (Tag, Recipe.tags.through, 'tag'),
+    (Ingredient, Recipe.ingredients.through, 'ingredient'),
+)
+
+CHUNK_SIZE = 500
+
+
+def chunks(items, size=CHUNK_SIZE):
+    # Split a list for the bound parameters limit of SQLite
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    """
+    Merge the tags and ingredients of a user having the same name
+    """
+    help = (
+        'Merge the tags and ingredients of a user with the same normalized '
+        'name into the oldest one, move their recipes to it and fill the '
+        'normalized names of the older rows.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            help='Alias of the database, all the user data by default.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the duplicates.'
+        )
+
+    def handle(self, *args, **options):
+        if options['database']:
+            aliases = [options['database']]
+        else:
+            aliases = settings.SHARD_DATABASES or [DEFAULT_DB_ALIAS]
+
+        for alias in aliases:
+            for model, through, field in MERGED_MODELS:
+                with transaction.atomic(using=alias):
+                    merged, normalized = self._merge(
+                        model, through, field, alias, options['dry_run']
+                    )
+                self.stdout.write(
+                    f'{alias}: {merged} duplicate '
+                    f'{model._meta.verbose_name_plural} merged, '
+                    f'{normalized} names normalized'
+                )
+
+    def _merge(self, model, through, field, alias, dry_run):
+        # Merge the duplicates of a model, return the merged and fixed counts
+        groups = {}
+        rows = model.objects.using(alias).order_by('pk').values_list(
+            'pk', 'user_id', 'name', 'normalized_name'
+        )
+        for pk, user_id, name, normalized in rows.iterator():
+            groups.setdefault(
+                (user_id, normalize_name(name)), []
+            ).append((pk, normalized))
+
+        duplicates = {}
+        stale = []
+        for (_, normalized), members in groups.items():
+            kept, kept_normalized = members[0]
+            if kept_normalized != normalized:
+                stale.append(model(pk=kept, normalized_name=normalized))
+            for pk, _ in members[1:]:
+                duplicates[pk] = kept
+
+        if dry_run:
+            return len(duplicates), len(stale)
+
+        if duplicates:
+            self._relink(through, field, duplicates, alias)
+            for pks in chunks(duplicates):
+                model.objects.using(alias).filter(pk__in=pks).delete()
+        model.objects.using(alias).bulk_update(
+            stale, ['normalized_name'], batch_size=CHUNK_SIZE
+        )
+
+        return len(duplicates), len(stale)
+
+    def _relink(self, through, field, duplicates, alias):
+        # Point the relations of the duplicates to the kept objects
+        attname = f'{field}_id'
+        links = set()
+        for pks in chunks(set(duplicates.values())):
+            links.update(through.objects.using(alias).filter(
+                **{f'{attname}__in': pks}
+            ).values_list('recipe_id', attname))
+
+        moved = []
+        dropped = []
+        recipes = set()
+        for pks in chunks(duplicates):
+            rows = through.objects.using(alias).filter(
+                **{f'{attname}__in': pks}
+            ).values_list('pk', 'recipe_id', attname)
+            for pk, recipe_id, value in rows:
+                recipes.add(recipe_id)
+                link = (recipe_id, duplicates[value])
+                if link in links:
+                    # The recipe already has the kept object
+                    dropped.append(pk)
+                else:
+                    links.add(link)
+                    moved.append(through(
+                        pk=pk, recipe_id=recipe_id,
+                        **{attname: duplicates[value]}
+                    ))
+
+        through.objects.using(alias).bulk_update(
+            moved, [field], batch_size=CHUNK_SIZE
+        )
+        for pks in chunks(dropped):
+            through.objects.using(alias).filter(pk__in=pks).delete()
+        for pks in chunks(recipes):
+            touch_recipes(alias, pk__in=pks)
+            if cards.is_enabled():
+                cards.refresh_cards(pks, alias)
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+from core import sharding
+from core.models import Recipe
+from core.models import Tombstone
+from core.signals import USER_DATA_MODELS
+from core.signals import delete_user_data
+
+
+RELATIONS = (
+    (Recipe.tags.through, 'tag_id'),
+    (Recipe.ingredients.through, 'ingredient_id'),
+)
+
+
+class Command(BaseCommand):
+    """
+    Move the data of a user to another shard
+    """
+    help = (
+        'Move the recipes, tags and ingredients of a user to another shard. '
+        'Writes of the user during the move are lost and pending resumable '
+        'uploads are dropped, run it while the user is inactive.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('shard', help='Alias of the target database.')
+
+    def handle(self, *args, **options):
+        target = options['shard']
+        if not sharding.is_enabled():
+            raise CommandError('Sharding is disabled, set SHARD_DATABASES')
+        if target not in settings.SHARD_DATABASES:
+            raise CommandError(f'Unknown shard {target!r}')
+        user_model = get_user_model()
+        try:
+            user = user_model.objects.using(DEFAULT_DB_ALIAS).get(
+                email=user_model.objects.normalize_email(options['email'])
+            )
+        except user_model.DoesNotExist:
+            raise CommandError('Unknown user')
+        source = sharding.shard_for_user(user)
+        if source == target:
+            self.stdout.write(f'{user.email} is already on {target}')
+            return
+
+        sharding.mirror_user(user, target)
+        with transaction.atomic(using=target):
+            # Leftovers of an interrupted move
+            delete_user_data(user, target)
+            copied = self._copy_user_data(user, source, target)
+
+        user.shard = target
+        user.save(update_fields=['shard'])
+        with transaction.atomic(using=source):
+            delete_user_data(user, source)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {copied} rows of {user.email} from {source} to {target}'
+        ))
+
+    def _copy_user_data(self, user, source, target):
+        # Copy the rows of a user between databases, return the row count
+        copied = 0
+        for model in USER_DATA_MODELS:
+            rows = list(model.objects.using(source).filter(user=user))
+            if model is Tombstone:
+                # Tombstone ids are local to each shard
+                for row in rows:
+                    row.pk = None
+            model.objects.using(target).bulk_create(rows, batch_size=500)
+            copied += len(rows)
+
+        for through, field in RELATIONS:
+            pairs = through.objects.using(source).filter(
+                recipe__user=user
+            ).values_list('recipe_id', field)
+            rows = [
+                through(recipe_id=recipe_id, **{field: value})
+                for recipe_id, value in pairs
+            ]
+            through.objects.using(target).bulk_create(rows, batch_size=500)
+            copied += len(rows)
+
+        return copied
@@ -0,0 +1,145 @@
+import csv
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hashers_by_algorithm
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from core import counts
+from core import sharding
+
+
+def _hash_password(args):
+    # Hash a password, run inside the pool workers
+    password, hasher = args
+    return make_password(password, hasher=hasher)
+
+
+def _chunks(iterable, size):
+    # Yield lists of at most size elements
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    """
+    Create users and their auth tokens in bulk from a CSV file
+    """
+    help = (
+        'Create users from a CSV file with email, password and an optional '
+        'name column. Passwords are hashed in a process pool and rows are '
+        'inserted in chunks, existing emails are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Users hashed and inserted per batch.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Hashing processes, 1 hashes in this process. '
+                 'Defaults to the number of CPUs.'
+        )
+        parser.add_argument(
+            '--hasher', default='default',
+            help='Algorithm of a hasher from PASSWORD_HASHERS, e.g. a '
+                 'cheaper one for test and staging data.'
+        )
+        parser.add_argument(
+            '--no-tokens', action='store_true',
+            help="Don't create the auth tokens."
+        )
+
+    def handle(self, *args, **options):
+        hasher = options['hasher']
+        if hasher != 'default' and hasher not in get_hashers_by_algorithm():
+            raise CommandError(
+                f'Unknown hasher {hasher!r}, it must be in PASSWORD_HASHERS'
+            )
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        executor = None
+        if options['workers'] != 1:
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                initializer=django.setup
+            )
+
+        created = skipped = 0
+        start = time.monotonic()
+        try:
+            with open(options['csv_file'], newline='') as csv_file:
+                rows = csv.DictReader(csv_file)
+                for chunk in _chunks(rows, options['chunk_size']):
+                    inserted = self._provision_chunk(
+                        chunk, hasher, executor, not options['no_tokens']
+                    )
+                    created += inserted
+                    skipped += len(chunk) - inserted
+                    elapsed = time.monotonic() - start
+                    self.stdout.write(
+                        f'{created} users created, {skipped} skipped '
+                        f'({created / elapsed:.0f} users/s)'
+                    )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} users in {elapsed:.1f}s, skipped {skipped}'
+        ))
+
+    def _provision_chunk(self, rows, hasher, executor, with_tokens):
+        # Hash and insert a chunk of rows, return the number of new users
+        user_model = get_user_model()
+        users = {}
+        for row in rows:
+            email = user_model.objects.normalize_email(
+                (row.get('email') or '').strip()
+            )
+            if email and row.get('password'):
+                users.setdefault(email, row)
+        existing = set(user_model.objects.filter(
+            email__in=users
+        ).values_list('email', flat=True))
+        for email in existing:
+            del users[email]
+        if not users:
+            return 0
+
+        jobs = [(row['password'], hasher) for row in users.values()]
+        if executor is None:
+            hashes = map(_hash_password, jobs)
+        else:
+            hashes = executor.map(_hash_password, jobs, chunksize=64)
+        new_users = [
+            user_model(email=email, name=row.get('name') or '', password=pw)
+            for (email, row), pw in zip(users.items(), hashes)
+        ]
+
+        with transaction.atomic():
+            user_model.objects.bulk_create(new_users)
+            # SQLite doesn't return the ids of the bulk created rows
+            created = list(user_model.objects.filter(email__in=users))
+            if with_tokens:
+                Token.objects.bulk_create([
+                    Token(key=Token.generate_key(), user_id=user.pk)
+                    for user in created
+                ])
+            if sharding.is_enabled():
+                sharding.mirror_users(created)
+            counts.create_user_counts(created)
+
+        return len(new_users)
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from core import querylog
+from core.models import QueryStat
+
+
+class Command(BaseCommand):
+    """
+    Report the timings of the sampled queries
+    """
+    help = (
+        'Print the query fingerprints with the highest timings, recorded '
+        'while QUERY_LOG is enabled.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--order', choices=sorted(querylog.ORDERINGS), default='total',
+            help='Sort by total time, max time, calls or slow calls.'
+        )
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument(
+            '--plans', action='store_true',
+            help='Print the query plan of the slow queries.'
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Delete the recorded timings.'
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = QueryStat.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} query stats')
+            return
+        if options['limit'] < 1:
+            raise CommandError('--limit must be at least 1.')
+
+        for stat in querylog.top_stats(options['order'], options['limit']):
+            self.stdout.write(
+                f'{stat.total_time:10.1f} ms total  '
+                f'{stat.total_time / stat.calls:8.2f} ms avg  '
+                f'{stat.max_time:8.1f} ms max  '
+                f'{stat.calls} calls  {stat.slow_calls} slow  '
+                f'{stat.origin}'
+            )
+            self.stdout.write(f'    {stat.sql}')
+            if options['plans'] and stat.plan:
+                for line in stat.plan.splitlines():
+                    self.stdout.write(f'    | {line}')
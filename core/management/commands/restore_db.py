@@ -0,0 +1,84 @@
+import os
+import tempfile
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from core import backups
+
+
+class Command(BaseCommand):
+    """
+    Replace the content of a SQLite database with a snapshot
+    """
+    help = (
+        'Restore a snapshot of snapshot_db into a SQLite database with the '
+        'online backup API, after checking its integrity and its SHA-256 '
+        'when INPUT.sha256 exists. Gzipped snapshots are decompressed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='Path of the snapshot file.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false',
+            dest='interactive',
+            help='Do not prompt for confirmation.'
+        )
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        connection = connections[alias]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Snapshots are only supported on SQLite')
+
+        path = options['input']
+        if not os.path.exists(path):
+            raise CommandError(f'No snapshot at {path}')
+        expected = backups.read_checksum(path)
+        if expected is not None and backups.file_sha256(path) != expected:
+            raise CommandError(f'Checksum mismatch of {path}')
+
+        if options['interactive']:
+            confirm = input(
+                f'This replaces all the data of the {alias!r} database with '
+                f'{path}.\nType \'yes\' to continue, or \'no\' to cancel: '
+            )
+            if confirm != 'yes':
+                raise CommandError('Restore cancelled.')
+
+        with tempfile.TemporaryDirectory() as directory:
+            if backups.is_gzip(path):
+                source_path = os.path.join(directory, 'snapshot.sqlite3')
+                backups.decompress(path, source_path)
+            else:
+                source_path = path
+            source = backups.connect(source_path)
+            try:
+                result = source.execute('PRAGMA integrity_check').fetchone()
+                if result[0] != 'ok':
+                    raise CommandError(
+                        f'Snapshot {path} is corrupted: {result[0]}'
+                    )
+                connection.ensure_connection()
+                # The target stays locked for the whole copy, a single step
+                # keeps the writers waiting the least
+                report = backups.backup(source, connection.connection)
+                size = report.pages * backups.page_size(source)
+            finally:
+                source.close()
+
+        # Cached counts and users of the old data
+        for cache_alias in settings.CACHES:
+            caches[cache_alias].clear()
+
+        throughput = size / max(report.duration, 1e-6) / (1024 * 1024)
+        self.stdout.write(
+            f'{alias}: {report.pages} pages, '
+            f'{size / (1024 * 1024):.1f} MB in {report.duration:.2f} s '
+            f'({throughput:.1f} MB/s)'
+        )
+        self.stdout.write(
+            f'Database locked {report.lock_time * 1000:.1f} ms'
+        )
@@ -0,0 +1,111 @@
+import multiprocessing
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from core import jobs
+
+
+def _run_threads(lanes, threads, once, stop_event=None):
+    # Run worker threads until they are stopped, or idle with once
+    stop_event = stop_event or threading.Event()
+    workers = [jobs.Worker(lanes, stop_event, once) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        while worker.is_alive():
+            worker.join(timeout=0.5)
+
+
+def _run_process(lanes, threads, once):
+    # Entry point of the worker processes
+    import django
+
+    django.setup()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    _run_threads(lanes, threads, once, stop_event)
+
+
+class Command(BaseCommand):
+    """
+    Run the jobs of the local job queue
+    """
+    help = (
+        'Run the queued jobs with a pool of threads, optionally in several '
+        'processes. Use --stats to print the queue depth and latency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=settings.JOB_WORKER_THREADS,
+            help='Worker threads of each process.'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Worker processes, 1 runs the threads in this process.'
+        )
+        parser.add_argument(
+            '--lanes', default=','.join(jobs.LANES),
+            help='Comma separated lanes to run, in priority order.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once there are no due jobs.'
+        )
+        parser.add_argument(
+            '--stats', action='store_true',
+            help='Print the depth and latency of the lanes and exit.'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            return self._print_stats()
+
+        try:
+            lanes = [jobs.LANES[name] for name in options['lanes'].split(',')]
+        except KeyError as exc:
+            raise CommandError(f'Unknown lane {exc}')
+        requeued = jobs.requeue_stale_jobs(settings.JOB_STALE_TIMEOUT)
+        purged = jobs.purge_finished_jobs(settings.JOB_RETENTION)
+        self.stdout.write(
+            f'Requeued {requeued} stale jobs, purged {purged} finished jobs'
+        )
+
+        threads, processes = options['threads'], options['processes']
+        if processes <= 1:
+            _run_threads(lanes, threads, options['once'])
+            return
+
+        # The children must not inherit the connections of this process
+        connections.close_all()
+        children = [
+            multiprocessing.Process(
+                target=_run_process,
+                args=(lanes, threads, options['once'])
+            )
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+                child.join()
+
+    def _print_stats(self):
+        # Print the depth and the average wait of every lane
+        for lane, stats in jobs.queue_stats().items():
+            latency = stats['latency']
+            latency = (
+                f'{latency.total_seconds() * 1000:.0f}ms'
+                if latency is not None else '-'
+            )
+            self.stdout.write(
+                f'{lane}: {stats["queued"]} queued, {stats["running"]} '
+                f'running, {stats["failed"]} failed, latency {latency}'
+            )
@@ -0,0 +1,105 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db import connections
+from core import backups
+
+
+class Command(BaseCommand):
+    """
+    Copy a live SQLite database to a snapshot file
+    """
+    help = (
+        'Copy a SQLite database with the online backup API, a few pages '
+        'per step with a pause in between so the requests keep writing. '
+        'Optionally gzip the snapshot and store its SHA-256 next to it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the snapshot file.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            '--pages', type=int, default=256,
+            help='Pages copied per step, -1 copies all at once.'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.005,
+            help='Seconds between the steps.'
+        )
+        parser.add_argument(
+            '--max-restarts', type=int, default=10,
+            help='Restarts of the copy, caused by the writes of the requests, '
+                 'after which the database is copied in a single step.'
+        )
+        parser.add_argument(
+            '--compress', action='store_true',
+            help='Gzip the snapshot.'
+        )
+        parser.add_argument(
+            '--checksum', action='store_true',
+            help='Write the SHA-256 of the snapshot to OUTPUT.sha256.'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Snapshots are only supported on SQLite')
+        if options['pages'] == 0 or options['pages'] < -1:
+            raise CommandError('--pages must be positive or -1')
+        if options['max_restarts'] < 0:
+            raise CommandError('--max-restarts must not be negative')
+
+        output = options['output']
+        copy_path = f'{output}.tmp'
+        connection.ensure_connection()
+        target = backups.connect(copy_path)
+        try:
+            report = backups.backup(
+                connection.connection,
+                target,
+                pages=options['pages'],
+                sleep=options['sleep'],
+                max_restarts=options['max_restarts']
+            )
+            size = report.pages * backups.page_size(target)
+        except Exception:
+            target.close()
+            os.remove(copy_path)
+            raise
+        target.close()
+
+        try:
+            if options['compress']:
+                # Compressed next to the output, a failure leaves the
+                # previous snapshot in place
+                compressed_path = f'{output}.part'
+                try:
+                    backups.compress(copy_path, compressed_path)
+                    os.replace(compressed_path, output)
+                except Exception:
+                    if os.path.exists(compressed_path):
+                        os.remove(compressed_path)
+                    raise
+            else:
+                os.replace(copy_path, output)
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        if options['checksum']:
+            backups.write_checksum(output, backups.file_sha256(output))
+
+        throughput = size / max(report.duration, 1e-6) / (1024 * 1024)
+        self.stdout.write(
+            f'{options["database"]}: {report.pages} pages, '
+            f'{size / (1024 * 1024):.1f} MB in {report.duration:.2f} s '
+            f'({throughput:.1f} MB/s), {report.steps} steps, '
+            f'{report.restarts} restarts'
+            + (', copied in a single step' if report.single_step else '')
+        )
+        self.stdout.write(
+            f'Source locked {report.lock_time * 1000:.1f} ms in total, '
+            f'{report.max_lock_time * 1000:.1f} ms at most'
+        )
+        self.stdout.write(
+            f'Snapshot {output}: {os.path.getsize(output)} bytes'
+        )
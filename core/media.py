@@ -0,0 +1,164 @@
+"""
+Serving of the media files checked by a view.
+
+With MEDIA_SERVING['BACKEND'] set, the view only answers with a header and
+the front-end server sends the file itself: 'x-sendfile' (Apache, lighttpd)
+gets the absolute path, 'x-accel-redirect' (nginx) gets the path under the
+internal location aliasing MEDIA_ROOT. Otherwise the worker sends the file
+with a FileResponse, which the WSGI server's file wrapper turns into
+sendfile() calls, honouring single Range requests.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse
+from django.http import Http404
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.cache import patch_cache_control
+
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)', re.ASCII)
+
+
+class FileRange:
+    """
+    File object reading a byte range of an open file
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        # Read up to size bytes, never past the end of the range
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def fileno(self):
+        # The WSGI file wrapper sends from the current offset, bounded by
+        # the Content-Length of the response
+        return self.file.fileno()
+
+    def close(self):
+        # Closed by the response once sent
+        self.file.close()
+
+
+def get_etag(stat):
+    # Return the ETag of a file, the mtime is bumped by the variants cache
+    return f'"{stat.st_ino:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    # Return the (start, end) bytes of a single range, None for the whole
+    # file, raise ValueError when it can't be satisfied
+    match = _RANGE.fullmatch(header.strip())
+    if not match:
+        # Multiple or unknown ranges, the whole file is a valid answer
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            raise ValueError(header)
+        # Suffix range, the last bytes of the file
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+
+    return start, end
+
+
+def _accel_path(path):
+    # Return the internal location of a file of MEDIA_ROOT, None otherwise
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(path)
+    if os.path.commonpath([root, path]) != root:
+        return None
+
+    return settings.MEDIA_SERVING['INTERNAL_URL'] + quote(
+        os.path.relpath(path, root)
+    )
+
+
+def _send_file(request, path, stat, content_type):
+    # Return a response sending the file from the worker
+    file = open(path, 'rb')
+    header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if header and (not if_range or if_range == get_etag(stat)):
+        try:
+            byte_range = parse_range(header, stat.st_size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = FileResponse(
+                FileRange(file, start, end - start + 1),
+                status=206,
+                content_type=content_type
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            return response
+
+    return FileResponse(file, content_type=content_type)
+
+
+def serve_file(request, path, content_type=None, immutable=False):
+    # Return a response sending the file at path to the client, immutable
+    # files are cached without revalidation
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('File not found.')
+    if content_type is None:
+        content_type = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        )
+
+    etag = get_etag(stat)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        backend = settings.MEDIA_SERVING['BACKEND']
+        accel_path = _accel_path(path)
+        if backend == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = os.path.realpath(path)
+        elif backend == 'x-accel-redirect' and accel_path is not None:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = accel_path
+        else:
+            response = _send_file(request, path, stat, content_type)
+            if response.status_code == 416:
+                return response
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    # The files are only readable by their owner
+    if immutable:
+        patch_cache_control(
+            response,
+            private=True,
+            max_age=settings.MEDIA_SERVING['MAX_AGE'],
+            immutable=True
+        )
+    else:
+        # Replaced files, e.g. stripped of their metadata, must not outlive
+        # their replacement in the caches, the ETag keeps the checks cheap
+        patch_cache_control(response, private=True, no_cache=True)
+
+    return response
@@ -1,10 +1,15 @@
 from django.db import models
+from django.db import IntegrityError
+from django.db import router
+from django.db import transaction
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin
 )
+import unicodedata
 import uuid
 import os
 
@@ -17,6 +22,11 @@ def recipe_image_file_path(instance, filename):
     return os.path.join('uploads/recipe/', filename)
 
 
+def normalize_name(name):
+    # Return the name compared for duplicates, ignoring case and spacing
+    return ' '.join(unicodedata.normalize('NFKC', name).split()).casefold()
+
+
 class UserManager(BaseUserManager):
 
     def create_user(self, email, password=None, **extra_fields):
@@ -48,39 +58,172 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Database alias overriding the hashed shard of the user data
+    shard = models.CharField(max_length=50, blank=True)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
+class RecipeAttrManager(models.Manager):
+    """
+    Manager creating tags and ingredients once per user and name
+    """
+
+    def get_or_create_name(self, user, name):
+        # Return the object with the name and whether it was created
+        return self.get_or_create(
+            user=user,
+            normalized_name=normalize_name(name),
+            defaults={'name': name}
+        )
+
+    def get_or_create_many(self, user, names):
+        # Return the objects of the names, creating the missing ones at once
+        from core import counts
+        from core import events
+        from core import sharding
+
+        using = self._db or router.db_for_write(self.model)
+        manager = self.db_manager(using)
+        wanted = {}
+        for name in names:
+            wanted.setdefault(normalize_name(name), name)
+        found = {
+            obj.normalized_name: obj for obj in manager.filter(
+                user=user,
+                normalized_name__in=wanted
+            )
+        }
+        missing = [
+            self.model(user=user, name=name, normalized_name=normalized)
+            for normalized, name in wanted.items()
+            if normalized not in found
+        ]
+        if missing:
+            # bulk_create skips the signals of save()
+            if sharding.is_enabled():
+                for obj in missing:
+                    obj.pk = sharding.allocate_id()
+            bulk_created = False
+            try:
+                with transaction.atomic(using=using):
+                    manager.bulk_create(missing)
+            except IntegrityError:
+                # Some names were created concurrently, the signals of
+                # save() count the others
+                for obj in missing:
+                    manager.get_or_create_name(user, obj.name)
+            else:
+                counts.add_to_user_count(
+                    user.pk,
+                    self.model,
+                    len(missing),
+                    using
+                )
+                counts.invalidate_cached_counts(user.pk)
+                bulk_created = True
+            found.update(
+                (obj.normalized_name, obj) for obj in manager.filter(
+                    user=user,
+                    normalized_name__in=[obj.normalized_name
+                                         for obj in missing]
+                )
+            )
+            if bulk_created:
+                # The ids are only known once the objects are read back
+                for obj in missing:
+                    events.publish_change(
+                        user.pk,
+                        events.CREATED,
+                        self.model._meta.model_name,
+                        found[obj.normalized_name].pk,
+                        using
+                    )
+
+        return [found[normalize_name(name)] for name in names]
+
+
 class Tag(models.Model):
     """
     Tag model for the recipe
     """
     name = models.CharField(max_length=255)
+    # Null on rows older than the constraint, see merge_duplicate_names
+    normalized_name = models.CharField(
+        max_length=255,
+        null=True,
+        editable=False
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'updated_at'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'normalized_name'],
+                name='unique_tag_name'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Keep the normalized name in sync with the name
+        self.normalized_name = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     """
     Ingredient model for the recipe
     """
     name = models.CharField(max_length=255)
+    # Null on rows older than the constraint, see merge_duplicate_names
+    normalized_name = models.CharField(
+        max_length=255,
+        null=True,
+        editable=False
+    )
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = RecipeAttrManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'updated_at'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'normalized_name'],
+                name='unique_ingredient_name'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Keep the normalized name in sync with the name
+        self.normalized_name = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'normalized_name'}
+        super().save(*args, **kwargs)
+
 
 class Recipe(models.Model):
     """
@@ -97,6 +240,217 @@ class Recipe(models.Model):
     )
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at']),
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'price']),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class RecipeCard(models.Model):
+    """
+    Pre-encoded JSON representations of a recipe served by the lists
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='card'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    # Output of RecipeSerializer and RecipeDetailSerializer
+    summary = models.BinaryField()
+    detail = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Card of {self.recipe_id}'
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted object for the delta sync of the clients
+    """
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    MODEL_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'deleted_at'])]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class UploadSession(models.Model):
+    """
+    Resumable chunked upload of a recipe image
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey('Recipe', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def temp_path(self):
+        # Path of the partial file, in MEDIA_ROOT to be moved atomically
+        return os.path.join(settings.RECIPE_UPLOAD_TEMP_DIR, f'{self.id}.part')
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+
+class UserCounts(models.Model):
+    """
+    Number of recipes, tags and ingredients of a user, kept by signals
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    recipes = models.IntegerField(default=0)
+    tags = models.IntegerField(default=0)
+    ingredients = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.recipes} recipes'
+
+
+class Job(models.Model):
+    """
+    Deferred task of the local job queue, run by the run_workers command
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    HIGH = 0
+    DEFAULT = 1
+    LOW = 2
+    LANE_CHOICES = (
+        (HIGH, 'high'),
+        (DEFAULT, 'default'),
+        (LOW, 'low'),
+    )
+
+    task = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    lane = models.PositiveSmallIntegerField(
+        choices=LANE_CHOICES,
+        default=DEFAULT
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=QUEUED
+    )
+    idempotency_key = models.CharField(max_length=255, null=True, unique=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'lane', 'run_at'])]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
+
+
+class GlobalIdSequence(models.Model):
+    """
+    Next free id of the objects spread across the shards
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    next_id = models.BigIntegerField()
+
+    def __str__(self):
+        return f'{self.name}: {self.next_id}'
+
+
+class RevokedToken(models.Model):
+    """
+    Signed auth token revoked before its expiry
+    """
+    jti = models.CharField(max_length=32, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
+
+
+class ChangeEvent(models.Model):
+    """
+    Change notification carried between the processes serving the feed
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.payload} of {self.user_id}'
+
+
+class QueryStat(models.Model):
+    """
+    Timings of the sampled queries sharing a fingerprint
+    """
+    fingerprint = models.CharField(max_length=16, primary_key=True)
+    # SQL with the literals replaced by ?
+    sql = models.TextField()
+    # View and action of the last call
+    origin = models.CharField(max_length=255, blank=True)
+    calls = models.BigIntegerField(default=0)
+    slow_calls = models.BigIntegerField(default=0)
+    # Milliseconds
+    total_time = models.FloatField(default=0)
+    max_time = models.FloatField(default=0)
+    # Query plan of the last slow call
+    plan = models.TextField(blank=True)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.sql[:80]
@@ -0,0 +1,207 @@
+"""
+Sampled query log.
+
+With QUERY_LOG enabled, a sample of the requests runs with an execute
+wrapper on every database connection. Their queries are fingerprinted by
+replacing the literals, and timed. Statements slower than SLOW_MS also
+get their query plan, taken with EXPLAIN. The timings are added to the
+QueryStat of their fingerprint when the response is returned, see
+manage.py query_stats and the api/query-stats/ endpoint.
+"""
+import hashlib
+import logging
+import random
+import re
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import IntegrityError
+from django.db import connections
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from core.models import QueryStat
+
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+# Orderings of the reports
+ORDERINGS = {
+    'total': '-total_time',
+    'max': '-max_time',
+    'calls': '-calls',
+    'slow': '-slow_calls',
+}
+
+
+def normalize_sql(sql):
+    # Return the SQL with its literals and IN lists replaced by ?
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:16]
+
+
+def explain(connection, sql, params):
+    # Return the query plan of a statement, without running it
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # id, parent, notused, detail
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+class QueryRecorder:
+    """
+    Execute wrapper timing the queries of a request
+    """
+
+    def __init__(self, slow_ms):
+        self.slow_ms = slow_ms
+        self.origin = ''
+        self.stats = {}
+        self._explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self._explaining:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            plan = None
+            if (
+                duration >= self.slow_ms
+                and not many
+                and sql.lstrip()[:6].upper() == 'SELECT'
+            ):
+                plan = self._explain(context['connection'], sql, params)
+            self._record(sql, duration, plan)
+
+    def _explain(self, connection, sql, params):
+        # Return the plan of a slow query, its own queries aren't recorded
+        self._explaining = True
+        try:
+            return explain(connection, sql, params)
+        except Exception:
+            logger.warning('EXPLAIN failed', exc_info=True)
+            return ''
+        finally:
+            self._explaining = False
+
+    def _record(self, sql, duration, plan):
+        normalized = normalize_sql(sql)
+        key = fingerprint(normalized)
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = self.stats[key] = {
+                'sql': normalized,
+                'calls': 0,
+                'slow_calls': 0,
+                'total_time': 0,
+                'max_time': 0,
+                'plan': '',
+            }
+        stat['calls'] += 1
+        stat['total_time'] += duration
+        stat['max_time'] = max(stat['max_time'], duration)
+        if plan is not None:
+            stat['slow_calls'] += 1
+            stat['plan'] = plan
+
+    def save(self):
+        # Add the timings of the request to their QueryStat
+        for key, stat in self.stats.items():
+            changes = {
+                'origin': self.origin,
+                'calls': F('calls') + stat['calls'],
+                'slow_calls': F('slow_calls') + stat['slow_calls'],
+                'total_time': F('total_time') + stat['total_time'],
+                'max_time': Greatest('max_time', stat['max_time']),
+                'last_seen': timezone.now(),
+            }
+            if stat['plan']:
+                changes['plan'] = stat['plan']
+            if QueryStat.objects.filter(fingerprint=key).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    QueryStat.objects.create(
+                        fingerprint=key,
+                        origin=self.origin,
+                        **stat
+                    )
+            except IntegrityError:
+                # Created by a concurrent request
+                QueryStat.objects.filter(fingerprint=key).update(**changes)
+
+
+def top_stats(order='total', limit=20):
+    # Return the fingerprints with the highest timings
+    return QueryStat.objects.order_by(ORDERINGS[order])[:limit]
+
+
+def get_origin(request):
+    # Return the view and action of a request, e.g. recipe:recipe-list list
+    match = request.resolver_match
+    if match is None:
+        return request.path
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower())
+
+    return f'{match.view_name} {action}' if action else match.view_name
+
+
+class QueryLogMiddleware:
+    """
+    Record the queries of a sample of the requests
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.QUERY_LOG
+        if (
+            not options['ENABLED']
+            or random.random() >= options['SAMPLE_RATE']
+        ):
+            return self.get_response(request)
+
+        recorder = QueryRecorder(options['SLOW_MS'])
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(recorder)
+                )
+            response = self.get_response(request)
+
+        recorder.origin = get_origin(request)[:255]
+        try:
+            recorder.save()
+        except Exception:
+            logger.warning('Query stats not saved', exc_info=True)
+
+        return response
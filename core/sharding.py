@@ -0,0 +1,197 @@
+"""
+Horizontal sharding of the user data.
+
+The users, their tokens and the job queue stay in the default database.
+The recipes, tags, ingredients and every other per-user model live on the
+shard of their user, picked by a stable hash of the user id unless
+User.shard overrides it. Each user row is mirrored on its shard so the
+foreign keys hold there too. Ids of the objects exposed by the API are
+allocated from a global sequence, so they stay unique when a user is moved
+between shards.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import hashlib
+import threading
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Max
+
+
+# Models of the core app stored on the shard of their user
+SHARDED_MODELS = {
+    'recipe',
+    'recipe_tags',
+    'recipe_ingredients',
+    'recipecard',
+    'tag',
+    'ingredient',
+    'tombstone',
+    'uploadsession',
+    'usercounts',
+}
+
+# Models whose ids are exposed and allocated from the global sequence
+GLOBAL_ID_MODELS = {'recipe', 'tag', 'ingredient'}
+
+ID_BLOCK_SIZE = 1000
+
+_current_shard = ContextVar('current_shard', default=None)
+
+_id_block = {'next': 0, 'end': 0}
+_id_lock = threading.Lock()
+
+
+def is_enabled():
+    # Return whether the user data is sharded
+    return bool(settings.SHARD_DATABASES)
+
+
+def is_sharded(model):
+    # Return whether a model is stored on the shards
+    return (
+        model._meta.app_label == 'core'
+        and model._meta.model_name in SHARDED_MODELS
+    )
+
+
+def shard_for_user(user):
+    # Return the database alias holding the data of a user
+    if user.shard:
+        return user.shard
+    digest = hashlib.sha1(str(user.pk).encode()).digest()
+    index = int.from_bytes(digest[:8], 'big') % len(settings.SHARD_DATABASES)
+
+    return settings.SHARD_DATABASES[index]
+
+
+@contextmanager
+def use_shard(alias):
+    # Route the queries without instance to a shard
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def _reserve_id_block():
+    # Reserve a block of ids in the default database, return its first id
+    from core.models import GlobalIdSequence, Tag, Ingredient, Recipe
+
+    sequences = GlobalIdSequence.objects.using(DEFAULT_DB_ALIAS)
+    while True:
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # Updating first takes the write lock before the read
+            if sequences.filter(name='objects').update(
+                next_id=F('next_id') + ID_BLOCK_SIZE
+            ):
+                return sequences.get(name='objects').next_id - ID_BLOCK_SIZE
+        # First block, start after the ids of the unsharded data
+        start = max(
+            model.objects.using(DEFAULT_DB_ALIAS).aggregate(
+                last=Max('id')
+            )['last'] or 0
+            for model in (Recipe, Tag, Ingredient)
+        ) + 1
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                sequences.create(name='objects', next_id=start)
+        except IntegrityError:
+            pass
+
+
+def allocate_id():
+    # Return an id unique across the shards
+    with _id_lock:
+        if _id_block['next'] >= _id_block['end']:
+            _id_block['next'] = _reserve_id_block()
+            _id_block['end'] = _id_block['next'] + ID_BLOCK_SIZE
+        allocated = _id_block['next']
+        _id_block['next'] += 1
+
+    return allocated
+
+
+class UserShardRouter:
+    """
+    Route the per-user models to the shard of their user
+    """
+
+    def _db_for_model(self, model, **hints):
+        if not is_enabled() or not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            if is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            if getattr(instance._meta, 'model_name', None) == 'user':
+                return shard_for_user(instance)
+
+        return _current_shard.get()
+
+    db_for_read = _db_for_model
+    db_for_write = _db_for_model
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are mirrored on their shard
+        if not is_enabled():
+            return None
+        models = {obj1._meta.model_name, obj2._meta.model_name}
+        if 'user' in models and (is_sharded(type(obj1))
+                                 or is_sharded(type(obj2))):
+            return True
+
+        return None
+
+
+class UserShardMixin:
+    """
+    Route the queries of a request to the shard of the authenticated user
+    """
+
+    def initial(self, request, *args, **kwargs):
+        self._shard_token = None
+        super().initial(request, *args, **kwargs)
+        if is_enabled() and request.user.is_authenticated:
+            self._shard_token = _current_shard.set(
+                shard_for_user(request.user)
+            )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_shard_token', None)
+        if token is not None:
+            _current_shard.reset(token)
+            self._shard_token = None
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+def _mirror_of(user):
+    # Return an unsaved copy of a user row
+    return type(user)(**{
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields
+    })
+
+
+def mirror_user(user, alias):
+    # Copy the row of a user to a shard
+    _mirror_of(user).save(using=alias)
+
+
+def mirror_users(users):
+    # Copy the rows of new users to their shards, e.g. after a bulk_create
+    # which sends no post_save
+    by_shard = {}
+    for user in users:
+        by_shard.setdefault(shard_for_user(user), []).append(_mirror_of(user))
+    for alias, mirrors in by_shard.items():
+        type(mirrors[0]).objects.using(alias).bulk_create(
+            mirrors,
+            batch_size=500,
+            ignore_conflicts=True
+        )
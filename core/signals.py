@@ -0,0 +1,244 @@
+from contextlib import contextmanager
+import os
+import threading
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
+from django.db.models.signals import pre_delete
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from core import authentication
+from core import counts
+from core import events
+from core import sharding
+from core.models import Tag
+from core.models import Ingredient
+from core.models import Recipe
+from core.models import RecipeCard
+from core.models import Tombstone
+from core.models import UploadSession
+from core.models import UserCounts
+
+
+TOMBSTONE_MODELS = {
+    Recipe: Tombstone.RECIPE,
+    Tag: Tombstone.TAG,
+    Ingredient: Tombstone.INGREDIENT,
+}
+
+# Models of the data of a user on its shard, in the order their rows can be
+# inserted so the relations exist before the rows using them
+USER_DATA_MODELS = (Tag, Ingredient, Recipe, RecipeCard, Tombstone, UserCounts)
+
+# Users whose objects are deleted without tombstones, by thread
+_without_tombstones = threading.local()
+
+
+def _users_without_tombstones():
+    # Return the ids of the users whose deletions aren't recorded
+    if not hasattr(_without_tombstones, 'ids'):
+        _without_tombstones.ids = set()
+
+    return _without_tombstones.ids
+
+
+@contextmanager
+def without_tombstones(user_id):
+    # Delete objects of a user without recording tombstones
+    _users_without_tombstones().add(user_id)
+    try:
+        yield
+    finally:
+        _users_without_tombstones().discard(user_id)
+
+
+def delete_user_data(user, alias):
+    # Delete the rows of a user in a database, the user row stays
+    with without_tombstones(user.pk):
+        UploadSession.objects.using(alias).filter(user=user).delete()
+        for model in reversed(USER_DATA_MODELS):
+            model.objects.using(alias).filter(user=user).delete()
+
+
+def touch_recipes(using, **filters):
+    # Mark the matching recipes as modified for the delta sync
+    Recipe.objects.using(using).filter(**filters).update(
+        updated_at=timezone.now()
+    )
+
+
+@receiver(pre_delete, sender=get_user_model())
+def user_pre_delete(sender, instance, **kwargs):
+    # The objects of a deleted user don't need tombstones
+    _users_without_tombstones().add(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_post_delete(sender, instance, **kwargs):
+    _users_without_tombstones().discard(instance.pk)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def attr_pre_delete(sender, instance, using, **kwargs):
+    # The deletion removes the object from its recipes
+    field = 'tags' if sender is Tag else 'ingredients'
+    touch_recipes(using, **{field: instance})
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def create_tombstone(sender, instance, using, **kwargs):
+    if instance.user_id in _users_without_tombstones():
+        return
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        model=TOMBSTONE_MODELS[sender],
+        object_id=instance.pk
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set,
+                             using, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch_recipes(using, pk=instance.pk)
+    elif action in ('post_add', 'post_remove'):
+        touch_recipes(using, pk__in=pk_set)
+    elif action == 'pre_clear':
+        touch_recipes(using, pk__in=list(
+            instance.recipe_set.values_list('pk', flat=True)
+        ))
+
+
+@receiver(post_delete, sender=UploadSession)
+def remove_upload_temp_file(sender, instance, **kwargs):
+    try:
+        os.remove(instance.temp_path)
+    except FileNotFoundError:
+        pass
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def count_saved(sender, instance, created, using, **kwargs):
+    if created:
+        counts.add_to_user_count(instance.user_id, sender, 1, using)
+    counts.invalidate_cached_counts(instance.user_id)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def count_deleted(sender, instance, using, **kwargs):
+    counts.add_to_user_count(instance.user_id, sender, -1, using)
+    counts.invalidate_cached_counts(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def count_relations_changed(sender, instance, action, **kwargs):
+    # The tag and ingredient filters count through the relations
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        counts.invalidate_cached_counts(instance.user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def forget_authenticated_user(sender, instance, **kwargs):
+    # Signed tokens must see the changes of the user, e.g. is_active
+    authentication.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=get_user_model())
+def mirror_user_on_shard(sender, instance, using, **kwargs):
+    # The foreign keys of the user data need the user row on its shard
+    if sharding.is_enabled() and using == DEFAULT_DB_ALIAS:
+        sharding.mirror_user(instance, sharding.shard_for_user(instance))
+
+
+@receiver(post_save, sender=get_user_model())
+def create_user_counts(sender, instance, created, using, **kwargs):
+    # After the mirror of the user, the counter references it on its shard
+    if created and using == DEFAULT_DB_ALIAS:
+        counts.create_user_counts([instance])
+
+
+@receiver(post_delete, sender=get_user_model())
+def delete_user_on_shard(sender, instance, using, **kwargs):
+    # The deletion collector only looks in the default database
+    if not sharding.is_enabled() or using != DEFAULT_DB_ALIAS:
+        return
+    alias = sharding.shard_for_user(instance)
+    with transaction.atomic(using=alias):
+        delete_user_data(instance, alias)
+        sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Tag)
+@receiver(pre_save, sender=Ingredient)
+def assign_global_id(sender, instance, **kwargs):
+    # Ids stay unique across the shards, so users can be moved
+    if sharding.is_enabled() and instance.pk is None:
+        instance.pk = sharding.allocate_id()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def publish_saved(sender, instance, created, using, **kwargs):
+    events.publish_change(
+        instance.user_id,
+        events.CREATED if created else events.UPDATED,
+        TOMBSTONE_MODELS[sender],
+        instance.pk,
+        using
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def publish_deleted(sender, instance, using, **kwargs):
+    # Same as the tombstones, e.g. nothing for a deleted user
+    if instance.user_id in _users_without_tombstones():
+        return
+    events.publish_change(
+        instance.user_id,
+        events.DELETED,
+        TOMBSTONE_MODELS[sender],
+        instance.pk,
+        using
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def publish_relations_changed(sender, instance, action, reverse, pk_set,
+                              using, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set:
+        recipe_ids = pk_set
+    else:
+        # Cleared from a tag or ingredient, its own event covers it
+        return
+    for recipe_id in recipe_ids:
+        events.publish_change(
+            instance.user_id,
+            events.UPDATED,
+            Tombstone.RECIPE,
+            recipe_id,
+            using
+        )
@@ -0,0 +1,216 @@
+"""
+Single-flight coalescing of identical concurrent reads.
+
+While a read is computed, identical requests of the same user wait for it
+and get a copy of its rendered bytes instead of running the same queries.
+Threads of a worker are coalesced in memory, workers can also be coalesced
+through lock files when SINGLE_FLIGHT_LOCK_DIR is set. The lock and result
+files unused for SINGLE_FLIGHT_FILE_TTL seconds are swept by the workers;
+removing the lock file of a call in progress only costs a duplicate call.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.http import HttpResponse
+
+
+class _Call:
+    """
+    In-flight call of a group
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class Group:
+    """
+    Coalesce the concurrent calls with the same key in a single call
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        # Return the result of fn and whether it was shared with a caller
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if not call.failed:
+                return call.result, True
+            # The leader failed, compute independently
+            return fn(), False
+
+        try:
+            call.result = fn()
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class FileLockGroup(Group):
+    """
+    Coalesce the calls of the threads and of the workers of a host
+    """
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self._next_sweep = 0
+
+    def do(self, key, fn):
+        # Only one thread of each worker competes for the lock file
+        self._maybe_sweep()
+        return super().do(key, lambda: self._do_locked(key, fn))
+
+    def _maybe_sweep(self):
+        # Sweep the old files at most once per TTL in each worker
+        now = time.time()
+        with self._lock:
+            if now < self._next_sweep:
+                return
+            self._next_sweep = now + settings.SINGLE_FLIGHT_FILE_TTL
+        self.sweep(now - settings.SINGLE_FLIGHT_FILE_TTL)
+
+    def sweep(self, cutoff):
+        # Remove the lock, result and temporary files unused since cutoff
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _do_locked(self, key, fn):
+        # Return a (status, content type, content) computed once per host
+        import fcntl
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = hashlib.sha1(key.encode()).hexdigest()
+        result_path = os.path.join(self.directory, f'{name}.result')
+        started = time.time()
+        with open(os.path.join(self.directory, f'{name}.lock'), 'wb') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Marks the lock file as used for the sweeps
+            os.utime(lock.fileno())
+            try:
+                result = self._read_result(result_path, started)
+                if result is None:
+                    result = fn()
+                    self._write_result(result_path, result)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        return result
+
+    def _read_result(self, path, started):
+        # Return the result written by a worker since the call started
+        try:
+            with open(path, 'rb') as result:
+                if os.fstat(result.fileno()).st_mtime < started:
+                    return None
+                meta = json.loads(result.readline())
+                return meta['status'], meta['content_type'], result.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_result(self, path, result):
+        # Write a result atomically for the workers waiting on the lock
+        status, content_type, content = result
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as output:
+            output.write(json.dumps(
+                {'status': status, 'content_type': content_type}
+            ).encode() + b'\n')
+            output.write(content)
+        os.replace(temp_path, path)
+
+
+_local_group = Group()
+_file_groups = {}
+
+
+def get_group():
+    # Return the configured single-flight group
+    directory = getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', None)
+    if directory is None:
+        return _local_group
+    if directory not in _file_groups:
+        _file_groups[directory] = FileLockGroup(directory)
+
+    return _file_groups[directory]
+
+
+class SingleFlightMixin:
+    """
+    Share the rendered response of concurrent identical reads of a user
+    """
+    single_flight_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            request.method == 'GET'
+            and self.action in self.single_flight_actions
+            and request.user.is_authenticated
+        ):
+            # dispatch looks the handler up once initial returns
+            self.get = self._single_flight(self.get)
+
+    def _single_flight(self, handler):
+        # Wrap a handler so concurrent identical calls share its response
+        def single_flight_handler(request, *args, **kwargs):
+            leader_response = None
+
+            def render():
+                nonlocal leader_response
+                response = handler(request, *args, **kwargs)
+                response.accepted_renderer = request.accepted_renderer
+                response.accepted_media_type = request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+                leader_response = response
+                return (
+                    response.status_code,
+                    response['Content-Type'],
+                    response.content
+                )
+
+            key = ':'.join((
+                str(request.user.pk),
+                request.accepted_media_type,
+                request.get_full_path(),
+            ))
+            (status, content_type, content), _ = get_group().do(key, render)
+            if leader_response is not None:
+                return leader_response
+
+            return HttpResponse(
+                content,
+                status=status,
+                content_type=content_type
+            )
+
+        return single_flight_handler
@@ -0,0 +1,157 @@
+"""
+Server-sent events change feed.
+
+An ASGI app streaming the change events of the authenticated user, each
+connection is a coroutine waiting on its queue so idle connections cost
+no thread. Clients send the usual "Token" or "Bearer" Authorization
+header, or the token or signed_token query parameter from EventSource.
+After a reconnect or a resync event, clients catch up with the sync
+endpoint.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from core import authentication
+from core import events
+
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    # Stop nginx from buffering the stream
+    (b'x-accel-buffering', b'no'),
+]
+
+
+def _credentials(scope):
+    # Return the scheme and the token of the request
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            parts = value.decode('latin-1').split()
+            if len(parts) == 2:
+                return parts[0].lower(), parts[1]
+
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    if 'token' in query:
+        return 'token', query['token'][0]
+    if 'signed_token' in query:
+        return 'bearer', query['signed_token'][0]
+
+    return None, None
+
+
+def authenticate(scope):
+    # Return the active user of the token of the request, None otherwise
+    scheme, token = _credentials(scope)
+    try:
+        if scheme == 'token':
+            return TokenAuthentication().authenticate_credentials(token)[0]
+        if scheme == 'bearer' and authentication.is_enabled():
+            backend = authentication.SignedTokenAuthentication()
+            return backend.authenticate_credentials(token)[0]
+    except AuthenticationFailed:
+        pass
+    finally:
+        close_old_connections()
+
+    return None
+
+
+def encode_event(event):
+    # Encode an event in the text/event-stream format
+    data = json.dumps(event, separators=(',', ':'))
+
+    return f'event: {event["event"]}\ndata: {data}\n\n'.encode()
+
+
+class EventStreamApp:
+    """
+    ASGI app serving the change feed, other requests go to the wrapped app
+    """
+
+    def __init__(self, app, path='/api/events/'):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope['type'] != 'http'
+            or scope['path'] != self.path
+            or not events.is_enabled()
+        ):
+            return await self.app(scope, receive, send)
+
+        if scope['method'] != 'GET':
+            return await self._respond(send, 405, b'Method not allowed')
+        user = await sync_to_async(authenticate)(scope)
+        if user is None:
+            return await self._respond(send, 401, b'Invalid credentials')
+
+        subscription = events.get_broker().subscribe(user.pk)
+        stream = asyncio.ensure_future(self._stream(send, subscription))
+        disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+        try:
+            done, _ = await asyncio.wait(
+                {stream, disconnect},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if stream in done:
+                stream.result()
+        finally:
+            stream.cancel()
+            disconnect.cancel()
+            events.get_broker().unsubscribe(subscription)
+
+    async def _stream(self, send, subscription):
+        # Send the events of the subscription until the client leaves
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': HEADERS,
+        })
+        await self._send_body(send, b'retry: 5000\n\n')
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(),
+                    settings.EVENTS['KEEPALIVE']
+                )
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing the idle connection
+                await self._send_body(send, b': keepalive\n\n')
+                continue
+            if subscription.overflowed:
+                await self._send_body(send, encode_event({'event': 'resync'}))
+                break
+            await self._send_body(send, encode_event(event))
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _wait_disconnect(self, receive):
+        # Return once the client disconnects
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    async def _send_body(self, send, body):
+        # Send a chunk of the open stream
+        await send({
+            'type': 'http.response.body',
+            'body': body,
+            'more_body': True,
+        })
+
+    async def _respond(self, send, status, body):
+        # Send a plain text error response
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain')],
+        })
+        await send({'type': 'http.response.body', 'body': body})
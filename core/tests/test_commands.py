@@ -0,0 +1,252 @@
+from io import StringIO
+import os
+import tempfile
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.urls import clear_url_caches
+from django.urls import get_resolver
+from PIL import Image
+from rest_framework.settings import api_settings
+from rest_framework.authtoken.models import Token
+from core import backups
+from core.models import Tag
+from core.models import Recipe
+from core.models import UserCounts
+from core.management.commands.coldstart_report import parse_import_times
+from drf_advance.warmup import warm_up
+
+
+class ProvisionUsersCommandTests(TestCase):
+    """
+    Test the bulk user provisioning command
+    """
+
+    def setUp(self) -> None:
+        self.csv_file = tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', delete=False
+        )
+        self.csv_file.write(
+            'email,password,name\n'
+            'one@EMAIL.com,12345qwe,One\n'
+            'two@email.com,12345qwe,Two\n'
+            'existing@email.com,12345qwe,Existing\n'
+        )
+        self.csv_file.close()
+
+    def tearDown(self) -> None:
+        os.remove(self.csv_file.name)
+
+    def test_provision_users(self):
+        # Test users are created with a usable password and a token
+        get_user_model().objects.create_user(
+            email='existing@email.com',
+            password='other'
+        )
+        call_command(
+            'provision_users', self.csv_file.name,
+            '--workers', '1', '--chunk-size', '2', stdout=StringIO()
+        )
+        user = get_user_model().objects.get(email='one@email.com')
+
+        self.assertEqual(get_user_model().objects.count(), 3)
+        self.assertEqual(user.name, 'One')
+        self.assertTrue(user.check_password('12345qwe'))
+        self.assertEqual(Token.objects.count(), 2)
+
+    def test_provision_users_unknown_hasher(self):
+        # Test a hasher not in PASSWORD_HASHERS is refused
+        with self.assertRaises(CommandError):
+            call_command(
+                'provision_users', self.csv_file.name,
+                '--hasher', 'unknown', stdout=StringIO()
+            )
+
+
+class ColdStartTests(TestCase):
+    """
+    Test the worker warm-up and the cold start report
+    """
+
+    def test_parse_import_times(self):
+        # Test the -X importtime lines are parsed
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |   _io\n'
+            'import time:      2000 |       5000 | django\n'
+        )
+
+        self.assertEqual(
+            parse_import_times(output),
+            [('_io', 120, 120), ('django', 2000, 5000)]
+        )
+
+    def test_warm_up_runs_every_step(self):
+        # Test the forced warm-up fills the caches of every step
+        clear_url_caches()
+        api_settings.reload()
+        Recipe._meta._expire_cache()
+        timings = warm_up(force=True)
+
+        self.assertEqual(set(timings), {
+            'warm_up_urls',
+            'warm_up_api_settings',
+            'warm_up_models',
+            'warm_up_images',
+        })
+        self.assertTrue(get_resolver()._populated)
+        self.assertIn('DEFAULT_RENDERER_CLASSES', api_settings.__dict__)
+        self.assertTrue(Recipe._meta._get_fields_cache)
+        self.assertIn('fields_map', Recipe._meta.__dict__)
+        self.assertEqual(Image._initialized, 2)
+
+    def test_warm_up_disabled(self):
+        # Test nothing is warmed up unless enabled or forced
+        with self.settings(WARMUP_ON_BOOT=False):
+            self.assertEqual(warm_up(), {})
+
+
+class BackfillUserCountsCommandTests(TestCase):
+    """
+    Test the counters of the users older than the counters
+    """
+
+    def test_backfill_missing_counters(self):
+        # Test the users without counters get their exact counts
+        user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.assertTrue(UserCounts.objects.filter(user=user).exists())
+        Tag.objects.create(user=user, name='Vegan')
+        UserCounts.objects.filter(user=user).delete()
+        out = StringIO()
+        call_command('backfill_user_counts', stdout=out)
+
+        self.assertIn('Counted 1 users', out.getvalue())
+        self.assertEqual(UserCounts.objects.get(user=user).tags, 1)
+
+
+class MergeDuplicateNamesCommandTests(TestCase):
+    """
+    Test the merge of the duplicated tags and ingredients
+    """
+
+    def test_merge_duplicates(self):
+        # Test duplicates are merged into the oldest object
+        user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        kept = Tag.objects.create(user=user, name='Vegan')
+        # Rows created before the unique constraint
+        Tag.objects.filter(pk=kept.pk).update(normalized_name=None)
+        duplicate = Tag.objects.create(user=user, name='vegan ')
+        both = Recipe.objects.create(
+            user=user, title='Salad', time_minutes=5, price=5.00
+        )
+        both.tags.add(kept, duplicate)
+        duplicate_only = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=5.00
+        )
+        duplicate_only.tags.add(duplicate)
+
+        call_command('merge_duplicate_names', stdout=StringIO())
+
+        kept.refresh_from_db()
+        self.assertEqual(kept.normalized_name, 'vegan')
+        self.assertFalse(Tag.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(list(both.tags.all()), [kept])
+        self.assertEqual(list(duplicate_only.tags.all()), [kept])
+
+
+class DatabaseSnapshotTests(TransactionTestCase):
+    """
+    Test the online snapshot and restore commands
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'db.sqlite3.gz')
+        self.user = get_user_model().objects.create_user(
+            email='testsnapshot@email.com',
+            password='12345qwe'
+        )
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_snapshot_and_restore(self):
+        # Test a compressed snapshot brings back the deleted data
+        Tag.objects.create(user=self.user, name='Vegan')
+        output = StringIO()
+        call_command(
+            'snapshot_db', self.path, '--pages', '1', '--sleep', '0',
+            '--compress', '--checksum', stdout=output
+        )
+        Tag.objects.all().delete()
+        call_command('restore_db', self.path, '--noinput', stdout=StringIO())
+
+        self.assertTrue(os.path.exists(f'{self.path}.sha256'))
+        self.assertIn('steps', output.getvalue())
+        self.assertEqual(
+            list(Tag.objects.values_list('name', flat=True)),
+            ['Vegan']
+        )
+
+    def test_backup_restarted_too_often_single_step(self):
+        # Test a copy restarted by the writers ends in a single step
+        source_path = os.path.join(self.directory.name, 'source.sqlite3')
+        source = backups.connect(source_path)
+        source.execute('CREATE TABLE item (data BLOB)')
+        source.executemany(
+            'INSERT INTO item VALUES (?)',
+            [(b'x' * 2000,)] * 50
+        )
+        writer = backups.connect(source_path)
+        target = backups.connect(':memory:')
+
+        def write(seconds):
+            writer.execute('INSERT INTO item VALUES (?)', (b'y',))
+
+        with mock.patch.object(backups.time, 'sleep', side_effect=write):
+            report = backups.backup(
+                source, target, pages=1, sleep=0.001, max_restarts=2
+            )
+        count = target.execute('SELECT COUNT(*) FROM item').fetchone()[0]
+        for connection in (source, writer, target):
+            connection.close()
+
+        self.assertTrue(report.single_step)
+        self.assertEqual(report.restarts, 3)
+        self.assertEqual(count, 53)
+
+    def test_failed_compression_leaves_no_files(self):
+        # Test the temporary files are removed when the compression fails
+        with mock.patch.object(
+            backups,
+            'compress',
+            side_effect=OSError('No space left on device')
+        ), self.assertRaises(OSError):
+            call_command(
+                'snapshot_db', self.path, '--compress', stdout=StringIO()
+            )
+
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_restore_checksum_mismatch(self):
+        # Test a snapshot not matching its checksum isn't restored
+        call_command(
+            'snapshot_db', self.path, '--checksum', stdout=StringIO()
+        )
+        with open(self.path, 'ab') as output:
+            output.write(b'x')
+
+        with self.assertRaises(CommandError):
+            call_command('restore_db', self.path, '--noinput')
+        self.assertTrue(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
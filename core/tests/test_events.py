@@ -0,0 +1,144 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from core import events
+from core.models import Recipe
+from core.models import Tag
+from core.sse import EventStreamApp
+
+
+PUBLISHED = []
+
+
+class RecordingBackend(events.LocalBackend):
+    """
+    Backend recording the published events
+    """
+
+    def publish(self, broker, user_id, event):
+        PUBLISHED.append((user_id, event))
+        super().publish(broker, user_id, event)
+
+
+EVENTS = {
+    'ENABLED': True,
+    'BACKEND': 'core.tests.test_events.RecordingBackend',
+    'POLL_INTERVAL': 1,
+    'RETENTION': 60,
+    'KEEPALIVE': 15,
+}
+
+
+async def not_found_app(scope, receive, send):
+    # ASGI app answering every request with a 404
+    await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+@override_settings(EVENTS=EVENTS)
+class ChangeEventsTests(TestCase):
+    """
+    Test the change events of the users
+    """
+
+    def setUp(self) -> None:
+        PUBLISHED.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+
+    def test_publish_on_commit(self):
+        # Test the changes are published once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title='Sample recipe',
+                time_minutes=10,
+                price=5.00
+            )
+            self.assertEqual(PUBLISHED, [])
+        recipe_id = recipe.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+
+        self.assertEqual(PUBLISHED, [
+            (self.user.pk, {'event': 'created', 'model': 'recipe',
+                            'id': recipe_id}),
+            (self.user.pk, {'event': 'deleted', 'model': 'recipe',
+                            'id': recipe_id}),
+        ])
+
+    def test_publish_names_created_at_once(self):
+        # Test the objects created from names publish their creation
+        with self.captureOnCommitCallbacks(execute=True):
+            tags = Tag.objects.get_or_create_many(
+                self.user,
+                ['Vegan', 'Dessert']
+            )
+
+        self.assertEqual(sorted(PUBLISHED, key=lambda item: item[1]['id']), [
+            (self.user.pk, {'event': 'created', 'model': 'tag', 'id': tag.pk})
+            for tag in sorted(tags, key=lambda tag: tag.pk)
+        ])
+
+    def test_stream_events(self):
+        # Test the feed streams the events of the authenticated user
+        token = Token.objects.create(user=self.user)
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/events/',
+            'query_string': f'token={token.key}'.encode(),
+            'headers': [],
+        }
+        sent = []
+
+        async def run_feed():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message['type'] == 'http.response.start':
+                    events.get_broker().deliver(self.user.pk, {
+                        'event': 'updated', 'model': 'tag', 'id': 1
+                    })
+                elif b'data:' in message.get('body', b''):
+                    disconnected.set()
+
+            await EventStreamApp(not_found_app)(scope, receive, send)
+
+        async_to_sync(run_feed)()
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(
+            b'event: updated\ndata: {"event":"updated","model":"tag","id":1}',
+            sent[-1]['body']
+        )
+
+    def test_stream_requires_token(self):
+        # Test the feed rejects anonymous requests
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/events/',
+            'query_string': b'',
+            'headers': [],
+        }
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async_to_sync(EventStreamApp(not_found_app))(scope, receive, send)
+
+        self.assertEqual(sent[0]['status'], 401)
@@ -0,0 +1,153 @@
+import threading
+from django.contrib.auth import get_user_model
+from django.db import OperationalError
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import groupcommit
+from core.models import Tag
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+GROUP_COMMIT = {'ENABLED': True, 'MAX_BATCH': 64, 'MAX_DELAY': 0.05}
+
+
+class RecordingWriter(groupcommit.Writer):
+    """
+    Writer recording the size of its batches
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        super().__init__(*args, **kwargs)
+
+    def _commit(self, batch):
+        # Record the batch before committing it
+        self.batches.append(len(batch))
+        super()._commit(batch)
+
+
+class WriterTests(TransactionTestCase):
+    """
+    Test the batched transactions of the group commit writer
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.writer = RecordingWriter('default', max_batch=10, max_delay=0.2)
+
+    def create_tag(self, name):
+        # Create a tag of the user
+        return Tag.objects.create(user=self.user, name=name).pk
+
+    def test_concurrent_writes_batched(self):
+        # Test concurrent writes are committed together with their results
+        futures = [
+            self.writer.submit(lambda name=name: self.create_tag(name))
+            for name in ('Vegan', 'Dessert', 'Breakfast')
+        ]
+        ids = [future.result(timeout=5) for future in futures]
+
+        self.assertEqual(self.writer.batches, [3])
+        self.assertEqual(
+            sorted(ids),
+            sorted(Tag.objects.values_list('id', flat=True))
+        )
+
+    def test_failed_write_isolated(self):
+        # Test a failing write is rolled back without the others
+        def failing_write():
+            self.create_tag('Failed')
+            raise ValueError('failed')
+
+        failed = self.writer.submit(failing_write)
+        stored = self.writer.submit(lambda: self.create_tag('Stored'))
+
+        with self.assertRaises(ValueError):
+            failed.result(timeout=5)
+        stored.result(timeout=5)
+        self.assertEqual(
+            list(Tag.objects.values_list('name', flat=True)),
+            ['Stored']
+        )
+
+    def test_failed_hook_keeps_results(self):
+        # Test a failing on_commit hook doesn't fail the stored writes
+        def failing_hook():
+            raise OperationalError('database is locked')
+
+        def write(name):
+            transaction.on_commit(failing_hook)
+            return self.create_tag(name)
+
+        futures = [
+            self.writer.submit(lambda name=name: write(name))
+            for name in ('Vegan', 'Dessert')
+        ]
+        with self.assertLogs('core.groupcommit', level='ERROR') as logs:
+            ids = [future.result(timeout=5) for future in futures]
+            self.writer.submit(lambda: None).result(timeout=5)
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(
+            sorted(ids),
+            sorted(Tag.objects.values_list('id', flat=True))
+        )
+
+
+@override_settings(GROUP_COMMIT=GROUP_COMMIT)
+class GroupCommitApiTests(TransactionTestCase):
+    """
+    Test the creates of the API through the group commit writer
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_concurrent_creates(self):
+        # Test concurrent creates each get their own response
+        responses = []
+
+        def create(name):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            responses.append(client.post(TAGS_URL, {'name': name}))
+
+        threads = [
+            threading.Thread(target=create, args=(f'Tag {index}',))
+            for index in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(
+            [res.status_code for res in responses],
+            [status.HTTP_201_CREATED] * 4
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 4)
+
+
+@override_settings(GROUP_COMMIT=GROUP_COMMIT)
+class OuterTransactionTests(TestCase):
+    """
+    Test writes of an outer transaction skip the writer
+    """
+
+    def test_run_inline(self):
+        # Test the write runs in the calling thread
+        thread = groupcommit.run(threading.current_thread)
+
+        self.assertIs(thread, threading.current_thread())
@@ -0,0 +1,153 @@
+from datetime import timedelta
+from io import StringIO
+import threading
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from core import jobs
+from core.models import Job
+
+
+CALLS = []
+
+
+def record_call(*args, **kwargs):
+    # Task recording its arguments
+    CALLS.append((args, kwargs))
+
+
+def failing_task():
+    # Task always failing
+    raise RuntimeError('failed')
+
+
+class JobQueueTests(TestCase):
+    """
+    Test the local job queue
+    """
+
+    def setUp(self) -> None:
+        CALLS.clear()
+
+    def test_enqueue_idempotency_key(self):
+        # Test a job with the same idempotency key is queued once
+        job_1 = jobs.enqueue(record_call, args=[1], idempotency_key='key')
+        job_2 = jobs.enqueue(record_call, args=[2], idempotency_key='key')
+
+        self.assertEqual(job_1.pk, job_2.pk)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(job_1.task, 'core.tests.test_jobs.record_call')
+
+    def test_run_job(self):
+        # Test a claimed job runs with its arguments
+        jobs.enqueue(record_call, args=[1], kwargs={'name': 'value'})
+        job = jobs.claim_job([Job.DEFAULT])
+        jobs.run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(CALLS, [((1,), {'name': 'value'})])
+        self.assertEqual(job.status, Job.DONE)
+        self.assertIsNone(jobs.claim_job([Job.DEFAULT]))
+
+    def test_claim_by_lane_priority(self):
+        # Test the high lane is claimed first
+        jobs.enqueue(record_call, lane=Job.LOW)
+        high = jobs.enqueue(record_call, lane=Job.HIGH)
+
+        self.assertEqual(jobs.claim_job(list(jobs.LANES.values())).pk, high.pk)
+
+    def test_failed_job_retried_then_failed(self):
+        # Test a failing job is retried later, until its last attempt
+        jobs.enqueue(failing_task, max_attempts=2)
+        with self.assertLogs('core.jobs', level='ERROR'):
+            jobs.run_job(jobs.claim_job([Job.DEFAULT]))
+        job = Job.objects.get()
+
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.jobs', level='ERROR'):
+            jobs.run_job(jobs.claim_job([Job.DEFAULT]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('RuntimeError', job.last_error)
+
+    def test_requeue_stale_jobs(self):
+        # Test jobs left running by a dead worker are queued again
+        jobs.enqueue(record_call)
+        jobs.claim_job([Job.DEFAULT])
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(jobs.requeue_stale_jobs(60), 1)
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+    def test_stale_job_out_of_attempts_failed(self):
+        # Test a stale job on its last attempt fails instead of looping
+        jobs.enqueue(record_call, max_attempts=1)
+        jobs.claim_job([Job.DEFAULT])
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs('core.jobs', level='ERROR'):
+            self.assertEqual(jobs.requeue_stale_jobs(60), 0)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stats_command(self):
+        # Test the queue depth is reported
+        jobs.enqueue(record_call)
+        out = StringIO()
+        call_command('run_workers', '--stats', stdout=out)
+
+        self.assertIn('default: 1 queued', out.getvalue())
+
+
+class RunWorkersCommandTests(TransactionTestCase):
+    """
+    Test the worker threads of the run_workers command
+    """
+
+    def setUp(self) -> None:
+        CALLS.clear()
+
+    def test_workers_run_due_jobs(self):
+        # Test the workers run the queued jobs and exit once idle
+        jobs.enqueue(record_call, args=[1])
+        jobs.enqueue(record_call, args=[2], lane=Job.HIGH)
+        call_command(
+            'run_workers', '--once', '--threads', '2', stdout=StringIO()
+        )
+
+        self.assertEqual(sorted(CALLS), [((1,), {}), ((2,), {})])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+    @override_settings(JOB_STALE_CHECK_INTERVAL=0)
+    def test_worker_requeues_stale_jobs(self):
+        # Test the workers queue again the stale jobs while they run
+        jobs.enqueue(record_call, args=[1])
+        jobs.claim_job([Job.DEFAULT])
+        Job.objects.update(started_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('core.jobs', level='WARNING'):
+            jobs.Worker([Job.DEFAULT], threading.Event(), once=True).run()
+
+        self.assertEqual(CALLS, [((1,), {})])
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    @override_settings(JOB_POLL_INTERVAL=0)
+    def test_worker_survives_errors(self):
+        # Test an unexpected error doesn't stop the worker thread
+        jobs.enqueue(record_call, args=[1])
+        claim_job = jobs.claim_job
+        errors = [RuntimeError('failed')]
+
+        def fail_once(lanes):
+            if errors:
+                raise errors.pop()
+            return claim_job(lanes)
+
+        with mock.patch.object(jobs, 'claim_job', side_effect=fail_once), \
+                self.assertLogs('core.jobs', level='ERROR'):
+            jobs.Worker([Job.DEFAULT], threading.Event(), once=True).run()
+
+        self.assertEqual(CALLS, [((1,), {})])
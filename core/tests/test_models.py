@@ -1,5 +1,7 @@
+from django.db import IntegrityError
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from core import counts
 from core import models
 from unittest.mock import patch
 
@@ -90,3 +92,79 @@ class ModelTest(TestCase):
         exp_path = f'uploads/recipe/{uuid}.jpg'
 
         self.assertEqual(file_patch, exp_path)
+
+    def test_delete_recipe_creates_tombstone(self):
+        # Test deleting a recipe records a tombstone
+        recipe = models.Recipe.objects.create(
+            user=sample_user(),
+            title='Steak and mushroom sauce',
+            time_minutes=5,
+            price=5.00
+        )
+        recipe_id = recipe.id
+        recipe.delete()
+
+        self.assertTrue(models.Tombstone.objects.filter(
+            model=models.Tombstone.RECIPE,
+            object_id=recipe_id
+        ).exists())
+
+    def test_delete_user_skips_tombstones(self):
+        # Test deleting a user doesn't leave tombstones of its objects
+        user = sample_user()
+        recipe = models.Recipe.objects.create(
+            user=user,
+            title='Steak and mushroom sauce',
+            time_minutes=5,
+            price=5.00
+        )
+        recipe.tags.add(models.Tag.objects.create(user=user, name='Meat'))
+        user.delete()
+
+        self.assertFalse(models.Tombstone.objects.exists())
+
+    def test_tag_normalized_name(self):
+        # Test a tag stores its name ignoring case and spacing
+        tag = models.Tag.objects.create(
+            user=sample_user(),
+            name='  Comfort   FOOD '
+        )
+
+        self.assertEqual(tag.normalized_name, 'comfort food')
+
+    def test_get_or_create_many(self):
+        # Test the names are resolved to existing or new objects at once
+        user = sample_user()
+        existing = models.Ingredient.objects.create(user=user, name='Salt')
+
+        with self.assertNumQueries(6):
+            ingredients = models.Ingredient.objects.get_or_create_many(
+                user,
+                ['salt', 'Pepper', 'SALT', 'Garlic']
+            )
+
+        self.assertEqual(ingredients[0], existing)
+        self.assertEqual(ingredients[2], existing)
+        self.assertEqual(
+            [ingredient.name for ingredient in ingredients],
+            ['Salt', 'Pepper', 'Salt', 'Garlic']
+        )
+        self.assertEqual(
+            models.Ingredient.objects.filter(user=user).count(),
+            3
+        )
+
+    def test_get_or_create_many_concurrent_counted_once(self):
+        # Test names created one by one after a conflict are counted once
+        user = sample_user()
+        counts.get_user_count(user, 'tags')
+
+        with patch.object(
+            type(models.Tag.objects),
+            'bulk_create',
+            side_effect=IntegrityError
+        ):
+            models.Tag.objects.get_or_create_many(user, ['Vegan', 'Dessert'])
+
+        self.assertEqual(models.Tag.objects.filter(user=user).count(), 2)
+        self.assertEqual(models.UserCounts.objects.get(user=user).tags, 2)
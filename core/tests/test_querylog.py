@@ -0,0 +1,109 @@
+from io import StringIO
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import querylog
+from core.models import QueryStat
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+QUERY_STATS_URL = reverse('query-stats')
+
+QUERY_LOG = {'ENABLED': True, 'SAMPLE_RATE': 1, 'SLOW_MS': 0}
+
+
+class NormalizeSqlTests(SimpleTestCase):
+    """
+    Test the fingerprints of the queries
+    """
+
+    def test_literals_replaced(self):
+        # Test the strings, numbers and IN lists are replaced
+        sql = (
+            'SELECT "core_tag"."id" FROM "core_tag" WHERE '
+            '("core_tag"."id" IN (%s, %s, %s) AND "core_tag"."name" = \'x\') '
+            'LIMIT 21'
+        )
+
+        self.assertEqual(
+            querylog.normalize_sql(sql),
+            'SELECT "core_tag"."id" FROM "core_tag" WHERE '
+            '("core_tag"."id" IN (...) AND "core_tag"."name" = ?) LIMIT ?'
+        )
+
+    def test_same_fingerprint(self):
+        # Test queries differing by their literals share a fingerprint
+        first = querylog.normalize_sql('SELECT 1 FROM t WHERE id IN (%s)')
+        second = querylog.normalize_sql(
+            'SELECT 1 FROM t WHERE id IN (%s, %s)'
+        )
+
+        self.assertEqual(
+            querylog.fingerprint(first),
+            querylog.fingerprint(second)
+        )
+
+
+@override_settings(QUERY_LOG=QUERY_LOG)
+class QueryLogTests(TestCase):
+    """
+    Test the query log of the sampled requests
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_queries_recorded_with_plan(self):
+        # Test the queries of a request are recorded with their origin
+        self.client.get(RECIPES_URL)
+        stat = QueryStat.objects.get(sql__contains='FROM "core_recipe"')
+
+        self.assertEqual(stat.origin, 'recipe:recipe-list list')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.slow_calls, 1)
+        self.assertIn('core_recipe', stat.plan)
+
+        self.client.get(RECIPES_URL)
+        stat.refresh_from_db()
+        self.assertEqual(stat.calls, 2)
+
+    def test_endpoint_staff_only(self):
+        # Test the query stats are only served to the staff
+        res = self.client.get(QUERY_STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(RECIPES_URL)
+        res = self.client.get(QUERY_STATS_URL, {'order': 'max'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.data)
+
+    def test_endpoint_rejects_invalid_limit(self):
+        # Test a limit below 1 or not a number is a bad request
+        self.user.is_staff = True
+        self.user.save()
+
+        for limit in ('-1', '0', 'ten'):
+            res = self.client.get(QUERY_STATS_URL, {'limit': limit})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('limit', res.data)
+
+    def test_command_report(self):
+        # Test the command prints the recorded queries
+        self.client.get(RECIPES_URL)
+        out = StringIO()
+        call_command('query_stats', '--plans', stdout=out)
+
+        self.assertIn('recipe:recipe-list list', out.getvalue())
@@ -0,0 +1,260 @@
+from datetime import timedelta
+from io import StringIO
+import os
+import tempfile
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import sharding
+from core.models import Recipe, Tag, Job, UploadSession
+
+
+SHARDS = ['shard_0', 'shard_1', 'shard_2']
+
+
+@override_settings(SHARD_DATABASES=SHARDS)
+class ShardRouterTests(SimpleTestCase):
+    """
+    Test the routing of the user data to the shards
+    """
+
+    def setUp(self) -> None:
+        self.router = sharding.UserShardRouter()
+
+    def test_shard_for_user_is_stable(self):
+        # Test a user always maps to the same shard
+        user = get_user_model()(pk=42)
+
+        self.assertIn(sharding.shard_for_user(user), SHARDS)
+        self.assertEqual(
+            sharding.shard_for_user(user),
+            sharding.shard_for_user(get_user_model()(pk=42))
+        )
+
+    def test_shard_override(self):
+        # Test the shard of the user row overrides the hash
+        user = get_user_model()(pk=42, shard='shard_2')
+
+        self.assertEqual(sharding.shard_for_user(user), 'shard_2')
+
+    def test_route_to_current_shard(self):
+        # Test queries without instance go to the shard of the request
+        with sharding.use_shard('shard_1'):
+            self.assertEqual(self.router.db_for_read(Recipe), 'shard_1')
+            self.assertEqual(
+                self.router.db_for_write(Recipe.tags.through),
+                'shard_1'
+            )
+            self.assertIsNone(self.router.db_for_read(get_user_model()))
+            self.assertIsNone(self.router.db_for_write(Job))
+
+    def test_route_by_instance(self):
+        # Test related queries follow the database of their instance
+        user = get_user_model()(pk=7, shard='shard_0')
+        tag = Tag(pk=1)
+        tag._state.db = 'shard_2'
+
+        self.assertEqual(
+            self.router.db_for_read(Recipe, instance=user),
+            'shard_0'
+        )
+        self.assertEqual(
+            self.router.db_for_read(Recipe, instance=tag),
+            'shard_2'
+        )
+
+    @override_settings(SHARD_DATABASES=[])
+    def test_disabled_without_shards(self):
+        # Test nothing is routed without shards
+        with sharding.use_shard('shard_1'):
+            self.assertIsNone(self.router.db_for_read(Recipe))
+
+
+class GlobalIdTests(TestCase):
+    """
+    Test the ids allocated across the shards
+    """
+
+    def test_allocate_unique_ids(self):
+        # Test allocated ids follow the existing ones and don't repeat
+        user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        recipe = Recipe.objects.create(
+            user=user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        sharding._id_block.update(next=0, end=0)
+        ids = [sharding.allocate_id() for _ in range(3)]
+
+        self.assertEqual(len(set(ids)), 3)
+        self.assertGreater(min(ids), recipe.pk)
+
+
+# Databases of the shards, only declared while the test case runs
+TEST_SHARDS = ['test_shard_0', 'test_shard_1']
+
+
+@override_settings(SHARD_DATABASES=TEST_SHARDS)
+class ShardedApiTests(TestCase):
+    """
+    Test the user data through the API with real shard databases
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Declare and create the shard databases before their transactions,
+        # the test runner only sets up and checks the declared databases
+        cls.databases = {'default', *TEST_SHARDS}
+        for alias in TEST_SHARDS:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            }
+            connections[alias].creation.create_test_db(
+                verbosity=0,
+                autoclobber=True,
+                serialize=False
+            )
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Drop the shard databases once their transactions are rolled back
+        super().tearDownClass()
+        for alias in TEST_SHARDS:
+            connections[alias].creation.destroy_test_db(
+                ':memory:',
+                verbosity=0
+            )
+            del connections[alias]
+            del connections.databases[alias]
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testshard@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.shard = sharding.shard_for_user(self.user)
+
+    def _create_recipe(self):
+        # Create a recipe with a tag through the API, return its id
+        res = self.client.post(reverse('recipe:recipe-list'), {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': '7.00',
+            'tag_names': ['Vegan'],
+        }, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        return res.data['id']
+
+    def test_user_mirrored_on_shard(self):
+        # Test the user row is copied to its shard only
+        other = ({*TEST_SHARDS} - {self.shard}).pop()
+
+        self.assertTrue(get_user_model().objects.using(self.shard).filter(
+            pk=self.user.pk
+        ).exists())
+        self.assertFalse(get_user_model().objects.using(other).filter(
+            pk=self.user.pk
+        ).exists())
+
+    def test_create_and_list_on_shard(self):
+        # Test the recipes, tags and relations are stored on the shard
+        recipe_id = self._create_recipe()
+        recipe = Recipe.objects.using(self.shard).get(pk=recipe_id)
+        res = self.client.get(reverse('recipe:recipe-list'))
+
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertEqual(
+            list(recipe.tags.values_list('name', flat=True)),
+            ['Vegan']
+        )
+        self.assertEqual(
+            Recipe.tags.through.objects.using(self.shard).count(),
+            1
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [recipe_id])
+
+    def test_move_user_shard(self):
+        # Test the data of a moved user is served from the new shard
+        recipe_id = self._create_recipe()
+        target = ({*TEST_SHARDS} - {self.shard}).pop()
+        call_command(
+            'move_user_shard', self.user.email, target, stdout=StringIO()
+        )
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+        res = self.client.get(reverse('recipe:recipe-list'))
+
+        self.assertEqual([r['id'] for r in res.data], [recipe_id])
+        self.assertEqual(res.data[0]['tags'], list(
+            Tag.objects.using(target).values_list('id', flat=True)
+        ))
+        self.assertFalse(Recipe.objects.using(self.shard).exists())
+        self.assertFalse(Tag.objects.using(self.shard).exists())
+
+    def test_provisioned_users_mirrored(self):
+        # Test bulk provisioned users can create data on their shard
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.csv', delete=False
+        ) as csv_file:
+            csv_file.write('email,password\nbulk@email.com,12345qwe\n')
+        try:
+            call_command(
+                'provision_users', csv_file.name, '--workers', '1',
+                stdout=StringIO()
+            )
+        finally:
+            os.remove(csv_file.name)
+        user = get_user_model().objects.get(email='bulk@email.com')
+        self.client.force_authenticate(user)
+        res = self.client.post(
+            reverse('recipe:tag-list'), {'name': 'Vegan'}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(get_user_model().objects.using(
+            sharding.shard_for_user(user)
+        ).filter(pk=user.pk).exists())
+
+    def test_delete_user_deletes_shard_data(self):
+        # Test the data and the mirror of a deleted user leave the shard
+        self._create_recipe()
+        self.user.delete()
+
+        for model in (get_user_model(), Recipe, Tag, Recipe.tags.through):
+            self.assertFalse(model.objects.using(self.shard).exists())
+
+    def test_clear_upload_sessions_on_shard(self):
+        # Test the abandoned upload sessions of the shards are deleted
+        recipe_id = self._create_recipe()
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                override_settings(RECIPE_UPLOAD_TEMP_DIR=temp_dir):
+            res = self.client.post(
+                reverse(
+                    'recipe:recipe-create-upload-session',
+                    args=[recipe_id]
+                ),
+                {'filename': 'photo.jpg', 'size': 10}
+            )
+            UploadSession.objects.using(self.shard).update(
+                updated_at=timezone.now() - timedelta(days=2)
+            )
+            call_command('clear_upload_sessions', stdout=StringIO())
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(UploadSession.objects.using(self.shard).exists())
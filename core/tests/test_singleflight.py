@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from django.test import SimpleTestCase, override_settings
+from core.singleflight import Group, FileLockGroup
+
+
+class GroupTests(SimpleTestCase):
+    """
+    Test the coalescing of concurrent calls
+    """
+
+    def _run_concurrently(self, group, fn, count=3):
+        # Call the group from several threads while fn is blocked
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(group.do('key', fn))
+            )
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+
+        return threads, results
+
+    def test_concurrent_calls_share_result(self):
+        # Test concurrent calls with the same key run fn once
+        group = Group()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, results = self._run_concurrently(group, fn)
+        # Let the other threads join the in-flight call
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results),
+                         [False, True, True])
+        self.assertEqual({result for result, _ in results}, {'result'})
+
+    def test_sequential_calls_not_shared(self):
+        # Test a finished call isn't reused
+        group = Group()
+
+        self.assertEqual(group.do('key', lambda: 1), (1, False))
+        self.assertEqual(group.do('key', lambda: 2), (2, False))
+
+    def test_failed_leader_not_shared(self):
+        # Test the error of a call is only raised to its caller
+        group = Group()
+
+        def fail():
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            group.do('key', fail)
+        self.assertEqual(group.do('key', lambda: 1), (1, False))
+
+
+class FileLockGroupTests(SimpleTestCase):
+    """
+    Test the coalescing through lock files
+    """
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory)
+
+    def test_result_written_while_waiting_is_shared(self):
+        # Test a worker waiting on the lock reads the leader result
+        leader = FileLockGroup(self.directory)
+        follower = FileLockGroup(self.directory)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 200, 'application/json', b'[]'
+
+        thread = threading.Thread(target=leader.do, args=('key', fn))
+        thread.start()
+        started.wait(5)
+        results = []
+        waiting = threading.Thread(
+            target=lambda: results.append(follower.do('key', fn))
+        )
+        waiting.start()
+        # Let the follower block on the lock file
+        time.sleep(0.1)
+        release.set()
+        thread.join()
+        waiting.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0][0], (200, 'application/json', b'[]'))
+
+    @override_settings(SINGLE_FLIGHT_FILE_TTL=60)
+    def test_old_files_swept(self):
+        # Test the files of old calls are removed, the recent ones kept
+        group = FileLockGroup(self.directory)
+        group.do('old', lambda: (200, 'application/json', b'[]'))
+        for name in os.listdir(self.directory):
+            os.utime(os.path.join(self.directory, name), (0, 0))
+        group.do('recent', lambda: (200, 'application/json', b'[]'))
+        group._next_sweep = 0
+        group.do('recent', lambda: (200, 'application/json', b'[]'))
+
+        self.assertEqual(len(os.listdir(self.directory)), 2)
@@ -0,0 +1,91 @@
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.throttling import CacheSlotStore, LocalSlotStore, get_slot_store
+
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class SlotStoreTests(TestCase):
+    """
+    Test the in-flight request counters
+    """
+
+    def test_acquire_until_limit(self):
+        # Test slots are refused once the limit is reached
+        store = LocalSlotStore()
+
+        self.assertTrue(store.acquire('key', 2))
+        self.assertTrue(store.acquire('key', 2))
+        self.assertFalse(store.acquire('key', 2))
+
+    def test_release_frees_slot(self):
+        # Test a released slot can be taken again
+        store = LocalSlotStore()
+        store.acquire('key', 1)
+        store.release('key')
+
+        self.assertTrue(store.acquire('key', 1))
+
+    def test_cache_counter_expiry_refreshed(self):
+        # Test the shared counter lives on while slots are being taken
+        cache.clear()
+        store = CacheSlotStore('default', 10)
+        with mock.patch('time.time', return_value=1000):
+            store.acquire('key', 2)
+        with mock.patch('time.time', return_value=1008):
+            store.acquire('key', 2)
+        with mock.patch('time.time', return_value=1015):
+            self.assertFalse(store.acquire('key', 2))
+
+
+@override_settings(ADMISSION_CONTROL={'LIMITS': {'recipe_attr': 1}})
+class AdmissionControlApiTests(TestCase):
+    """
+    Test write requests over the in-flight limit are shed
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.key = f'admission:recipe_attr:{self.user.pk}'
+
+    def test_write_over_limit_rejected(self):
+        # Test a write is rejected while the user is at the limit
+        store = get_slot_store()
+        store.acquire(self.key, 1)
+        try:
+            res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+        finally:
+            store.release(self.key)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    def test_slot_released_after_request(self):
+        # Test consecutive writes are admitted
+        res_1 = self.client.post(TAGS_URL, {'name': 'Vegan'})
+        res_2 = self.client.post(TAGS_URL, {'name': 'Dessert'})
+
+        self.assertEqual(res_1.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res_2.status_code, status.HTTP_201_CREATED)
+
+    def test_reads_not_limited(self):
+        # Test reads are admitted while the user is at the limit
+        store = get_slot_store()
+        store.acquire(self.key, 1)
+        try:
+            res = self.client.get(TAGS_URL)
+        finally:
+            store.release(self.key)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -0,0 +1,156 @@
+"""
+Admission control for the write heavy endpoints.
+
+DRF throttles limit the request rate, these helpers limit how many write
+requests of the same user and endpoint class are in flight at once, so a
+single client can't hold every worker (and the SQLite write lock).
+"""
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import Throttled
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULTS = {
+    'CACHE': None,
+    'CACHE_TIMEOUT': 60,
+    'RETRY_AFTER': 1,
+    'LIMITS': {},
+}
+
+
+def get_config():
+    # Return the admission control settings merged with the defaults
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'ADMISSION_CONTROL', {}))
+
+    return config
+
+
+class LocalSlotStore:
+    """
+    In-process counters of in-flight requests
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, limit):
+        # Take a slot, return False when the key is already at its limit
+        with self._lock:
+            current = self._counters.get(key, 0)
+            if current >= limit:
+                return False
+            self._counters[key] = current + 1
+
+        return True
+
+    def release(self, key):
+        # Give back a slot taken with acquire
+        with self._lock:
+            current = self._counters.pop(key, 0) - 1
+            if current > 0:
+                self._counters[key] = current
+
+
+class CacheSlotStore:
+    """
+    Counters of in-flight requests shared between workers through a cache
+    """
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        # Counters leaked by a killed worker expire after the timeout
+        self.timeout = timeout
+
+    def acquire(self, key, limit):
+        # Take a slot, return False when the key is already at its limit
+        self.cache.add(key, 0, self.timeout)
+        try:
+            current = self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, 1, self.timeout)
+            current = 1
+        if current > limit:
+            self.release(key)
+            return False
+        # incr keeps the expiry of add, the counter must outlive the
+        # requests in flight or their releases would hit a new counter
+        self.cache.touch(key, self.timeout)
+
+        return True
+
+    def release(self, key):
+        # Give back a slot taken with acquire
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            pass
+
+
+_local_store = LocalSlotStore()
+
+
+def get_slot_store():
+    # Return the configured store of in-flight counters
+    config = get_config()
+    if config['CACHE'] is None:
+        return _local_store
+
+    return CacheSlotStore(config['CACHE'], config['CACHE_TIMEOUT'])
+
+
+def acquire_slot(request, scope):
+    # Take an in-flight slot of the scope for the request and return its
+    # key, None when the scope has no limit, raise Throttled when it is full
+    config = get_config()
+    limit = config['LIMITS'].get(scope)
+    if limit is None:
+        return None
+
+    if request.user and request.user.is_authenticated:
+        ident = request.user.pk
+    else:
+        ident = BaseThrottle().get_ident(request)
+    key = f'admission:{scope}:{ident}'
+    if not get_slot_store().acquire(key, limit):
+        raise Throttled(wait=config['RETRY_AFTER'])
+
+    return key
+
+
+def release_slot(key):
+    # Give back a slot of acquire_slot
+    if key is not None:
+        get_slot_store().release(key)
+
+
+class AdmissionControlMixin:
+    """
+    Shed write requests over the in-flight limit of their scope with a 429
+    """
+    admission_scope = None
+
+    def get_admission_scope(self):
+        # Return the endpoint class used to look up the in-flight limit
+        return self.admission_scope
+
+    def initial(self, request, *args, **kwargs):
+        self._admission_key = None
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            return
+
+        self._admission_key = acquire_slot(
+            request,
+            self.get_admission_scope()
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        release_slot(getattr(self, '_admission_key', None))
+        self._admission_key = None
+
+        return super().finalize_response(request, response, *args, **kwargs)
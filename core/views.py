@@ -0,0 +1,49 @@
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from core import querylog
+from core.authentication import SignedTokenAuthentication
+
+
+class QueryStatsView(APIView):
+    """
+    Timings of the sampled queries, for the staff
+    """
+    authentication_classes = (TokenAuthentication, SignedTokenAuthentication)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        # Return the fingerprints with the highest timings
+        order = request.query_params.get('order', 'total')
+        if order not in querylog.ORDERINGS:
+            raise ValidationError({'order': [
+                f'Must be one of {", ".join(querylog.ORDERINGS)}.'
+            ]})
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            raise ValidationError({'limit': ['A valid integer is required.']})
+        # Negative slices of querysets are not supported
+        if limit < 1:
+            raise ValidationError({'limit': [
+                'Ensure this value is greater than or equal to 1.'
+            ]})
+        limit = min(limit, 100)
+
+        return Response([
+            {
+                'fingerprint': stat.fingerprint,
+                'sql': stat.sql,
+                'origin': stat.origin,
+                'calls': stat.calls,
+                'slow_calls': stat.slow_calls,
+                'total_time': stat.total_time,
+                'avg_time': stat.total_time / stat.calls,
+                'max_time': stat.max_time,
+                'plan': stat.plan,
+                'last_seen': stat.last_seen,
+            }
+            for stat in querylog.top_stats(order, limit)
+        ])
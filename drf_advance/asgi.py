@@ -14,3 +14,12 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_advance.settings')
 
 application = get_asgi_application()
+
+from core.sse import EventStreamApp  # noqa: E402
+
+# The change feed holds long-lived connections outside of the Django views
+application = EventStreamApp(application)
+
+from drf_advance.warmup import warm_up  # noqa: E402
+
+warm_up()
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.querylog.QueryLogMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -86,6 +87,20 @@ DATABASES = {
     }
 }
 
+# Shards of the recipes, tags and ingredients of the users, none keeps all
+# the data in the default database
+SHARD_DATABASES = [
+    f'shard_{index}' for index in range(int(os.environ.get('DRF_SHARDS', 0)))
+]
+
+for shard in SHARD_DATABASES:
+    DATABASES[shard] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{shard}.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['core.sharding.UserShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -137,3 +152,185 @@ STATIC_ROOT = BASE_DIR / 'static_root/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User'
+
+
+# Admission control
+# Maximum in-flight write requests per user for each endpoint class
+
+ADMISSION_CONTROL = {
+    # Alias of a shared cache, None keeps the counters in each worker
+    'CACHE': None,
+    'RETRY_AFTER': 1,
+    'LIMITS': {
+        'recipe': 4,
+        'recipe_attr': 4,
+        'upload': 1,
+        'user': 2,
+    },
+}
+
+
+# Delta sync
+# Seconds subtracted from the sync tokens to cover in-flight transactions
+
+SYNC_TOKEN_LAG = 2
+
+
+# Worker warm-up
+# Build the URL resolver, DRF settings classes, model field caches and image
+# plugins when a worker boots
+
+WARMUP_ON_BOOT = True
+
+
+# Recipe image uploads
+# Partial files of the resumable uploads stay on the MEDIA_ROOT filesystem so
+# they can be moved atomically
+
+RECIPE_UPLOAD_TEMP_DIR = MEDIA_ROOT / 'uploads/tmp/'
+
+RECIPE_IMAGE_MAX_SIZE = 20 * 1024 * 1024
+
+# Uploads are checked from their header, larger images are never decoded
+RECIPE_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+RECIPE_UPLOAD_SESSION_MAX_AGE = 24 * 60 * 60
+
+
+# Resized recipe images
+# Variants are rendered by a pool of workers into a size bounded cache
+
+RECIPE_IMAGE_CACHE_DIR = MEDIA_ROOT / 'cache/recipe/'
+
+RECIPE_IMAGE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+# Sizes of the variants, requested sizes are rounded up to the next one
+RECIPE_IMAGE_SIZES = (64, 128, 256, 512, 1024, 2048)
+
+RECIPE_IMAGE_WORKERS = 2
+
+
+# Media serving
+# The recipe images are checked by a view, then sent by the front-end server
+# when BACKEND is 'x-sendfile' or 'x-accel-redirect' (with an internal nginx
+# location at INTERNAL_URL aliasing MEDIA_ROOT), by the worker otherwise.
+# MAX_AGE is the cache lifetime of the resized variants, the originals are
+# revalidated
+
+MEDIA_SERVING = {
+    'BACKEND': os.environ.get('DRF_MEDIA_BACKEND', ''),
+    'INTERNAL_URL': '/protected-media/',
+    'MAX_AGE': 365 * 24 * 60 * 60,
+}
+
+
+# Recipes multi-get
+# Maximum number of ids of a recipes/batch/ request
+
+RECIPE_BATCH_MAX_IDS = 100
+
+
+# Id lists
+# Maximum number of ids of a filter parameter, e.g. ?tags=1,2,3, and the
+# length from which the ids are passed as a single parameter
+
+ID_LIST_MAX_IDS = 1000
+
+ID_LIST_INLINE_MAX = 50
+
+
+# Single-flight reads
+# Directory of lock files coalescing identical reads across the workers,
+# None only coalesces the threads of each worker
+
+SINGLE_FLIGHT_LOCK_DIR = None
+
+# Seconds after which the unused lock and result files are removed
+SINGLE_FLIGHT_FILE_TTL = 60
+
+
+# List counts
+# Cache of the counts of the filtered lists, the unfiltered lists are
+# counted from per-user counters
+
+COUNT_CACHE = 'default'
+
+COUNT_CACHE_TIMEOUT = 60
+
+
+# Job queue
+# Jobs are stored in the database and run by manage.py run_workers
+
+JOB_WORKER_THREADS = 4
+
+JOB_POLL_INTERVAL = 1
+
+# Seconds after which a running job of a dead worker is queued again
+JOB_STALE_TIMEOUT = 10 * 60
+
+# Seconds between the checks of the workers for stale jobs
+JOB_STALE_CHECK_INTERVAL = 60
+
+# Seconds the done jobs are kept
+JOB_RETENTION = 7 * 24 * 60 * 60
+
+
+# Group commit
+# Creates of concurrent requests are committed in batches by one writer
+# thread per database, MAX_DELAY is the time in seconds a batch waits for
+# more writes
+
+GROUP_COMMIT = {
+    'ENABLED': os.environ.get('DRF_GROUP_COMMIT') == '1',
+    'MAX_BATCH': 64,
+    'MAX_DELAY': 0.002,
+}
+
+
+# Signed auth tokens
+# Stateless tokens issued by the login next to the database tokens,
+# MAX_AGE is their lifetime in seconds
+
+SIGNED_TOKENS = {
+    'ENABLED': os.environ.get('DRF_SIGNED_TOKENS') == '1',
+    'MAX_AGE': 24 * 60 * 60,
+    # Alias of a shared cache makes revocations immediate on every worker
+    'CACHE': 'default',
+    'USER_CACHE_TIMEOUT': 5 * 60,
+    'REVOKED_CACHE_TIMEOUT': 60,
+}
+
+
+# Recipe cards
+# Recipe lists are served from pre-encoded cards refreshed on every change,
+# run manage.py check_recipe_cards --fix after enabling them
+
+RECIPE_CARDS = os.environ.get('DRF_RECIPE_CARDS') == '1'
+
+
+# Change feed
+# Server-sent events of the changes of each user, served by asgi.py.
+# LocalBackend only reaches the feeds of the process committing the change,
+# use DatabaseBackend when the API and the feed run in several processes
+
+EVENTS = {
+    'ENABLED': os.environ.get('DRF_EVENTS') == '1',
+    'BACKEND': 'core.events.LocalBackend',
+    # Seconds between the polls of DatabaseBackend
+    'POLL_INTERVAL': 1,
+    # Seconds the events of DatabaseBackend are kept
+    'RETENTION': 60,
+    # Seconds between the comments keeping idle connections open
+    'KEEPALIVE': 15,
+}
+
+
+# Query log
+# Share of the requests whose queries are timed, queries slower than
+# SLOW_MS milliseconds get their plan recorded
+
+QUERY_LOG = {
+    'ENABLED': os.environ.get('DRF_QUERY_LOG') == '1',
+    'SAMPLE_RATE': 0.05,
+    'SLOW_MS': 100,
+}
@@ -2,9 +2,22 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
+from core.views import QueryStatsView
+from recipe.views import RecipeImageFileView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path(
+        'api/query-stats/',
+        QueryStatsView.as_view(),
+        name='query-stats'
+    ),
+    # Checked by a view, the other media files are only served in DEBUG
+    path(
+        f'{settings.MEDIA_URL.lstrip("/")}uploads/recipe/<str:name>',
+        RecipeImageFileView.as_view(),
+        name='recipe-image-file'
+    ),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,88 @@
+"""
+Warm-up of a new worker before it serves live traffic.
+
+The URL resolver, the classes of the DRF settings, the field caches of the
+models and the Pillow plugins are otherwise built by the first requests of
+every worker, and kept for its lifetime. The serializer fields are not
+warmed up: DRF builds them again for every serializer instance. The DB
+connection is left alone, workers forked from a preloading master must not
+share it.
+"""
+import logging
+import time
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def _compile_patterns(resolver):
+    # Compile the regex of every URL pattern, they are compiled lazily
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if hasattr(pattern, 'url_patterns'):
+            _compile_patterns(pattern)
+
+
+def warm_up_urls():
+    # Populate the URL resolver and compile its patterns
+    from django.urls import get_resolver
+
+    resolver = get_resolver()
+    resolver.reverse_dict
+    _compile_patterns(resolver)
+
+
+def warm_up_api_settings():
+    # Import the classes of the DRF settings, the settings cache them
+    from rest_framework.settings import api_settings
+
+    for name in api_settings.import_strings:
+        getattr(api_settings, name)
+
+
+def warm_up_models():
+    # Build the field caches of the models, read by the model serializers
+    # of every request through model_meta.get_field_info()
+    from django.apps import apps
+
+    for model in apps.get_models():
+        model._meta.get_fields()
+        model._meta.fields_map
+
+
+def warm_up_images():
+    # Import Pillow and register its format plugins
+    from PIL import Image
+
+    Image.init()
+
+
+WARM_UP_STEPS = (
+    warm_up_urls,
+    warm_up_api_settings,
+    warm_up_models,
+    warm_up_images,
+)
+
+
+def warm_up(force=False):
+    # Run the warm-up steps, return the seconds spent in each of them
+    timings = {}
+    if not force and not getattr(settings, 'WARMUP_ON_BOOT', False):
+        return timings
+
+    for step in WARM_UP_STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            # A failing step only costs the first request its warm-up
+            logger.exception('Worker warm-up step %s failed', step.__name__)
+        timings[step.__name__] = time.perf_counter() - start
+    logger.info(
+        'Worker warmed up in %.1fms',
+        sum(timings.values()) * 1000
+    )
+
+    return timings
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drf_advance.settings')
 
 application = get_wsgi_application()
+
+from drf_advance.warmup import warm_up  # noqa: E402
+
+warm_up()
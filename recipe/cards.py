@@ -0,0 +1,148 @@
+"""
+Materialized recipe cards.
+
+With RECIPE_CARDS enabled each recipe keeps its RecipeSerializer and
+RecipeDetailSerializer output pre-encoded in a RecipeCard, refreshed in the
+transaction of the creation or any change of the recipe, its relations or
+the names of its tags and ingredients. Within refresh_once, e.g. a write of
+the recipe serializer, each card is refreshed once at the end of the block. The lists are then
+served by joining the stored bytes. Missing cards are rendered for the
+response without being stored, so reads never write; check_recipe_cards
+finds and fixes the missing and stale ones.
+"""
+from contextlib import contextmanager
+import contextvars
+import json
+from django.conf import settings
+from django.db import router
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from core.models import Recipe
+from core.models import RecipeCard
+
+
+# Recipe ids of the cards to refresh at the end of refresh_once, by database
+_pending = contextvars.ContextVar('pending_card_refresh', default=None)
+
+
+def is_enabled():
+    # Return whether the cards are maintained and served
+    return settings.RECIPE_CARDS
+
+
+def render_card(recipe):
+    # Return the encoded summary and detail of a recipe
+    from recipe.serializers import RecipeDetailSerializer
+    from recipe.serializers import RecipeSerializer
+
+    renderer = JSONRenderer()
+
+    return (
+        renderer.render(RecipeSerializer(recipe).data),
+        renderer.render(RecipeDetailSerializer(recipe).data),
+    )
+
+
+def build_cards(recipe_ids, using=None):
+    # Return unsaved cards rendered from the current recipes
+    recipes = Recipe.objects.using(using).filter(
+        pk__in=recipe_ids
+    ).prefetch_related('tags', 'ingredients')
+    cards = []
+    for recipe in recipes:
+        summary, detail = render_card(recipe)
+        cards.append(RecipeCard(
+            recipe=recipe,
+            user_id=recipe.user_id,
+            summary=summary,
+            detail=detail
+        ))
+
+    return cards
+
+
+def refresh_cards(recipe_ids, using=None):
+    # Store the cards of the recipes, return them
+    recipe_ids = list(recipe_ids)
+    using = using or router.db_for_write(RecipeCard)
+    cards = build_cards(recipe_ids, using)
+    with transaction.atomic(using=using):
+        RecipeCard.objects.using(using).filter(
+            recipe_id__in=recipe_ids
+        ).delete()
+        RecipeCard.objects.using(using).bulk_create(cards)
+
+    return cards
+
+
+@contextmanager
+def refresh_once():
+    # Refresh the cards of the recipes changed in the block once, at its
+    # end, in the transaction of the changes
+    if _pending.get() is not None:
+        # The outer block refreshes them
+        yield
+        return
+    pending = {}
+    token = _pending.set(pending)
+    try:
+        yield
+    finally:
+        _pending.reset(token)
+    for using, recipe_ids in pending.items():
+        refresh_cards(recipe_ids, using)
+
+
+def schedule_refresh(recipe_ids, using=None):
+    # Refresh the cards of the recipes at the end of refresh_once, right
+    # away otherwise, in the transaction of the change
+    using = using or router.db_for_write(RecipeCard)
+    pending = _pending.get()
+    if pending is None:
+        refresh_cards(recipe_ids, using)
+    else:
+        pending.setdefault(using, set()).update(recipe_ids)
+
+
+def get_cards(recipe_ids, field):
+    # Return the encoded summaries or details of the recipes in order
+    cards = RecipeCard.objects.only(field).in_bulk(recipe_ids)
+    missing = [pk for pk in recipe_ids if pk not in cards]
+    if missing:
+        # Rendered for this response only, a read must not write
+        cards.update((card.pk, card) for card in build_cards(missing))
+
+    return [bytes(getattr(cards[pk], field)) for pk in recipe_ids
+            if pk in cards]
+
+
+def encode_list(items):
+    # Join encoded items in a JSON array
+    return b'[' + b','.join(items) + b']'
+
+
+def encode_envelope(data, results):
+    # Encode a dict whose 'results' are already encoded
+    head = json.dumps(
+        {key: value for key, value in data.items() if key != 'results'},
+        separators=(',', ':')
+    ).encode()
+    separator = b',' if len(head) > 2 else b''
+
+    return head[:-1] + separator + b'"results":' + results + b'}'
+
+
+class EncodedResponse(Response):
+    """
+    Response with a body already encoded as JSON
+    """
+
+    def __init__(self, content, **kwargs):
+        super().__init__(**kwargs)
+        self.encoded_content = content
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = 'application/json'
+        return self.encoded_content
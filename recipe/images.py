@@ -0,0 +1,280 @@
+"""
+Validation and resized variants of the recipe images.
+
+Uploads are validated from their header only, the metadata is stripped
+later by the job queue so no image is decoded on the request thread.
+
+Each variant is rendered once by a small pool of Pillow workers and kept in
+a size bounded cache directory, the least recently served files are evicted
+first. Concurrent requests for a missing variant wait on the same render.
+The sizes are snapped to RECIPE_IMAGE_SIZES so a client can't fill the
+cache with variants of every dimension.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from django.conf import settings
+
+
+# Format parameter: (Pillow format, content type, file extension)
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'png': ('PNG', 'image/png', 'png'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+}
+
+# Pillow formats accepted for the uploads
+UPLOAD_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# File extension of the stored images of each Pillow format
+EXTENSIONS = {pillow: extension for pillow, _, extension in FORMATS.values()}
+
+# Eviction brings the cache down to this share of its maximum size, so the
+# next renders don't scan the directory again right away
+EVICT_TO = 0.9
+
+# Quality of the lossy uploads encoded again without their metadata, the
+# Pillow default of 75 visibly degrades the photos
+STRIPPED_QUALITY = 95
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_in_flight = {}
+_lock = threading.Lock()
+
+# Bytes in the cache directory, counted by this process since the last scan
+_cache_size = None
+_cache_size_lock = threading.Lock()
+
+
+def _get_executor():
+    # Return the pool rendering the variants
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-image'
+            )
+
+    return _executor
+
+
+def variant_path(name, version, width, height, fmt):
+    # Return the cache path of a variant of a version of the image stored as
+    # name, a new version e.g. once stripped gets new variants
+    digest = hashlib.sha1(
+        f'{name}:{version}:{width}x{height}'.encode()
+    ).hexdigest()
+
+    return os.path.join(
+        settings.RECIPE_IMAGE_CACHE_DIR,
+        f'{digest}.{FORMATS[fmt][2]}'
+    )
+
+
+def _resize(source, path, width, height, fmt):
+    # Render a variant fitting in width x height to path
+    from PIL import Image
+
+    with Image.open(source) as image:
+        # JPEG can decode straight at a reduced scale
+        image.draft('RGB', (width, height))
+        image.thumbnail((width, height))
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                image.save(output, format=FORMATS[fmt][0])
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def _render(source, path, width, height, fmt):
+    # Render a variant and keep the cache under its maximum size
+    try:
+        _resize(source, path, width, height, fmt)
+        _add_to_cache_size(os.path.getsize(path))
+    finally:
+        with _lock:
+            _in_flight.pop(path, None)
+
+
+def _add_to_cache_size(size):
+    # Count a rendered file, the directory is only scanned once it is full
+    global _cache_size
+    max_size = settings.RECIPE_IMAGE_CACHE_MAX_SIZE
+    with _cache_size_lock:
+        if _cache_size is not None:
+            _cache_size += size
+            if _cache_size <= max_size:
+                return
+        # Also resyncs with the renders of the other processes
+        _cache_size = evict(
+            settings.RECIPE_IMAGE_CACHE_DIR,
+            int(max_size * EVICT_TO)
+        )
+
+
+def snap_size(value):
+    # Return the smallest allowed size fitting value, None if too large
+    for size in sorted(settings.RECIPE_IMAGE_SIZES):
+        if size >= value:
+            return size
+
+    return None
+
+
+def evict(directory, max_size):
+    # Delete the least recently used files until the directory fits, return
+    # the size left
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return total
+
+
+def _current_variant_path(image, width, height, fmt):
+    # Return the path of a variant of the current file of an image field
+    try:
+        # The original is only replaced, by the metadata stripping
+        version = os.stat(image.path).st_mtime_ns
+    except FileNotFoundError:
+        raise InvalidImage('The image file is missing.')
+
+    return variant_path(image.name, version, width, height, fmt)
+
+
+def find_variant(image, width, height, fmt):
+    # Return the path of a variant of an image field, None until rendered
+    path = _current_variant_path(image, width, height, fmt)
+    try:
+        # The modification time orders the files for the eviction
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return path
+
+
+def get_variant(image, width, height, fmt):
+    # Return the path of a variant of an image field, rendering it once
+    path = find_variant(image, width, height, fmt)
+    if path is not None:
+        return path
+
+    path = _current_variant_path(image, width, height, fmt)
+    executor = _get_executor()
+    with _lock:
+        future = _in_flight.get(path)
+        if future is None:
+            future = _in_flight[path] = executor.submit(
+                _render, image.path, path, width, height, fmt
+            )
+    try:
+        future.result()
+    except Exception as exc:
+        # e.g. a truncated image which passed the header only probe
+        logger.warning(
+            'Variant of %s not rendered', image.name, exc_info=True
+        )
+        raise InvalidImage('The image can\'t be resized.') from exc
+
+    return path
+
+
+class InvalidImage(Exception):
+    """
+    Upload rejected by the image validation
+    """
+
+
+def probe_image(file):
+    # Check the format and dimensions of an image reading its header only
+    from PIL import Image
+
+    file.seek(0)
+    try:
+        # Image.open only parses the header, pixels are decoded on load
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except Exception:
+        raise InvalidImage('Upload a valid image. The file you uploaded was '
+                           'either not an image or a corrupted image.')
+    finally:
+        file.seek(0)
+
+    if image_format not in UPLOAD_FORMATS:
+        raise InvalidImage(
+            f'Unsupported image format, use {", ".join(UPLOAD_FORMATS)}.'
+        )
+    if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise InvalidImage(
+            f'The image is too large, {width}x{height} exceeds '
+            f'{settings.RECIPE_IMAGE_MAX_PIXELS} pixels.'
+        )
+
+    return image_format
+
+
+def strip_metadata(path):
+    # Re-encode an image without its EXIF data, applying its orientation
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        if not image.getexif():
+            return
+        image_format = image.format
+        # The colour profile is not metadata, the colours depend on it
+        options = {'icc_profile': image.info.get('icc_profile')}
+        if image_format in ('JPEG', 'WEBP'):
+            options['quality'] = STRIPPED_QUALITY
+        image = ImageOps.exif_transpose(image)
+        image.info.pop('exif', None)
+        fd, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path),
+            suffix='.tmp'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                image.save(output, format=image_format, **options)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def schedule_strip_metadata(image):
+    # Queue the stripping of the metadata of an uploaded image field
+    from core import jobs
+    from core.models import Job
+
+    return jobs.enqueue(
+        strip_metadata,
+        args=[image.path],
+        lane=Job.LOW,
+        idempotency_key=f'strip-metadata:{image.name}'
+    )
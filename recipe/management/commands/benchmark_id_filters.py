@@ -0,0 +1,62 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from django.db import connection
+from core import idlists
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Compare the inline and the single parameter id list filters
+    """
+    help = (
+        'Time a count of the recipes filtered by id lists of growing sizes, '
+        'with one bound parameter per id and with the ids in a single '
+        'parameter.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10,100,1000,10000,100000',
+            help='Comma separated list sizes.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs of each query, the best one is reported.'
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        self.stdout.write(f'{connection.vendor}: best of {options["repeat"]}')
+        self.stdout.write(f'{"ids":>8} {"inline":>12} {"parameter":>12}')
+
+        queryset = Recipe.objects.all()
+        for size in sizes:
+            ids = random.sample(range(1, size * 10 + 1), size)
+            inline = self._time(
+                lambda: queryset.filter(id__in=ids).count(),
+                options['repeat']
+            )
+            parameter = self._time(
+                lambda: idlists.filter_in_parameter(
+                    queryset, 'id', ids
+                ).count(),
+                options['repeat']
+            )
+            self.stdout.write(f'{size:>8} {inline:>12} {parameter:>12}')
+
+    def _time(self, query, repeat):
+        # Return the best time of the query in ms, or its error
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                query()
+            except DatabaseError:
+                # e.g. too many SQL variables
+                return 'error'
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return f'{min(timings):.2f} ms'
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from core.models import Recipe
+from core.models import RecipeCard
+from recipe import cards
+
+
+class Command(BaseCommand):
+    """
+    Compare the stored recipe cards with a live serialization
+    """
+    help = (
+        'Compare the stored recipe cards with the current serialization of '
+        'the recipes, fails on missing or stale cards unless --fix stores '
+        'them again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            help='Alias of the database, all the user data by default.'
+        )
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Store the missing and stale cards.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Recipes compared at once.'
+        )
+
+    def handle(self, *args, **options):
+        if options['database']:
+            aliases = [options['database']]
+        else:
+            aliases = settings.SHARD_DATABASES or [DEFAULT_DB_ALIAS]
+
+        missing = stale = 0
+        for alias in aliases:
+            recipe_ids = list(Recipe.objects.using(alias).order_by(
+                'pk'
+            ).values_list('pk', flat=True))
+            size = options['chunk_size']
+            for start in range(0, len(recipe_ids), size):
+                chunk = recipe_ids[start:start + size]
+                chunk_missing, chunk_stale = self._check(chunk, alias)
+                missing += len(chunk_missing)
+                stale += len(chunk_stale)
+                if options['fix'] and (chunk_missing or chunk_stale):
+                    cards.refresh_cards(chunk_missing + chunk_stale, alias)
+
+        message = f'{missing} missing and {stale} stale recipe cards'
+        if (missing or stale) and not options['fix']:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(
+            f'{message}, fixed' if missing or stale else message
+        ))
+
+    def _check(self, recipe_ids, alias):
+        # Return the ids of the recipes with a missing and a stale card
+        stored = RecipeCard.objects.using(alias).in_bulk(recipe_ids)
+        missing = []
+        stale = []
+        for card in cards.build_cards(recipe_ids, alias):
+            current = stored.get(card.pk)
+            if current is None:
+                missing.append(card.pk)
+            elif (bytes(current.summary), bytes(current.detail)) != (
+                card.summary, card.detail
+            ):
+                stale.append(card.pk)
+
+        return missing, stale
@@ -0,0 +1,59 @@
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from core.models import UploadSession
+
+
+class Command(BaseCommand):
+    """
+    Delete the abandoned resumable uploads
+    """
+    help = (
+        'Delete the upload sessions not updated for --max-age seconds and '
+        'the partial files left without session.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int,
+            default=settings.RECIPE_UPLOAD_SESSION_MAX_AGE,
+            help='Seconds of inactivity after which a session is deleted.'
+        )
+
+    def handle(self, *args, **options):
+        max_age = options['max_age']
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+        aliases = settings.SHARD_DATABASES or [DEFAULT_DB_ALIAS]
+        sessions = 0
+        for alias in aliases:
+            # The partial files are removed by the post_delete receiver
+            deleted, _ = UploadSession.objects.using(alias).filter(
+                updated_at__lt=cutoff
+            ).delete()
+            sessions += deleted
+
+        orphans = 0
+        temp_dir = settings.RECIPE_UPLOAD_TEMP_DIR
+        if os.path.isdir(temp_dir):
+            # The partial files of every shard share the directory
+            active = {
+                f'{session_id}.part'
+                for alias in aliases
+                for session_id in UploadSession.objects.using(
+                    alias
+                ).values_list('id', flat=True)
+            }
+            for entry in os.scandir(temp_dir):
+                if entry.name in active or not entry.is_file():
+                    continue
+                if entry.stat().st_mtime < time.time() - max_age:
+                    os.remove(entry.path)
+                    orphans += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {sessions} upload sessions and {orphans} orphan files'
+        ))
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from core import counts
+
+
+# Query parameters that don't change the number of objects of a list
+UNFILTERED_PARAMS = {'limit', 'offset', 'count', 'ordering', 'format'}
+
+
+class CountedLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination, enabled by the limit parameter, with cheap counts
+    """
+    max_limit = 100
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.with_count = request.query_params.get(
+            self.count_query_param
+        ) not in ('0', 'false')
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        # One more row tells whether there is a next page
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+
+        return page[:self.limit]
+
+    def get_count(self, queryset):
+        # Return the counter of the user for unfiltered lists
+        user = self.request.user
+        count_field = getattr(self.view, 'count_field', None)
+        filtered = set(self.request.query_params) - UNFILTERED_PARAMS
+        if count_field and not filtered:
+            return counts.get_user_count(user, count_field)
+
+        return counts.get_cached_count(user.pk, queryset)
+
+    def get_next_link(self):
+        if self.with_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+
+        return replace_query_param(
+            url,
+            self.offset_query_param,
+            self.offset + self.limit
+        )
+
+    def get_paginated_response(self, data):
+        if self.with_count:
+            return super().get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
@@ -1,10 +1,55 @@
+import os
+from django.conf import settings
+from django.db import router
+from django.db import transaction
 from rest_framework import serializers
 from core.models import Tag
 from core.models import Ingredient
 from core.models import Recipe
+from core.models import UploadSession
+from recipe import cards
+from recipe import images
 
 
-class TagSerializer(serializers.ModelSerializer):
+class BoundedImageField(serializers.FileField):
+    """
+    Image upload validated from its header, bounded in bytes and pixels
+    """
+    default_error_messages = {
+        'too_large': 'The file is too large, the maximum is {max_size} bytes.',
+    }
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+        if file.size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        try:
+            image_format = images.probe_image(file)
+        except images.InvalidImage as exc:
+            raise serializers.ValidationError(str(exc), code='invalid_image')
+        # The stored extension follows the format, not the client filename
+        file.name = f'image.{images.EXTENSIONS[image_format]}'
+
+        return file
+
+
+class RecipeAttrSerializer(serializers.ModelSerializer):
+    """
+    Serializer returning the existing object of a name on create
+    """
+    created = False
+
+    def create(self, validated_data):
+        # Create the object unless the user has one with the same name
+        instance, self.created = self.Meta.model.objects.get_or_create_name(
+            validated_data['user'],
+            validated_data['name']
+        )
+
+        return instance
+
+
+class TagSerializer(RecipeAttrSerializer):
     """
     Serializer for the tag object
     """
@@ -15,7 +60,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(RecipeAttrSerializer):
     """
     Serializer for the tag object
     """
@@ -32,19 +77,72 @@ class RecipeSerializer(serializers.ModelSerializer):
     """
     ingredients = serializers.PrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Ingredient.objects.all()
     )
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
+        required=False,
         queryset=Tag.objects.all()
     )
+    # Names resolved to the user's objects, the missing ones are created
+    ingredient_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        write_only=True,
+        required=False
+    )
+    tag_names = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        write_only=True,
+        required=False
+    )
 
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredients', 'tags',
+                  'ingredient_names', 'tag_names',
                   'time_minutes', 'price', 'link')
         read_only_fields = ('id',)
 
+    def create(self, validated_data):
+        # Create the recipe, its named objects and relations at once, its
+        # card is refreshed once before the commit
+        using = router.db_for_write(Recipe)
+        with transaction.atomic(using=using), cards.refresh_once():
+            self._resolve_names(validated_data['user'], validated_data)
+
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        # Update the recipe, its named objects and relations at once, its
+        # card is refreshed once before the commit
+        using = router.db_for_write(Recipe)
+        with transaction.atomic(using=using), cards.refresh_once():
+            self._resolve_names(instance.user, validated_data, instance)
+
+            return super().update(instance, validated_data)
+
+    def _resolve_names(self, user, validated_data, instance=None):
+        # Add the objects of the names to the ids of the relations
+        for field, names_field, model in (
+            ('ingredients', 'ingredient_names', Ingredient),
+            ('tags', 'tag_names', Tag),
+        ):
+            names = validated_data.pop(names_field, None)
+            if not names:
+                continue
+            if field in validated_data:
+                current = validated_data[field]
+            elif instance is not None and self.partial:
+                # A partial update without the ids keeps the current objects
+                current = list(getattr(instance, field).all())
+            else:
+                current = []
+            validated_data[field] = list(dict.fromkeys([
+                *current,
+                *model.objects.get_or_create_many(user, names)
+            ]))
+
 
 class RecipeDetailSerializer(RecipeSerializer):
     """
@@ -58,7 +156,56 @@ class RecipeImageSerializer(serializers.ModelSerializer):
     """
     Serialize and image
     """
+    image = BoundedImageField()
+
     class Meta:
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """
+    Serialize a resumable upload of a recipe image
+    """
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'offset')
+        read_only_fields = ('id', 'offset')
+
+    def validate_filename(self, value):
+        # Keep the base name only, the stored name doesn't use it
+        name = os.path.basename(value.replace('\\', '/')).strip()
+        if name in ('', '.', '..') or any(ord(char) < 32 for char in name):
+            raise serializers.ValidationError('Enter a valid file name.')
+
+        return name
+
+    def validate_size(self, value):
+        # Validate the announced size of the file
+        if value < 1 or value > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'The size must be between 1 and '
+                f'{settings.RECIPE_IMAGE_MAX_SIZE} bytes.'
+            )
+
+        return value
+
+
+class ShoppingListItemSerializer(serializers.Serializer):
+    """
+    Serialize an ingredient entry of a shopping list
+    """
+    id = serializers.IntegerField(source='ingredient_id')
+    name = serializers.CharField(source='ingredient__name')
+    recipes = serializers.IntegerField()
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    """
+    Serialize the aggregated shopping list of several recipes
+    """
+    recipes = serializers.IntegerField()
+    ingredients = ShoppingListItemSerializer(many=True)
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    total_time_minutes = serializers.IntegerField()
@@ -0,0 +1,62 @@
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from core.models import Tag
+from core.models import Ingredient
+from core.models import Recipe
+from recipe import cards
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_saved_recipe_card(sender, instance, using, **kwargs):
+    if cards.is_enabled():
+        cards.schedule_refresh([instance.pk], using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def refresh_related_recipe_cards(sender, instance, action, reverse, pk_set,
+                                 using, **kwargs):
+    if not cards.is_enabled():
+        return
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            cards.schedule_refresh([instance.pk], using)
+    elif action in ('post_add', 'post_remove'):
+        cards.schedule_refresh(pk_set, using)
+    elif action == 'pre_clear':
+        instance._card_recipe_ids = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        cards.schedule_refresh(instance._card_recipe_ids, using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def refresh_renamed_recipe_cards(sender, instance, created, using, **kwargs):
+    # The cards show the names of the tags and ingredients
+    if cards.is_enabled() and not created:
+        cards.schedule_refresh(
+            instance.recipe_set.values_list('pk', flat=True),
+            using
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def collect_recipe_cards(sender, instance, **kwargs):
+    # The relations are gone once the object is deleted
+    if cards.is_enabled():
+        instance._card_recipe_ids = list(
+            instance.recipe_set.values_list('pk', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def refresh_unrelated_recipe_cards(sender, instance, using, **kwargs):
+    if cards.is_enabled() and getattr(instance, '_card_recipe_ids', None):
+        cards.schedule_refresh(instance._card_recipe_ids, using)
@@ -0,0 +1,150 @@
+from io import StringIO
+from unittest.mock import patch
+import json
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Ingredient, Recipe, RecipeCard, Tag
+from recipe import cards
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+BATCH_URL = reverse('recipe:recipe-batch')
+
+
+def sample_recipe(user, **params) -> Recipe:
+    # Create and return recipe
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+@override_settings(RECIPE_CARDS=True)
+class RecipeCardsApiTests(TestCase):
+    """
+    Test the recipe lists served from the stored cards
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = sample_recipe(user=self.user)
+        self.recipe.tags.add(self.tag)
+
+    def test_list_matches_serializers(self):
+        # Test the cards list is the list of the serializers
+        sample_recipe(user=self.user, title='Soup')
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with override_settings(RECIPE_CARDS=False):
+            expected = self.client.get(RECIPES_URL)
+        self.assertEqual(json.loads(res.content), expected.json())
+        self.assertEqual(RecipeCard.objects.count(), 2)
+
+    def test_paginated_list(self):
+        # Test a page of cards keeps the pagination envelope
+        sample_recipe(user=self.user, title='Soup')
+        res = self.client.get(RECIPES_URL, {'limit': 1})
+        data = json.loads(res.content)
+
+        self.assertEqual(data['count'], 2)
+        self.assertIn('offset=1', data['next'])
+        self.assertEqual(len(data['results']), 1)
+
+    def test_missing_card_not_stored_on_read(self):
+        # Test a missing card is served without writing it
+        RecipeCard.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(res.content)), 1)
+        self.assertFalse(RecipeCard.objects.exists())
+        self.assertFalse(any(
+            query['sql'].startswith(('INSERT', 'DELETE'))
+            for query in queries
+        ))
+
+    def test_update_refreshes_card_once(self):
+        # Test an update with relations refreshes the card once
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+        with patch(
+            'recipe.cards.refresh_cards',
+            wraps=cards.refresh_cards
+        ) as refresh:
+            res = self.client.put(
+                reverse('recipe:recipe-detail', args=[self.recipe.id]),
+                {
+                    'title': 'Soup',
+                    'tags': [],
+                    'ingredients': [ingredient.id],
+                    'time_minutes': 10,
+                    'price': '5.00',
+                },
+                format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(refresh.call_count, 1)
+        card = RecipeCard.objects.get(pk=self.recipe.pk)
+        self.assertEqual(json.loads(card.summary)['title'], 'Soup')
+        self.assertEqual(
+            json.loads(card.summary)['ingredients'],
+            [ingredient.id]
+        )
+
+    def test_failed_refresh_rolls_back_update(self):
+        # Test the update and the refresh of its card commit together
+        with patch(
+            'recipe.cards.refresh_cards',
+            side_effect=OperationalError('database is locked')
+        ), self.assertRaises(OperationalError):
+            self.client.patch(
+                reverse('recipe:recipe-detail', args=[self.recipe.id]),
+                {'title': 'Soup'},
+                format='json'
+            )
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Sample recipe')
+
+    def test_tag_rename_refreshes_card(self):
+        # Test renaming a tag updates the details of its recipes
+        self.tag.name = 'Vegetarian'
+        self.tag.save()
+        res = self.client.get(BATCH_URL, {'ids': self.recipe.id, 'detail': 1})
+        data = json.loads(res.content)
+
+        self.assertEqual(data['missing'], [])
+        self.assertEqual(data['results'][0]['tags'][0]['name'], 'Vegetarian')
+
+    def test_check_command(self):
+        # Test stale cards are reported and fixed
+        Recipe.objects.filter(pk=self.recipe.pk).update(title='Changed')
+
+        with self.assertRaises(CommandError):
+            call_command('check_recipe_cards', stdout=StringIO())
+        call_command('check_recipe_cards', '--fix', stdout=StringIO())
+        call_command('check_recipe_cards', stdout=StringIO())
+        card = RecipeCard.objects.get(pk=self.recipe.pk)
+        self.assertEqual(json.loads(card.summary)['title'], 'Changed')
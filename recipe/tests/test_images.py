@@ -0,0 +1,402 @@
+from unittest.mock import patch
+import os
+import shutil
+import tempfile
+import threading
+import time
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Job, Recipe
+from recipe import images
+from PIL import Image
+from PIL import ImageCms
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+CACHE_DIR = os.path.join(MEDIA_ROOT, 'cache/recipe/')
+
+
+def image_url(recipe_id):
+    # Return URL where the recipe image is served
+    return reverse('recipe:recipe-image-variant', args=[recipe_id])
+
+
+def sample_jpeg(width=100, height=50) -> bytes:
+    # Return the bytes of a JPEG image
+    with tempfile.TemporaryFile() as output:
+        Image.new('RGB', (width, height)).save(output, format='JPEG')
+        output.seek(0)
+        return output.read()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, RECIPE_IMAGE_CACHE_DIR=CACHE_DIR)
+class ImageVariantApiTests(TestCase):
+    """
+    Test the resized recipe images
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testimage@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        self.recipe.image.save(
+            'photo.jpg',
+            SimpleUploadedFile('photo.jpg', sample_jpeg())
+        )
+
+    def test_resized_variant(self):
+        # Test the variant fits in the requested size
+        res = self.client.get(image_url(self.recipe.id), {'w': 64})
+        with tempfile.TemporaryFile() as output:
+            output.write(b''.join(res.streaming_content))
+            output.seek(0)
+            size = Image.open(output).size
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(size, (64, 32))
+
+    def test_sizes_snapped(self):
+        # Test close sizes share the variant of the next allowed size
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        before = set(os.listdir(CACHE_DIR))
+        self.client.get(image_url(self.recipe.id), {'w': 40, 'h': 40})
+        self.client.get(image_url(self.recipe.id), {'w': 50, 'h': 60})
+
+        self.assertEqual(len(set(os.listdir(CACHE_DIR)) - before), 1)
+
+    def test_render_admission(self):
+        # Test renders are limited like uploads, cached variants are not
+        self.client.get(image_url(self.recipe.id), {'w': 64})
+        with override_settings(ADMISSION_CONTROL={'LIMITS': {'upload': 0}}):
+            res_1 = self.client.get(image_url(self.recipe.id), {'w': 64})
+            res_2 = self.client.get(image_url(self.recipe.id), {'w': 128})
+
+        self.assertEqual(res_1.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_2.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_render_failure(self):
+        # Test an image failing to decode is a 404, not a server error
+        with open(self.recipe.image.path, 'r+b') as image:
+            image.truncate(200)
+        with self.assertLogs('recipe.images', 'WARNING'):
+            res = self.client.get(image_url(self.recipe.id), {'w': 64})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cache_size_tracked(self):
+        # Test the directory is only scanned once the cache is full
+        with patch('recipe.images._cache_size', 0), \
+                patch('recipe.images.evict', return_value=0) as evict:
+            images._add_to_cache_size(10)
+            with override_settings(RECIPE_IMAGE_CACHE_MAX_SIZE=15):
+                images._add_to_cache_size(10)
+
+        self.assertEqual(evict.call_count, 1)
+
+    def test_variant_cache_headers(self):
+        # Test the variants are cached, the original revalidated
+        res_1 = self.client.get(image_url(self.recipe.id), {'w': 64})
+        res_2 = self.client.get(image_url(self.recipe.id))
+
+        self.assertIn('immutable', res_1['Cache-Control'])
+        self.assertIn('no-cache', res_2['Cache-Control'])
+        self.assertNotIn('immutable', res_2['Cache-Control'])
+
+    def test_stripped_image_gets_new_variants(self):
+        # Test replacing the original, e.g. by the stripping, changes the
+        # variant path
+        path = images.get_variant(self.recipe.image, 64, 64, 'jpeg')
+        stat = os.stat(self.recipe.image.path)
+        os.utime(
+            self.recipe.image.path,
+            ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000)
+        )
+
+        self.assertNotEqual(
+            images.get_variant(self.recipe.image, 64, 64, 'jpeg'),
+            path
+        )
+
+    def test_original_image(self):
+        # Test the original image is served without parameters
+        res = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), sample_jpeg())
+
+    def test_invalid_parameters(self):
+        # Test invalid sizes and formats are rejected
+        res_1 = self.client.get(image_url(self.recipe.id), {'w': 'abc'})
+        res_2 = self.client.get(image_url(self.recipe.id), {'w': 100000})
+        res_3 = self.client.get(image_url(self.recipe.id), {'fmt': 'bmp'})
+
+        self.assertEqual(res_1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res_2.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res_3.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_requests_render_once(self):
+        # Test concurrent requests of a missing variant share one render
+        calls = []
+        resize = images._resize
+
+        def slow_resize(*args):
+            calls.append(args)
+            time.sleep(0.1)
+            resize(*args)
+
+        with patch('recipe.images._resize', side_effect=slow_resize):
+            threads = [
+                threading.Thread(
+                    target=images.get_variant,
+                    args=(self.recipe.image, 30, 30, 'png')
+                )
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            images.get_variant(self.recipe.image, 30, 30, 'png')
+
+        self.assertEqual(len(calls), 1)
+
+    def test_evict_least_recently_used(self):
+        # Test the oldest files are deleted first
+        directory = tempfile.mkdtemp(dir=MEDIA_ROOT)
+        for index, name in enumerate(('old', 'recent')):
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as output:
+                output.write(b'x' * 10)
+            os.utime(path, (index, index))
+        images.evict(directory, 15)
+
+        self.assertEqual(os.listdir(directory), ['recent'])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageFileApiTests(TestCase):
+    """
+    Test the stored recipe images served to their owner
+    """
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testimagefile@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        self.recipe.image.save(
+            'photo.jpg',
+            SimpleUploadedFile('photo.jpg', sample_jpeg())
+        )
+        self.url = reverse(
+            'recipe-image-file',
+            args=[os.path.basename(self.recipe.image.name)]
+        )
+
+    def test_owner_only(self):
+        # Test the image is served to the owner of the recipe only
+        other = get_user_model().objects.create_user(
+            email='testimageother@email.com',
+            password='12345qwe'
+        )
+        res = self.client.get(self.url)
+        self.client.force_authenticate(other)
+        res_other = self.client.get(self.url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), sample_jpeg())
+        self.assertIn('private', res['Cache-Control'])
+        self.assertIn('no-cache', res['Cache-Control'])
+        self.assertEqual(res_other.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_range_request(self):
+        # Test a single range is served as partial content
+        size = len(sample_jpeg())
+        res_1 = self.client.get(self.url, HTTP_RANGE='bytes=2-11')
+        res_2 = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        res_3 = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+
+        self.assertEqual(res_1.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(res_1['Content-Range'], f'bytes 2-11/{size}')
+        self.assertEqual(
+            b''.join(res_1.streaming_content),
+            sample_jpeg()[2:12]
+        )
+        self.assertEqual(
+            b''.join(res_2.streaming_content),
+            sample_jpeg()[-4:]
+        )
+        self.assertEqual(
+            res_3.status_code,
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+    def test_not_modified(self):
+        # Test a request with the current ETag isn't sent the file again
+        etag = self.client.get(self.url)['ETag']
+        res = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_front_end_server(self):
+        # Test the file is handed to the front-end server when configured
+        with override_settings(MEDIA_SERVING={
+            'BACKEND': 'x-accel-redirect',
+            'INTERNAL_URL': '/protected-media/',
+            'MAX_AGE': 60,
+        }):
+            res_1 = self.client.get(self.url)
+        with override_settings(MEDIA_SERVING={
+            'BACKEND': 'x-sendfile',
+            'INTERNAL_URL': '/protected-media/',
+            'MAX_AGE': 60,
+        }):
+            res_2 = self.client.get(self.url)
+
+        self.assertEqual(
+            res_1['X-Accel-Redirect'],
+            f'/protected-media/{self.recipe.image.name}'
+        )
+        self.assertEqual(res_1.content, b'')
+        self.assertEqual(
+            res_2['X-Sendfile'],
+            os.path.realpath(self.recipe.image.path)
+        )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageValidationTests(TestCase):
+    """
+    Test the header only validation of the uploaded images
+    """
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testvalidation@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        self.url = reverse('recipe:recipe-upload-image', args=[self.recipe.id])
+
+    def _upload(self, image_format, size=(10, 10)):
+        # Upload an image in the given format
+        with tempfile.NamedTemporaryFile(suffix='.img') as ntf:
+            Image.new('RGB', size).save(ntf, format=image_format)
+            ntf.seek(0)
+            return self.client.post(
+                self.url,
+                {'image': ntf},
+                format='multipart'
+            )
+
+    def test_upload_queues_metadata_stripping(self):
+        # Test the metadata is stripped by a queued job
+        res = self._upload('JPEG')
+        self.recipe.refresh_from_db()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # The extension follows the format, not the .img of the client
+        self.assertTrue(self.recipe.image.name.endswith('.jpg'))
+        self.assertTrue(Job.objects.filter(
+            task='recipe.images.strip_metadata',
+            args=[self.recipe.image.path]
+        ).exists())
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=50)
+    def test_upload_too_many_pixels(self):
+        # Test images over the pixel limit are rejected
+        res = self._upload('PNG', size=(10, 10))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', res.data)
+
+    def test_upload_unsupported_format(self):
+        # Test images in other formats are rejected
+        res = self._upload('BMP')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=100)
+    def test_upload_too_many_bytes(self):
+        # Test files over the byte limit are rejected
+        res = self._upload('PNG', size=(200, 200))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_probe_reads_header_only(self):
+        # Test a truncated image passes the probe without decoding
+        with tempfile.TemporaryFile() as output:
+            Image.new('RGB', (50, 50)).save(output, format='PNG')
+            output.truncate(100)
+            output.seek(0)
+
+            self.assertEqual(images.probe_image(output), 'PNG')
+
+    def test_strip_metadata(self):
+        # Test the EXIF data is removed from the image
+        path = os.path.join(MEDIA_ROOT, 'exif.jpg')
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera maker'
+        Image.new('RGB', (10, 10)).save(path, format='JPEG', exif=exif)
+        images.strip_metadata(path)
+
+        with Image.open(path) as image:
+            self.assertEqual(dict(image.getexif()), {})
+
+    def test_strip_metadata_keeps_profile_and_quality(self):
+        # Test the colour profile is kept and the photo barely re-compressed
+        path = os.path.join(MEDIA_ROOT, 'profile.jpg')
+        profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera maker'
+        with patch.object(Image.Image, 'save', autospec=True,
+                          side_effect=Image.Image.save) as save:
+            Image.new('RGB', (10, 10)).save(
+                path,
+                format='JPEG',
+                exif=exif,
+                icc_profile=profile.tobytes()
+            )
+            images.strip_metadata(path)
+
+        self.assertEqual(
+            save.call_args.kwargs['quality'],
+            images.STRIPPED_QUALITY
+        )
+        with Image.open(path) as image:
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertEqual(image.info['icc_profile'], profile.tobytes())
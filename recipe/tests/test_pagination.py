@@ -0,0 +1,156 @@
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core import counts
+from core.models import Recipe, Tag, UserCounts
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def sample_recipe(user, **params) -> Recipe:
+    # Create and return recipe
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PaginationApiTests(TestCase):
+    """
+    Test the paginated lists and their counts
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for index in range(3):
+            sample_recipe(user=self.user, time_minutes=index)
+
+    def test_list_not_paginated_without_limit(self):
+        # Test lists stay plain lists without the limit parameter
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 3)
+
+    def test_paginated_list(self):
+        # Test a page with its count and next link
+        res = self.client.get(RECIPES_URL, {'limit': 2})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 3)
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIn('offset=2', res.data['next'])
+
+    def test_unfiltered_count_uses_counter(self):
+        # Test the unfiltered count comes from the user counters
+        UserCounts.objects.filter(user=self.user).update(recipes=42)
+        res = self.client.get(RECIPES_URL, {'limit': 2})
+
+        self.assertEqual(res.data['count'], 42)
+
+    def test_counter_follows_changes(self):
+        # Test the counters are kept by creations and deletions
+        sample_recipe(user=self.user)
+        Recipe.objects.filter(user=self.user).first().delete()
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        counts = UserCounts.objects.get(user=self.user)
+        self.assertEqual(counts.recipes, 3)
+        self.assertEqual(counts.tags, 1)
+
+    def test_count_without_counter_not_stored(self):
+        # Test a list of a user without counter counts without writing
+        UserCounts.objects.filter(user=self.user).delete()
+        res = self.client.get(RECIPES_URL, {'limit': 2})
+
+        self.assertEqual(res.data['count'], 3)
+        self.assertFalse(UserCounts.objects.filter(user=self.user).exists())
+
+    def test_fill_keeps_concurrent_creation(self):
+        # Test a recipe created once the counter exists is counted once
+        UserCounts.objects.filter(user=self.user).delete()
+        get_or_create = QuerySet.get_or_create
+
+        def create_then_add_recipe(queryset, **kwargs):
+            result = get_or_create(queryset, **kwargs)
+            sample_recipe(user=self.user)
+            return result
+
+        with mock.patch.object(
+            QuerySet,
+            'get_or_create',
+            autospec=True,
+            side_effect=create_then_add_recipe
+        ):
+            counts.fill_user_counts(self.user)
+        sample_recipe(user=self.user)
+
+        self.assertEqual(UserCounts.objects.get(user=self.user).recipes, 5)
+
+    def test_pages_ordered_without_ordering(self):
+        # Test the pages follow the ids without the ordering parameter
+        res_1 = self.client.get(RECIPES_URL, {'limit': 2})
+        res_2 = self.client.get(RECIPES_URL, {'limit': 2, 'offset': 2})
+
+        ids = [recipe['id'] for recipe in res_1.data['results']]
+        ids += [recipe['id'] for recipe in res_2.data['results']]
+        self.assertEqual(
+            ids,
+            list(Recipe.objects.order_by('id').values_list('id', flat=True))
+        )
+
+    def test_filtered_count_cached_until_change(self):
+        # Test filtered counts are cached and invalidated by changes
+        params = {'limit': 1, 'max_time': 1}
+        res_1 = self.client.get(RECIPES_URL, params)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(RECIPES_URL, params)
+        sample_recipe(user=self.user, time_minutes=0)
+        res_2 = self.client.get(RECIPES_URL, params)
+
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries.captured_queries)
+        )
+        self.assertEqual(res_1.data['count'], 2)
+        self.assertEqual(res_2.data['count'], 3)
+
+    def test_list_without_count(self):
+        # Test clients can opt out of the count
+        res_1 = self.client.get(RECIPES_URL, {'limit': 2, 'count': 'false'})
+        res_2 = self.client.get(
+            RECIPES_URL,
+            {'limit': 2, 'offset': 2, 'count': 'false'}
+        )
+
+        self.assertNotIn('count', res_1.data)
+        self.assertEqual(len(res_1.data['results']), 2)
+        self.assertIsNotNone(res_1.data['next'])
+        self.assertEqual(len(res_2.data['results']), 1)
+        self.assertIsNone(res_2.data['next'])
+
+    def test_tags_paginated(self):
+        # Test the tags list is paginated too
+        Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        res = self.client.get(TAGS_URL, {'limit': 1})
+
+        self.assertEqual(res.data['count'], 2)
+        self.assertEqual(len(res.data['results']), 1)
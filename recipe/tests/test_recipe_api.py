@@ -1,16 +1,21 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 from core.models import Recipe, Tag, Ingredient
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.serializers import TagSerializer
 from PIL import Image
 import tempfile
 import os
 
 
 RECIP_URL = reverse('recipe:recipe-list')
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+BATCH_URL = reverse('recipe:recipe-batch')
 
 
 def image_upload_url(recipe_id) -> str:
@@ -163,6 +168,47 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient_1, ingredients)
         self.assertIn(ingredient_2, ingredients)
 
+    def test_create_recipe_with_names(self):
+        # Test create recipe with the names of new and existing objects
+        tag = sample_tag(user=self.user, name='Vegan')
+        payload = {
+            'title': 'Avocado toast',
+            'tags': [tag.id],
+            'tag_names': ['vegan', 'Breakfast'],
+            'ingredient_names': ['Avocado', 'Bread', 'avocado'],
+            'time_minutes': 10,
+            'price': 4.00
+        }
+        res = self.client.post(RECIP_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=res.data['id'])
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['Breakfast', 'Vegan']
+        )
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('name', flat=True)),
+            ['Avocado', 'Bread']
+        )
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+
+    def test_partial_update_with_names_keeps_objects(self):
+        # Test patching names adds to the current objects
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user, name='Vegan'))
+        res = self.client.patch(
+            detail_url(recipe.id),
+            {'tag_names': ['New']},
+            format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['New', 'Vegan']
+        )
+
 
 class RecipeImageUploadTests(TestCase):
     """
@@ -238,3 +284,351 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer_1.data, res.data)
         self.assertIn(serializer_2.data, res.data)
         self.assertNotIn(serializer_3.data, res.data)
+
+
+class ShoppingListApiTests(TestCase):
+    """
+    Test the aggregated shopping list of several recipes
+    """
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testshopping@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_shopping_list_aggregates_ingredients(self):
+        # Test ingredients are de-duplicated and counted per recipe
+        salt = sample_ingredient(user=self.user, name='Salt')
+        eggs = sample_ingredient(user=self.user, name='Eggs')
+        recipe_1 = sample_recipe(user=self.user, time_minutes=10, price=2.50)
+        recipe_2 = sample_recipe(user=self.user, time_minutes=20, price=4.00)
+        recipe_1.ingredients.add(salt, eggs)
+        recipe_2.ingredients.add(salt)
+        res = self.client.get(
+            SHOPPING_LIST_URL,
+            {'ids': '{},{}'.format(recipe_1.id, recipe_2.id)}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipes'], 2)
+        self.assertEqual(res.data['total_price'], '6.50')
+        self.assertEqual(res.data['total_time_minutes'], 30)
+        self.assertEqual(
+            [dict(item) for item in res.data['ingredients']],
+            [
+                {'id': eggs.id, 'name': 'Eggs', 'recipes': 1},
+                {'id': salt.id, 'name': 'Salt', 'recipes': 2},
+            ]
+        )
+
+    def test_shopping_list_limited_to_user(self):
+        # Test recipes of other users are ignored
+        user_2 = get_user_model().objects.create_user(
+            email='other@email.com',
+            password='12345qwe'
+        )
+        recipe = sample_recipe(user=user_2)
+        recipe.ingredients.add(sample_ingredient(user=user_2))
+        res = self.client.get(SHOPPING_LIST_URL, {'ids': str(recipe.id)})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipes'], 0)
+        self.assertEqual(res.data['ingredients'], [])
+
+    def test_shopping_list_requires_ids(self):
+        # Test the ids parameter is required
+        res = self.client.get(SHOPPING_LIST_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeBatchApiTests(TestCase):
+    """
+    Test the multi-get of recipes by id
+    """
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testbatch@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_batch_keeps_requested_order(self):
+        # Test recipes are returned in the order of the ids
+        recipe_1 = sample_recipe(user=self.user, title='First')
+        recipe_2 = sample_recipe(user=self.user, title='Second')
+        res = self.client.get(
+            BATCH_URL,
+            {'ids': '{},{}'.format(recipe_2.id, recipe_1.id)}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res.data['results'],
+            RecipeSerializer([recipe_2, recipe_1], many=True).data
+        )
+        self.assertEqual(res.data['missing'], [])
+
+    def test_batch_reports_missing_ids(self):
+        # Test unknown ids and recipes of other users are missing
+        user_2 = get_user_model().objects.create_user(
+            email='other@email.com',
+            password='12345qwe'
+        )
+        recipe = sample_recipe(user=self.user)
+        other = sample_recipe(user=user_2)
+        res = self.client.get(
+            BATCH_URL,
+            {'ids': '{},{},{}'.format(recipe.id, other.id, 9999)}
+        )
+
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertEqual(res.data['missing'], [other.id, 9999])
+
+    def test_batch_detail_shape(self):
+        # Test the detail shape nests the tags
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+        res = self.client.get(BATCH_URL, {'ids': recipe.id, 'detail': 1})
+
+        self.assertEqual(
+            res.data['results'],
+            [RecipeDetailSerializer(recipe).data]
+        )
+
+    def test_batch_queries(self):
+        # Test a batch costs one query per relation
+        for index in range(3):
+            recipe = sample_recipe(user=self.user)
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {index}'))
+        ids = ','.join(
+            str(pk) for pk in Recipe.objects.values_list('id', flat=True)
+        )
+
+        # Authentication is forced, so only the recipes, tags, ingredients
+        with self.assertNumQueries(3):
+            self.client.get(BATCH_URL, {'ids': ids})
+
+    @override_settings(RECIPE_BATCH_MAX_IDS=2)
+    def test_batch_limit(self):
+        # Test more ids than the limit are rejected
+        res = self.client.get(BATCH_URL, {'ids': '1,2,3'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeRangeFilterTests(TestCase):
+    """
+    Test the price and time range filters and the ordering
+    """
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testrange@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.quick = sample_recipe(
+            user=self.user, title='Quick', time_minutes=10, price=12.00
+        )
+        self.cheap = sample_recipe(
+            user=self.user, title='Cheap', time_minutes=45, price=4.50
+        )
+        self.slow = sample_recipe(
+            user=self.user, title='Slow', time_minutes=90, price=20.00
+        )
+
+    def _titles(self, params):
+        # Return the titles of the recipes listed with the params
+        res = self.client.get(RECIP_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [recipe['title'] for recipe in res.data]
+
+    def test_filter_by_time(self):
+        # Test recipes are filtered by the time range
+        self.assertEqual(
+            sorted(self._titles({'max_time': 45})),
+            ['Cheap', 'Quick']
+        )
+        self.assertEqual(self._titles({'min_time': 46}), ['Slow'])
+
+    def test_filter_by_price(self):
+        # Test recipes are filtered by the price range
+        self.assertEqual(self._titles({'max_price': '10'}), ['Cheap'])
+        self.assertEqual(
+            self._titles({'min_price': '12.00', 'max_time': 60}),
+            ['Quick']
+        )
+
+    def test_ordering(self):
+        # Test recipes are ordered by the ordering parameter
+        self.assertEqual(
+            self._titles({'ordering': 'price'}),
+            ['Cheap', 'Quick', 'Slow']
+        )
+        self.assertEqual(
+            self._titles({'ordering': '-time_minutes'}),
+            ['Slow', 'Cheap', 'Quick']
+        )
+
+    def test_invalid_parameters(self):
+        # Test invalid numbers and orderings are rejected
+        for params in (
+            {'max_time': 'abc'},
+            {'min_price': 'NaN'},
+            {'ordering': 'title'},
+        ):
+            res = self.client.get(RECIP_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_range_numbers(self):
+        # Test integers the database can't compare are a bad request
+        for params in (
+            {'max_time': '99999999999999999999999'},
+            {'min_time': str(-2 ** 63 - 1)},
+        ):
+            res = self.client.get(RECIP_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(list(params)[0], res.data)
+
+    def test_range_query_uses_index(self):
+        # Test the filtered and ordered query doesn't sort in memory
+        plan = Recipe.objects.filter(
+            user=self.user,
+            time_minutes__lte=30
+        ).order_by('time_minutes', 'id').explain()
+
+        self.assertIn('INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class RecipeIdListFilterTests(TestCase):
+    """
+    Test the parsing and the filtering of the id list parameters
+    """
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testidlist@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.vegan = sample_tag(user=self.user, name='Vegan')
+        self.recipe = sample_recipe(user=self.user, title='Curry')
+        self.recipe.tags.add(self.vegan)
+        sample_recipe(user=self.user, title='Fish and chips')
+
+    def test_invalid_ids(self):
+        # Test malformed id lists are rejected
+        for params in (
+            {'tags': 'abc'},
+            {'tags': '1,-2'},
+            {'tags': '0'},
+            {'ingredients': '1.5'},
+            {'tags': '9' * 19},
+        ):
+            res = self.client.get(RECIP_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        res = self.client.get(SHOPPING_LIST_URL, {'ids': '1,x'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', res.data)
+
+    @override_settings(ID_LIST_MAX_IDS=3)
+    def test_too_many_ids(self):
+        # Test more ids than the limit are rejected
+        res = self.client.get(RECIP_URL, {'tags': '1,2,3,4'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data)
+
+    @override_settings(ID_LIST_INLINE_MAX=10)
+    def test_long_list_single_parameter(self):
+        # Test a long id list is passed as one parameter
+        ids = [self.vegan.id] + list(range(100000, 100500))
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(
+                RECIP_URL,
+                {'tags': ','.join(str(i) for i in ids)}
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [recipe['title'] for recipe in res.data],
+            ['Curry']
+        )
+        self.assertTrue(
+            any('json_each' in query['sql'] for query in queries)
+        )
+
+
+class RecipeExpandApiTests(TestCase):
+    """
+    Test the related objects included by the expand parameter
+    """
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = sample_tag(user=self.user, name='Vegan')
+        self.recipe_1 = sample_recipe(user=self.user, title='Salad')
+        self.recipe_1.tags.add(self.tag)
+        self.recipe_1.ingredients.add(sample_ingredient(user=self.user))
+        self.recipe_2 = sample_recipe(user=self.user, title='Soup')
+        self.recipe_2.tags.add(self.tag)
+
+    def test_list_includes_tags_once(self):
+        # Test a tag shared by the recipes is included once
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIP_URL, {'expand': 'tags'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertEqual(
+            res.data['included'],
+            {'tags': [TagSerializer(self.tag).data]}
+        )
+
+    def test_paginated_list_includes_page_objects(self):
+        # Test only the objects of the page are included
+        res = self.client.get(RECIP_URL, {
+            'expand': 'tags,ingredients',
+            'limit': 1,
+            'ordering': 'price',
+        })
+
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIn('count', res.data)
+        self.assertEqual(len(res.data['included']['tags']), 1)
+
+    def test_retrieve_expand(self):
+        # Test a recipe with its ingredients included
+        res = self.client.get(
+            detail_url(self.recipe_1.id),
+            {'expand': 'ingredients'}
+        )
+
+        self.assertEqual(res.data['result']['id'], self.recipe_1.id)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in
+             res.data['included']['ingredients']],
+            ['Cinnamon']
+        )
+        self.assertNotIn('tags', res.data['included'])
+
+    def test_invalid_expand(self):
+        # Test unknown relations are rejected
+        res = self.client.get(RECIP_URL, {'expand': 'user'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
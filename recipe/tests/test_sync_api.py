@@ -0,0 +1,115 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, Tag, Ingredient
+
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def sample_recipe(user, **params) -> Recipe:
+    # Create and return recipe
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTests(TestCase):
+    """
+    Test unauthenticated access to the sync API
+    """
+
+    def test_login_required(self):
+        # Test login is required to sync
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(SYNC_TOKEN_LAG=0)
+class PrivateSyncApiTests(TestCase):
+    """
+    Test the delta sync API
+    """
+
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create_user(
+            email='test@email.com',
+            password='12345qwe'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_full_sync(self):
+        # Test a sync without token returns everything of the user
+        sample_recipe(user=self.user)
+        Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        user_2 = get_user_model().objects.create_user(
+            email='other@email.com',
+            password='12345qwe'
+        )
+        Tag.objects.create(user=user_2, name='Meat')
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data['recipes']), 1)
+        self.assertEqual(len(res.data['tags']), 1)
+        self.assertEqual(len(res.data['ingredients']), 1)
+        self.assertIn('token', res.data)
+
+    def test_delta_sync_returns_changes_only(self):
+        # Test only the objects changed since the token are returned
+        sample_recipe(user=self.user, title='Unchanged')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self.client.get(SYNC_URL).data['token']
+        recipe = sample_recipe(user=self.user, title='New')
+        tag.name = 'Vegetarian'
+        tag.save()
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(
+            [item['title'] for item in res.data['recipes']],
+            [recipe.title]
+        )
+        self.assertEqual([item['id'] for item in res.data['tags']], [tag.id])
+        self.assertEqual(res.data['ingredients'], [])
+
+    def test_delta_sync_membership_change(self):
+        # Test adding a tag to a recipe returns the recipe
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self.client.get(SYNC_URL).data['token']
+        recipe.tags.add(tag)
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(len(res.data['recipes']), 1)
+        self.assertEqual(res.data['recipes'][0]['tags'], [tag.id])
+
+    def test_delta_sync_deletions(self):
+        # Test deleted objects are reported by id
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self.client.get(SYNC_URL).data['token']
+        recipe_id, tag_id = recipe.id, tag.id
+        recipe.delete()
+        tag.delete()
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(res.data['deleted']['recipes'], [recipe_id])
+        self.assertEqual(res.data['deleted']['tags'], [tag_id])
+
+    def test_invalid_token(self):
+        # Test a malformed token is a bad request
+        res_1 = self.client.get(SYNC_URL, {'since': 'abc'})
+        res_2 = self.client.get(SYNC_URL, {'since': '9' * 20})
+
+        self.assertEqual(res_1.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res_2.status_code, status.HTTP_400_BAD_REQUEST)
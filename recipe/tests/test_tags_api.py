@@ -75,6 +75,15 @@ class PrivateTagsApiTests(TestCase):
 
         self.assertTrue(exists)
 
+    def test_create_existing_tag(self):
+        # Test creating a tag with an existing name returns the tag
+        tag = Tag.objects.create(user=self.user, name='Comfort Food')
+        res = self.client.post(TAGS_URL, {'name': 'comfort  food'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['id'], tag.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
     def test_create_tag_invalid(self):
         # Test create a new tag with invalid payload
         payload = {'name': ''}
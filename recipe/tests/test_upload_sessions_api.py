@@ -0,0 +1,183 @@
+from io import BytesIO, StringIO
+from datetime import timedelta
+import os
+import shutil
+import tempfile
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from core.models import Recipe, UploadSession
+from PIL import Image
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def sessions_url(recipe_id):
+    # Return URL where the upload sessions are created
+    return reverse('recipe:recipe-create-upload-session', args=[recipe_id])
+
+
+def chunk_url(recipe_id, session_id):
+    # Return URL where the byte ranges are uploaded
+    return reverse('recipe:recipe-upload-chunk', args=[recipe_id, session_id])
+
+
+def finalize_url(recipe_id, session_id):
+    # Return URL where the upload is finalized
+    return reverse(
+        'recipe:recipe-finalize-upload',
+        args=[recipe_id, session_id]
+    )
+
+
+def sample_image() -> bytes:
+    # Return the bytes of a JPEG image
+    buffer = BytesIO()
+    Image.new('RGB', (10, 10)).save(buffer, format='JPEG')
+
+    return buffer.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    RECIPE_UPLOAD_TEMP_DIR=os.path.join(MEDIA_ROOT, 'uploads/tmp/')
+)
+class UploadSessionApiTests(TestCase):
+    """
+    Test the resumable image uploads
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email='testupload@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00
+        )
+        self.image = sample_image()
+
+    def _create_session(self):
+        # Start an upload of the sample image
+        res = self.client.post(
+            sessions_url(self.recipe.id),
+            {'filename': 'photo.jpg', 'size': len(self.image)}
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        return res.data['id']
+
+    def _put_range(self, session_id, start, end):
+        # Upload a byte range of the sample image
+        return self.client.put(
+            chunk_url(self.recipe.id, session_id),
+            data=self.image[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.image)}'
+        )
+
+    def test_chunked_upload(self):
+        # Test an image uploaded in two ranges is moved in place
+        session_id = self._create_session()
+        middle = len(self.image) // 2
+        res_1 = self._put_range(session_id, 0, middle - 1)
+        res_2 = self._put_range(session_id, middle, len(self.image) - 1)
+        res = self.client.post(finalize_url(self.recipe.id, session_id))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res_1.data['offset'], middle)
+        self.assertEqual(res_2.data['offset'], len(self.image))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        with open(self.recipe.image.path, 'rb') as image:
+            self.assertEqual(image.read(), self.image)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_stored_name_ignores_client_filename(self):
+        # Test the stored name has no client path and the format extension
+        res = self.client.post(
+            sessions_url(self.recipe.id),
+            {'filename': 'a.x/../../../page.html', 'size': len(self.image)}
+        )
+        session_id = res.data['id']
+        self._put_range(session_id, 0, len(self.image) - 1)
+        self.client.post(finalize_url(self.recipe.id, session_id))
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(res.data['filename'], 'page.html')
+        self.assertRegex(
+            self.recipe.image.name,
+            r'^uploads/recipe/[0-9a-f-]{36}\.jpg$'
+        )
+
+    def test_invalid_filename(self):
+        # Test a filename without base name is rejected
+        res = self.client.post(
+            sessions_url(self.recipe.id),
+            {'filename': '../', 'size': len(self.image)}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_resume_offset(self):
+        # Test the offset to resume from is returned
+        session_id = self._create_session()
+        self._put_range(session_id, 0, 9)
+        res = self.client.get(chunk_url(self.recipe.id, session_id))
+
+        self.assertEqual(res.data['offset'], 10)
+
+    def test_range_after_gap_rejected(self):
+        # Test a range starting after the offset is a conflict
+        session_id = self._create_session()
+        res = self._put_range(session_id, 10, 19)
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 0)
+
+    def test_finalize_incomplete_upload(self):
+        # Test an incomplete upload can't be finalized
+        session_id = self._create_session()
+        self._put_range(session_id, 0, 9)
+        res = self.client.post(finalize_url(self.recipe.id, session_id))
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+
+    def test_session_limited_to_user(self):
+        # Test other users can't write to the session
+        session_id = self._create_session()
+        user_2 = get_user_model().objects.create_user(
+            email='other@email.com',
+            password='12345qwe'
+        )
+        self.client.force_authenticate(user_2)
+        res = self._put_range(session_id, 0, 9)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_clear_abandoned_sessions(self):
+        # Test old sessions and their partial files are deleted
+        session_id = self._create_session()
+        self._put_range(session_id, 0, 9)
+        session = UploadSession.objects.get(id=session_id)
+        UploadSession.objects.filter(id=session_id).update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+        call_command('clear_upload_sessions', stdout=StringIO())
+
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(session.temp_path))
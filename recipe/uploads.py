@@ -0,0 +1,78 @@
+"""
+Resumable chunked uploads of recipe images.
+
+A session is created with the size of the file, byte ranges are then PUT
+with a Content-Range header and written straight to a partial file, the
+finalize step moves the complete file in place atomically.
+"""
+import os
+import re
+from django.core.files.storage import default_storage
+from core.models import recipe_image_file_path
+from recipe import images
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """
+    Invalid chunk or session state
+    """
+
+
+def parse_content_range(header, size):
+    # Return the (start, length) of a Content-Range header
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('A "Content-Range: bytes start-end/size" header '
+                          'is required.')
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError('The Content-Range is out of the upload size.')
+
+    return start, end - start + 1
+
+
+def write_chunk(session, stream, start, length):
+    # Write a byte range to the partial file, return the bytes written
+    os.makedirs(os.path.dirname(session.temp_path), exist_ok=True)
+    mode = 'r+b' if os.path.exists(session.temp_path) else 'wb'
+    written = 0
+    with open(session.temp_path, mode) as part:
+        part.seek(start)
+        while written < length and stream is not None:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+        # A retried range drops whatever was written after it
+        part.truncate(start + written)
+
+    return written
+
+
+def verify_image(path):
+    # Check the header of the complete file, return its Pillow format
+    with open(path, 'rb') as image:
+        try:
+            return images.probe_image(image)
+        except images.InvalidImage as exc:
+            raise UploadError(str(exc))
+
+
+def move_into_place(session, image_format):
+    # Move the complete file to the recipe images, return its storage name
+    # The extension comes from the format, never from the client filename
+    name = recipe_image_file_path(
+        session.recipe,
+        f'image.{images.EXTENSIONS[image_format]}'
+    )
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(session.temp_path, path)
+
+    return name
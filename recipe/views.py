@@ -1,21 +1,74 @@
+from datetime import datetime
+from datetime import timedelta
+from decimal import Decimal
+from decimal import InvalidOperation
+from django.conf import settings
+from django.db.models import Count
+from django.db.models import prefetch_related_objects
+from django.db.models import Sum
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import viewsets
 from rest_framework import mixins
 from rest_framework import status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from core import events
+from core import groupcommit
+from core import idlists
+from core import media
+from core import throttling
+from core.authentication import SignedTokenAuthentication
+from core.sharding import UserShardMixin
+from core.singleflight import SingleFlightMixin
+from core.throttling import AdmissionControlMixin
 from core.models import Tag
 from core.models import Ingredient
 from core.models import Recipe
+from core.models import Tombstone
+from core.models import UploadSession
+from recipe import cards
+from recipe import images
+from recipe.pagination import CountedLimitOffsetPagination
 from recipe import serializers
+from recipe import uploads
 
 
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
+# Query parameter, lookup and type of the recipe range filters
+RANGE_FILTERS = (
+    ('min_price', 'price__gte', Decimal),
+    ('max_price', 'price__lte', Decimal),
+    ('min_time', 'time_minutes__gte', int),
+    ('max_time', 'time_minutes__lte', int),
+)
+
+# Range of the integers the databases compare, a 64-bit signed integer
+MIN_INTEGER = -2 ** 63
+MAX_INTEGER = 2 ** 63 - 1
+
+ORDERING_FIELDS = ('price', '-price', 'time_minutes', '-time_minutes')
+
+# Relations of the expand parameter, with the serializer of their objects
+EXPANDABLE_FIELDS = {
+    'tags': serializers.TagSerializer,
+    'ingredients': serializers.IngredientSerializer,
+}
+
+UUID_PATTERN = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+
+
+class BaseRecipeAttrViewSet(UserShardMixin, SingleFlightMixin, AdmissionControlMixin, viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
     """
     ViewSet base
     """
-    authentication_classes = (TokenAuthentication,)
+    admission_scope = 'recipe_attr'
+    pagination_class = CountedLimitOffsetPagination
+    authentication_classes = (TokenAuthentication, SignedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
@@ -33,9 +86,24 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixi
 
         return self.queryset.filter(user=self.request.user).order_by('-name')
 
+    def create(self, request, *args, **kwargs):
+        # Return the existing object of the name with a 200
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        if not serializer.created:
+            return Response(serializer.data)
+        headers = self.get_success_headers(serializer.data)
+
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED,
+            headers=headers
+        )
+
     def perform_create(self, serializer):
         # Crate new tag
-        serializer.save(user=self.request.user)
+        groupcommit.save(serializer, user=self.request.user)
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -44,6 +112,7 @@ class TagViewSet(BaseRecipeAttrViewSet):
     """
     queryset = Tag.objects.all()
     serializer_class = serializers.TagSerializer
+    count_field = 'tags'
 
 
 class IngredientViewSet(BaseRecipeAttrViewSet):
@@ -52,38 +121,144 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     """
     queryset = Ingredient.objects.all()
     serializer_class = serializers.IngredientSerializer
+    count_field = 'ingredients'
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(UserShardMixin, SingleFlightMixin, AdmissionControlMixin, viewsets.ModelViewSet):
     """
     Manage recipes in the DB
     """
+    admission_scope = 'recipe'
+    pagination_class = CountedLimitOffsetPagination
+    count_field = 'recipes'
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (TokenAuthentication, SignedTokenAuthentication)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
         # Return objects for the authenticated user
         return self.queryset.filter(user=self.request.user)
 
+    def get_admission_scope(self):
+        # Image uploads have their own in-flight limit
+        if self.action in ('upload_image', 'create_upload_session',
+                           'upload_chunk', 'finalize_upload'):
+            return 'upload'
+
+        return self.admission_scope
+
     def get_serializer_class(self):
         # Return appropriated serializer class
         if self.action == 'retrieve':
             return serializers.RecipeDetailSerializer
-        elif self.action == 'upload_image':
+        elif self.action in ('upload_image', 'finalize_upload'):
             return serializers.RecipeImageSerializer
+        elif self.action in ('create_upload_session', 'upload_chunk'):
+            return serializers.UploadSessionSerializer
 
         return self.serializer_class
 
+    def list(self, request, *args, **kwargs):
+        expand = self._get_expand()
+        if expand:
+            return self._list_expanded(expand)
+        # Serve the stored cards of the recipes when they are enabled
+        if not self._serve_cards():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values_list('pk', flat=True)
+        page = self.paginate_queryset(queryset)
+        recipe_ids = list(queryset) if page is None else page
+        results = cards.encode_list(cards.get_cards(recipe_ids, 'summary'))
+        if page is None:
+            return cards.EncodedResponse(results)
+
+        envelope = self.get_paginated_response([]).data
+        return cards.EncodedResponse(
+            cards.encode_envelope(envelope, results)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        expand = self._get_expand()
+        if not expand:
+            return super().retrieve(request, *args, **kwargs)
+
+        recipe = self.get_object()
+        prefetch_related_objects([recipe], 'tags', 'ingredients')
+        serializer = serializers.RecipeSerializer(
+            recipe,
+            context=self.get_serializer_context()
+        )
+
+        return Response({
+            'result': serializer.data,
+            'included': self._get_included([recipe], expand),
+        })
+
+    def _list_expanded(self, expand):
+        # List the recipes with their related objects included once
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(
+            'tags', 'ingredients'
+        )
+        page = self.paginate_queryset(queryset)
+        recipes = list(queryset) if page is None else page
+        results = self.get_serializer(recipes, many=True).data
+        included = self._get_included(recipes, expand)
+        if page is None:
+            return Response({'results': results, 'included': included})
+
+        response = self.get_paginated_response(results)
+        response.data['included'] = included
+        return response
+
+    def _get_expand(self):
+        # Return the relations of the expand parameter
+        expand = self.request.query_params.get('expand')
+        if not expand:
+            return []
+        fields = list(dict.fromkeys(expand.split(',')))
+        if not set(fields) <= set(EXPANDABLE_FIELDS):
+            raise ValidationError({'expand': [
+                f'Must be a list of {", ".join(EXPANDABLE_FIELDS)}.'
+            ]})
+
+        return fields
+
+    def _get_included(self, recipes, expand):
+        # Return the distinct prefetched related objects of the recipes
+        included = {}
+        for field in expand:
+            objects = {}
+            for recipe in recipes:
+                for obj in getattr(recipe, field).all():
+                    objects[obj.pk] = obj
+            included[field] = EXPANDABLE_FIELDS[field](
+                sorted(objects.values(), key=lambda obj: obj.pk),
+                many=True
+            ).data
+
+        return included
+
     def perform_create(self, serializer):
         # Create a new recipe
-        serializer.save(user=self.request.user)
+        groupcommit.save(serializer, user=self.request.user)
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         # Upload images to recipe
         recipe = self.get_object()
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > settings.RECIPE_IMAGE_MAX_SIZE + 64 * 1024:
+            # Refuse before Django reads the body
+            return Response(
+                {'image': ['The file is too large.']},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
         serializer = self.get_serializer(
             recipe,
             data=request.data
@@ -91,6 +266,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
             serializer.save()
+            images.schedule_strip_metadata(recipe.image)
+            events.publish_change(
+                request.user.pk, events.IMAGE_READY, 'recipe', recipe.pk
+            )
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -101,9 +280,303 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    def _params_to_ints(self, qs):
-        # Parse ids string list to integer list
-        return [int(str_id) for str_id in qs.split(',')]
+    @action(methods=['GET'], detail=True, url_path='image')
+    def image_variant(self, request, pk=None):
+        # Serve the recipe image, resized with the w, h and fmt parameters
+        recipe = self.get_object()
+        if not recipe.image:
+            raise NotFound('The recipe has no image.')
+
+        params = request.query_params
+        if not any(param in params for param in ('w', 'h', 'fmt')):
+            return media.serve_file(request, recipe.image.path)
+
+        max_size = max(settings.RECIPE_IMAGE_SIZES)
+        dimensions = []
+        for param in ('w', 'h'):
+            try:
+                value = int(params.get(param, max_size))
+            except ValueError:
+                value = 0
+            if not 0 < value <= max_size:
+                raise ValidationError({param: [
+                    f'Must be an integer between 1 and {max_size}.'
+                ]})
+            dimensions.append(images.snap_size(value))
+        fmt = params.get('fmt', 'jpeg')
+        if fmt not in images.FORMATS:
+            raise ValidationError({'fmt': [
+                f'Must be one of {", ".join(images.FORMATS)}.'
+            ]})
+
+        try:
+            path = images.find_variant(recipe.image, *dimensions, fmt)
+            if path is None:
+                # Renders count as uploads, the cached variants are free
+                key = throttling.acquire_slot(request, 'upload')
+                try:
+                    path = images.get_variant(recipe.image, *dimensions, fmt)
+                finally:
+                    throttling.release_slot(key)
+        except images.InvalidImage as exc:
+            raise NotFound(str(exc))
+
+        # A variant path always holds the same rendering
+        return media.serve_file(
+            request,
+            path,
+            content_type=images.FORMATS[fmt][1],
+            immutable=True
+        )
+
+    @action(methods=['POST'], detail=True, url_path='upload-sessions')
+    def create_upload_session(self, request, pk=None):
+        # Start a resumable upload of the recipe image
+        recipe = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+
+        if serializer.is_valid():
+            serializer.save(user=request.user, recipe=recipe)
+            return Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED
+            )
+
+        return Response(
+            serializer.errors,
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    @action(
+        methods=['GET', 'PUT'],
+        detail=True,
+        url_path=f'upload-sessions/(?P<session_id>{UUID_PATTERN})'
+    )
+    def upload_chunk(self, request, pk=None, session_id=None):
+        # Return the offset to resume from or write a byte range
+        session = self._get_upload_session(pk, session_id)
+        if request.method == 'PUT':
+            try:
+                start, length = uploads.parse_content_range(
+                    request.META.get('HTTP_CONTENT_RANGE'),
+                    session.size
+                )
+            except uploads.UploadError as exc:
+                return Response(
+                    {'detail': str(exc)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if start > session.offset:
+                return Response(
+                    self.get_serializer(session).data,
+                    status=status.HTTP_409_CONFLICT
+                )
+            written = uploads.write_chunk(
+                session,
+                request.stream,
+                start,
+                length
+            )
+            session.offset = start + written
+            session.save(update_fields=['offset', 'updated_at'])
+
+        return Response(
+            self.get_serializer(session).data,
+            status=status.HTTP_200_OK
+        )
+
+    @action(
+        methods=['POST'],
+        detail=True,
+        url_path=f'upload-sessions/(?P<session_id>{UUID_PATTERN})/finalize'
+    )
+    def finalize_upload(self, request, pk=None, session_id=None):
+        # Move a complete upload in place as the recipe image
+        session = self._get_upload_session(pk, session_id)
+        if session.offset != session.size:
+            return Response(
+                {'detail': 'The upload is incomplete.',
+                 'offset': session.offset},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            image_format = uploads.verify_image(session.temp_path)
+        except uploads.UploadError as exc:
+            session.delete()
+            return Response(
+                {'image': [str(exc)]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        recipe = session.recipe
+        recipe.image.name = uploads.move_into_place(session, image_format)
+        recipe.save(update_fields=['image', 'updated_at'])
+        session.delete()
+        images.schedule_strip_metadata(recipe.image)
+        events.publish_change(
+            request.user.pk, events.IMAGE_READY, 'recipe', recipe.pk
+        )
+
+        return Response(
+            self.get_serializer(recipe).data,
+            status=status.HTTP_200_OK
+        )
+
+    def _get_upload_session(self, pk, session_id):
+        # Return an upload session of the authenticated user
+        return get_object_or_404(
+            UploadSession.objects.select_related('recipe'),
+            pk=session_id,
+            recipe_id=pk,
+            user=self.request.user
+        )
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        # Aggregate the ingredients of several recipes in a shopping list
+        ids = request.query_params.get('ids')
+        if not ids:
+            return Response(
+                {'ids': ['This query parameter is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipes = idlists.filter_in(
+            Recipe.objects.filter(user=request.user),
+            'id',
+            self._params_to_ints(ids, 'ids')
+        )
+        ingredients = Recipe.ingredients.through.objects.filter(
+            recipe__in=recipes
+        ).values(
+            'ingredient_id', 'ingredient__name'
+        ).annotate(
+            recipes=Count('recipe_id')
+        ).order_by('ingredient__name')
+        totals = recipes.aggregate(
+            recipes=Count('id'),
+            total_price=Sum('price'),
+            total_time_minutes=Sum('time_minutes')
+        )
+        serializer = serializers.ShoppingListSerializer({
+            'recipes': totals['recipes'],
+            'ingredients': ingredients,
+            'total_price': totals['total_price'] or 0,
+            'total_time_minutes': totals['total_time_minutes'] or 0,
+        })
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=False, url_path='batch')
+    def batch(self, request):
+        # Return several recipes by id, in the requested order
+        ids = request.query_params.get('ids')
+        if not ids:
+            return Response(
+                {'ids': ['This query parameter is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipe_ids = self._params_to_ints(
+            ids,
+            'ids',
+            max_ids=settings.RECIPE_BATCH_MAX_IDS
+        )
+
+        detail = request.query_params.get('detail') in ('1', 'true')
+        if self._serve_cards():
+            return self._batch_cards(recipe_ids, detail)
+
+        recipes = Recipe.objects.filter(
+            user=request.user
+        ).prefetch_related('tags', 'ingredients').in_bulk(recipe_ids)
+        if detail:
+            serializer_class = serializers.RecipeDetailSerializer
+        else:
+            serializer_class = serializers.RecipeSerializer
+        serializer = serializer_class(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context()
+        )
+
+        return Response({
+            'results': serializer.data,
+            'missing': [pk for pk in recipe_ids if pk not in recipes],
+        }, status=status.HTTP_200_OK)
+
+    def _serve_cards(self):
+        # Cards hold JSON, the other renderers need the serializers
+        return (
+            cards.is_enabled()
+            and self.request.accepted_renderer.format == 'json'
+        )
+
+    def _batch_cards(self, recipe_ids, detail):
+        # Return the batch from the stored cards of the recipes
+        found = set(Recipe.objects.filter(
+            user=self.request.user,
+            pk__in=recipe_ids
+        ).values_list('pk', flat=True))
+        found_ids = [pk for pk in recipe_ids if pk in found]
+        results = cards.encode_list(cards.get_cards(
+            found_ids,
+            'detail' if detail else 'summary'
+        ))
+        envelope = {'missing': [pk for pk in recipe_ids if pk not in found]}
+
+        return cards.EncodedResponse(
+            cards.encode_envelope(envelope, results),
+            status=status.HTTP_200_OK
+        )
+
+    def _params_to_ints(self, qs, name, max_ids=None):
+        # Parse ids string list to integer list, a 400 when invalid
+        return idlists.parse_id_list(qs, name, max_ids)
+
+    def _param_to_number(self, name, cast):
+        # Parse a numeric query parameter, None when it is missing
+        value = self.request.query_params.get(name)
+        if value is None or value == '':
+            return None
+        try:
+            number = cast(value)
+        except (ValueError, InvalidOperation):
+            number = None
+        if number is None or (cast is Decimal and not number.is_finite()):
+            raise ValidationError({name: ['A valid number is required.']})
+        if cast is int and not MIN_INTEGER <= number <= MAX_INTEGER:
+            raise ValidationError({name: [
+                f'Ensure this value is between {MIN_INTEGER} and '
+                f'{MAX_INTEGER}.'
+            ]})
+
+        return number
+
+    def _filter_ranges(self, queryset):
+        # Filter recipes by the price and time ranges of the query
+        for param, lookup, cast in RANGE_FILTERS:
+            value = self._param_to_number(param, cast)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+
+        return queryset
+
+    def _order(self, queryset):
+        # Order by the ordering parameter, the id breaks the ties
+        ordering = self.request.query_params.get('ordering')
+        if not ordering:
+            # Without ORDER BY the rows may come in any order, the pages of
+            # the limit/offset pagination would overlap or skip recipes
+            return queryset.order_by('id')
+        if ordering not in ORDERING_FIELDS:
+            raise ValidationError({'ordering': [
+                f'Must be one of {", ".join(ORDERING_FIELDS)}.'
+            ]})
+
+        # Same direction as the field, so the (user, field) index is used
+        # for the whole ordering
+        tie_breaker = '-id' if ordering.startswith('-') else 'id'
+
+        return queryset.order_by(ordering, tie_breaker)
 
     def get_queryset(self):
         # Get recipes to the authenticated user
@@ -111,10 +584,95 @@ class RecipeViewSet(viewsets.ModelViewSet):
         ingredients = self.request.query_params.get('ingredients')
         queryset = self.queryset
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            tag_ids = self._params_to_ints(tags, 'tags')
+            queryset = idlists.filter_in(queryset, 'tags__id', tag_ids)
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            ingredient_ids = self._params_to_ints(ingredients, 'ingredients')
+            queryset = idlists.filter_in(
+                queryset,
+                'ingredients__id',
+                ingredient_ids
+            )
+        queryset = self._filter_ranges(queryset)
+
+        return self._order(queryset.filter(user=self.request.user))
+
+
+class RecipeImageFileView(UserShardMixin, APIView):
+    """
+    Serve a stored recipe image to the owner of its recipe
+    """
+    authentication_classes = (TokenAuthentication, SignedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, name):
+        # Serve the image once the recipe of the user is found
+        recipe = Recipe.objects.filter(
+            user=request.user,
+            image=f'uploads/recipe/{name}'
+        ).only('image').first()
+        if recipe is None:
+            raise NotFound('Image not found.')
+
+        return media.serve_file(request, recipe.image.path)
+
+
+class SyncView(UserShardMixin, APIView):
+    """
+    Return the recipes, tags and ingredients changed since a sync token
+    """
+    authentication_classes = (TokenAuthentication, SignedTokenAuthentication)
+    permission_classes = (IsAuthenticated,)
+
+    def _token_to_datetime(self, token):
+        # Parse a sync token, None means a full sync
+        if not token:
+            return None
+        try:
+            return datetime.fromtimestamp(0, timezone.utc) + timedelta(
+                microseconds=int(token)
+            )
+        except (ValueError, OverflowError):
+            raise ValidationError({'since': ['Invalid sync token.']})
+
+    def _datetime_to_token(self, value):
+        # Encode a datetime as a sync token
+        delta = value - datetime.fromtimestamp(0, timezone.utc)
+
+        return str(delta // timedelta(microseconds=1))
+
+    def get(self, request):
+        # Return the changes since the token, or everything without a token
+        since = self._token_to_datetime(request.query_params.get('since'))
+        # Transactions still in flight commit rows older than now, the lag
+        # makes the next sync send them again rather than miss them
+        token = timezone.now() - timedelta(seconds=settings.SYNC_TOKEN_LAG)
+        recipes = Recipe.objects.filter(
+            user=request.user
+        ).prefetch_related('tags', 'ingredients').order_by('id')
+        tags = Tag.objects.filter(user=request.user).order_by('id')
+        ingredients = Ingredient.objects.filter(
+            user=request.user
+        ).order_by('id')
+        deleted = {'recipes': [], 'tags': [], 'ingredients': []}
+        if since is not None:
+            recipes = recipes.filter(updated_at__gte=since)
+            tags = tags.filter(updated_at__gte=since)
+            ingredients = ingredients.filter(updated_at__gte=since)
+            tombstones = Tombstone.objects.filter(
+                user=request.user,
+                deleted_at__gte=since
+            ).order_by('id').values_list('model', 'object_id')
+            for model, object_id in tombstones:
+                deleted[f'{model}s'].append(object_id)
 
-        return queryset.filter(user=self.request.user)
+        return Response({
+            'token': self._datetime_to_token(token),
+            'recipes': serializers.RecipeSerializer(recipes, many=True).data,
+            'tags': serializers.TagSerializer(tags, many=True).data,
+            'ingredients': serializers.IngredientSerializer(
+                ingredients,
+                many=True
+            ).data,
+            'deleted': deleted,
+        }, status=status.HTTP_200_OK)
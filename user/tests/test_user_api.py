@@ -1,5 +1,6 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -7,6 +8,15 @@ from rest_framework import status
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
+REVOKE_URL = reverse('user:token-revoke')
+
+SIGNED_TOKENS = {
+    'ENABLED': True,
+    'MAX_AGE': 60,
+    'CACHE': 'default',
+    'USER_CACHE_TIMEOUT': 60,
+    'REVOKED_CACHE_TIMEOUT': 60,
+}
 
 
 def create_user(**params):
@@ -150,3 +160,70 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@override_settings(SIGNED_TOKENS=SIGNED_TOKENS)
+class SignedTokenApiTests(TestCase):
+    """
+    Test the authentication with signed tokens
+    """
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = create_user(
+            email='test@email.com',
+            password='123qwe',
+            name='Test Name'
+        )
+        self.client = APIClient()
+        res = self.client.post(TOKEN_URL, {
+            'email': 'test@email.com',
+            'password': '123qwe'
+        })
+        self.token = res.data['signed_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_login_issues_both_tokens(self):
+        # Test the login returns the legacy and the signed token
+        res = self.client.post(TOKEN_URL, {
+            'email': 'test@email.com',
+            'password': '123qwe'
+        })
+
+        self.assertIn('token', res.data)
+        self.assertIn('signed_token', res.data)
+        self.assertIn('signed_token_expires', res.data)
+
+    def test_authenticate_without_queries(self):
+        # Test a signed token is validated from the cache
+        self.client.get(ME_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_tampered_token(self):
+        # Test a modified token is rejected
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}x')
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_token(self):
+        # Test a revoked token is rejected
+        res = self.client.post(REVOKE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_user(self):
+        # Test the token of a deactivated user is rejected
+        self.client.get(ME_URL)
+        self.user.is_active = False
+        self.user.save()
+        res = self.client.get(ME_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,13 +1,22 @@
 from user.serializers import UserSerializer, AuthTokenSerializer
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
-from rest_framework import generics, authentication, permissions
+from rest_framework.views import APIView
+from rest_framework import generics, authentication, permissions, status
+from core.authentication import SignedTokenAuthentication
+from core.authentication import is_enabled as signed_tokens_enabled
+from core.authentication import issue_token
+from core.authentication import revoke_token
+from core.throttling import AdmissionControlMixin
 
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(AdmissionControlMixin, generics.CreateAPIView):
     """
     Create a new user
     """
+    admission_scope = 'user'
     serializer_class = UserSerializer
 
 
@@ -18,13 +27,45 @@ class CreateTokenView(ObtainAuthToken):
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        # Return the database token, and a signed token when enabled
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, _ = Token.objects.get_or_create(user=user)
+        data = {'token': token.key}
+        if signed_tokens_enabled():
+            data['signed_token'], data['signed_token_expires'] = (
+                issue_token(user)
+            )
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+        return Response(data)
+
+
+class RevokeTokenView(APIView):
+    """
+    Revoke the signed token of the request
+    """
+    authentication_classes = (SignedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        # Revoke the token until its expiry
+        revoke_token(request.auth)
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ManageUserView(AdmissionControlMixin, generics.RetrieveUpdateAPIView):
     """
     Manage the authenticated user
     """
+    admission_scope = 'user'
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (
+        authentication.TokenAuthentication,
+        SignedTokenAuthentication
+    )
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):